@@ -0,0 +1,105 @@
+"""Benchmark for collating raw uploads of each log type, comparing collate_entry on each
+raw entry with collate_batch on the whole upload.
+
+The per_entry column includes building the table of the collated entries, which
+collate_batch returns.
+
+Usage: PYTHONPATH=src python benchmark/bench_collate_batch.py
+"""
+
+import datetime
+import random
+import time
+
+from app_collator import AppCollator
+from call_collator import CallCollator
+from contacts_collator import ContactsCollator
+from parquet import dicts_to_table
+from sms_collator import SmsCollator
+
+ENTRIES_COUNT = 50000
+
+
+def call_entry(randomizer, item_id):
+    return {
+        "cached_name": randomizer.choice([None, "Deno", "Amina Wanjiru"]),
+        "call_type": str(randomizer.randint(1, 7)),
+        "datetime": str(1466176793178 + item_id * 1000),
+        "duration": str(randomizer.randint(0, 600)),
+        "item_id": item_id,
+        "phone_number": f"+254 7{randomizer.randint(0, 99999999):08d}",
+    }
+
+
+def sms_entry(randomizer, item_id):
+    return {
+        "contact_id": randomizer.randint(0, 500),
+        "datetime": 1487722326477 + item_id * 1000,
+        "item_id": item_id,
+        "message_body": "Jambo people " * randomizer.randint(1, 10),
+        "sms_address": f"+254 7{randomizer.randint(0, 99999999):08d}",
+        "sms_type": randomizer.randint(1, 6),
+        "thread_id": randomizer.randint(0, 500),
+    }
+
+
+def contacts_entry(randomizer, item_id):
+    return {
+        "display_name": "Deno",
+        "item_id": item_id,
+        "last_time_contacted": 1510590105792 + item_id,
+        "phone_numbers": [
+            {
+                "item_id": item_id * 10,
+                "normalized_phone_number": "+254729477015",
+                "phone_number": "(072) 947-7015",
+            }
+        ],
+        "photo_id": str(item_id),
+        "times_contacted": randomizer.randint(0, 50),
+    }
+
+
+def app_entry(randomizer, item_id):
+    return {"package_name": f"Com.Example.App {item_id}"}
+
+
+COLLATORS = [
+    (CallCollator, call_entry),
+    (SmsCollator, sms_entry),
+    (ContactsCollator, contacts_entry),
+    (AppCollator, app_entry),
+]
+
+
+def main():
+    print(f"{'collator':>16} {'entries':>8} {'per_entry':>9} {'batch':>9}")
+    for collator_class, raw_entry in COLLATORS:
+        randomizer = random.Random(0)
+        raw_entries = [raw_entry(randomizer, i) for i in range(ENTRIES_COUNT)]
+        collator = collator_class(
+            None, None, None, 123, "456", datetime.datetime(2020, 1, 1), False
+        )
+
+        start = time.perf_counter()
+        collated_entries = []
+        for raw in raw_entries:
+            collated_entry = {"user_id": 123, "device_id": "456", "is_deleted": False}
+            if collator.collate_entry(collated_entry, raw):
+                collated_entries.append(collated_entry)
+        expected = dicts_to_table(collated_entries, collator.schema)
+        per_entry_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        collated = collator.collate_batch(raw_entries)
+        batch_seconds = time.perf_counter() - start
+
+        assert collated.equals(expected)
+        print(
+            f"{collator_class.__name__:>16} {len(raw_entries):>8}"
+            f" {per_entry_seconds:>9.3f} {batch_seconds:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
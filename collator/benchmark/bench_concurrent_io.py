@@ -0,0 +1,94 @@
+"""Benchmark for wall-clock time of collations of a small upload on top of a history of
+SMS logs, with S3 requests simulated to take a fixed latency plus the time to transfer
+their bytes, comparing running the S3 requests of a collation one after another with
+overlapping them.
+
+Usage: PYTHONPATH=src python benchmark/bench_concurrent_io.py
+"""
+
+import datetime
+import json
+import time
+
+from bench_delta_segments import KEY, upload
+from bench_ranged_reads import existing_logs
+from memory_s3 import MemoryS3Client
+from parquet import TableStreamWriter, dicts_to_table
+from sms_collator import SmsCollator
+
+S3_BUCKET = "benchmark"
+HISTORY_SIZES = [10000, 50000]
+DIFF_SIZE = 1000
+COLLATIONS_COUNT = 5
+# Time to first byte, and throughput of a single request
+LATENCY_SECONDS = 0.03
+BYTES_PER_SECOND = 50 * 1024 * 1024
+DIFF_KEY = "collated_logs/diff/sms_log/ts_update=2023-09-01/user=100/logs.parquet"
+
+
+class SlowS3Client(MemoryS3Client):
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        result = super(SlowS3Client, self).get_object(Bucket, Key, Range, **kwargs)
+        time.sleep(LATENCY_SECONDS + result["ContentLength"] / BYTES_PER_SECOND)
+        return result
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        time.sleep(LATENCY_SECONDS + len(Body) / BYTES_PER_SECOND)
+        return super(SlowS3Client, self).put_object(Bucket, Key, Body, **kwargs)
+
+
+def parquet(logs):
+    out = TableStreamWriter(SmsCollator.SCHEMA)
+    out.write(dicts_to_table(logs, SmsCollator.SCHEMA))
+    return out.close().to_pybytes()
+
+
+def run(history, diff, concurrent_io, projection):
+    s3_client = SlowS3Client()
+    MemoryS3Client.put_object(s3_client, Bucket=S3_BUCKET, Key=KEY, Body=history)
+    # Changes of earlier collations of the day
+    MemoryS3Client.put_object(s3_client, Bucket=S3_BUCKET, Key=DIFF_KEY, Body=diff)
+    for collation in range(COLLATIONS_COUNT):
+        MemoryS3Client.put_object(
+            s3_client,
+            Bucket=S3_BUCKET,
+            Key=f"uploads/users/100/unknown/1/sms_log/{collation}",
+            Body=json.dumps(upload(collation)),
+        )
+
+    start = time.perf_counter()
+    for collation in range(COLLATIONS_COUNT):
+        collator = SmsCollator(
+            s3_client,
+            S3_BUCKET,
+            f"uploads/users/100/unknown/1/sms_log/{collation}",
+            100,
+            "1",
+            datetime.datetime(2023, 9, 1) + datetime.timedelta(minutes=collation),
+            True,
+            projection=projection,
+            concurrent_io=concurrent_io,
+        )
+        collator.collate()
+    return time.perf_counter() - start
+
+
+def main():
+    print(
+        f"{'rows':>8} {'projection':>10} {'io':>10} {'seconds':>8}"
+        f" {'ms_per_collation':>16}"
+    )
+    diff = parquet(existing_logs(DIFF_SIZE))
+    for size in HISTORY_SIZES:
+        history = parquet(existing_logs(size))
+        for projection in [False, True]:
+            for io, concurrent_io in [("sequential", False), ("concurrent", True)]:
+                seconds = run(history, diff, concurrent_io, projection)
+                print(
+                    f"{size:>8} {str(projection):>10} {io:>10} {seconds:>8.3f}"
+                    f" {seconds * 1000 / COLLATIONS_COUNT:>16.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark for bytes written and time taken by collations of small uploads on top of a
+large history of SMS logs, comparing rewriting the current file on each collation with
+appending delta segments that are merged once MAX_DELTA_SEGMENTS of them are written.
+
+Usage: PYTHONPATH=src python benchmark/bench_delta_segments.py
+"""
+
+import datetime
+import json
+import time
+
+from bench_ranged_reads import existing_logs
+from memory_s3 import MemoryS3Client
+from parquet import TableStreamWriter, dicts_to_table
+from sms_collator import SmsCollator
+
+S3_BUCKET = "benchmark"
+KEY = "collated_logs/current/sms_log/user=100/logs.parquet"
+HISTORY_SIZES = [10000, 100000]
+COLLATIONS_COUNT = 20
+UPLOAD_SIZE = 10
+MAX_DELTA_SEGMENTS = 8
+
+
+class CountingS3Client(MemoryS3Client):
+    def __init__(self):
+        super(CountingS3Client, self).__init__()
+        self.bytes_written_count = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.bytes_written_count += len(Body)
+        return super(CountingS3Client, self).put_object(Bucket, Key, Body, **kwargs)
+
+
+def upload(collation):
+    return [
+        {
+            "message_body": f"New message {collation} {item_id}",
+            "thread_id": 1,
+            "sms_type": 1,
+            "contact_id": 0,
+            "datetime": 1693526400000 + collation * 1000,
+            "sms_address": f"+254 7{item_id:08d}",
+            "item_id": 10000000 + collation * UPLOAD_SIZE + item_id,
+        }
+        for item_id in range(UPLOAD_SIZE)
+    ]
+
+
+def run(history, delta_segments):
+    s3_client = CountingS3Client()
+    s3_client.put_object(Bucket=S3_BUCKET, Key=KEY, Body=history)
+    for collation in range(COLLATIONS_COUNT):
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=f"uploads/users/100/unknown/1/sms_log/{collation}",
+            Body=json.dumps(upload(collation)),
+        )
+    s3_client.bytes_written_count = 0
+
+    start = time.perf_counter()
+    for collation in range(COLLATIONS_COUNT):
+        collator = SmsCollator(
+            s3_client,
+            S3_BUCKET,
+            f"uploads/users/100/unknown/1/sms_log/{collation}",
+            100,
+            "1",
+            datetime.datetime(2023, 9, 1) + datetime.timedelta(minutes=collation),
+            False,
+            projection=True,
+            diff_parts=True,
+            delta_segments=delta_segments,
+            max_delta_segments=MAX_DELTA_SEGMENTS,
+        )
+        collator.collate()
+    seconds = time.perf_counter() - start
+    return s3_client.bytes_written_count, seconds
+
+
+def main():
+    print(
+        f"{'rows':>8} {'mode':>7} {'written_kb':>11} {'kb_per_collation':>16}"
+        f" {'seconds':>8}"
+    )
+    for size in HISTORY_SIZES:
+        out = TableStreamWriter(SmsCollator.SCHEMA)
+        out.write(dicts_to_table(existing_logs(size), SmsCollator.SCHEMA))
+        history = out.close().to_pybytes()
+        for mode, delta_segments in [("rewrite", False), ("deltas", True)]:
+            bytes_written, seconds = run(history, delta_segments)
+            print(
+                f"{size:>8} {mode:>7} {bytes_written // 1024:>11}"
+                f" {bytes_written // 1024 // COLLATIONS_COUNT:>16} {seconds:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Benchmark for S3 requests, bytes read and written and wall-clock time of collations of
+small uploads on top of a long history, comparing the full current file with current
+files partitioned by month. S3 requests are simulated to take a fixed latency plus the
+time to transfer their bytes, and the txt file is written by every collation, with and
+without concurrent_io. Calls are uploaded as the whole call log with a few new calls in
+the last month, and SMS logs only as the new ones. Only the partitions that receive rows
+are rewritten, and only those whose logs may have changed are read. Users are kept in
+the full current file below MIN_PARTITIONED_LOGS logs, as by default in the lambda.
+
+Usage: PYTHONPATH=src:benchmark python benchmark/bench_partitions.py
+"""
+
+import datetime
+import json
+import time
+
+from bench_concurrent_io import LATENCY_SECONDS, SlowS3Client
+from botocore.exceptions import ClientError
+from call_collator import CallCollator
+from memory_s3 import MemoryS3Client
+from sms_collator import SmsCollator
+
+S3_BUCKET = "benchmark"
+HISTORY_MONTHS = [12, 24, 48]
+LOGS_PER_MONTH = 500
+MIN_PARTITIONED_LOGS = 24000
+COLLATIONS_COUNT = 10
+RUNS_COUNT = 4
+UPLOAD_SIZE = 10
+START_MS = 1451606400000
+MONTH_MS = 30 * 86400 * 1000
+
+
+class CountingS3Client(SlowS3Client):
+    def __init__(self):
+        super(CountingS3Client, self).__init__()
+        self.requests_count = 0
+        self.bytes_read_count = 0
+        self.bytes_written_count = 0
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.requests_count += 1
+        try:
+            result = super(CountingS3Client, self).get_object(
+                Bucket, Key, Range, **kwargs
+            )
+        except ClientError:
+            # Requests for missing objects take the latency as well
+            time.sleep(LATENCY_SECONDS)
+            raise
+        self.bytes_read_count += result["ContentLength"]
+        return result
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.requests_count += 1
+        self.bytes_written_count += len(Body)
+        return super(CountingS3Client, self).put_object(Bucket, Key, Body, **kwargs)
+
+    def list_objects_v2(self, **kwargs):
+        time.sleep(LATENCY_SECONDS)
+        self.requests_count += 1
+        return super(CountingS3Client, self).list_objects_v2(**kwargs)
+
+
+def call(item_id, datetime_ms):
+    return {
+        "cached_name": f"Contact {item_id % 50}",
+        "call_type": str(item_id % 3 + 1),
+        "datetime": str(datetime_ms),
+        "duration": str(item_id % 600),
+        "item_id": item_id,
+        "phone_number": f"+254 7{item_id % 1000:08d}",
+    }
+
+
+def sms(item_id, datetime_ms):
+    return {
+        "thread_id": item_id % 50,
+        "sms_type": item_id % 2 + 1,
+        "contact_id": 0,
+        "datetime": datetime_ms,
+        "sms_address": f"+254 7{item_id % 1000:08d}",
+        "item_id": item_id,
+        "message_body": f"Message {item_id} " * 5,
+    }
+
+
+def history(log, months):
+    return [
+        log(item_id, START_MS + item_id * MONTH_MS // LOGS_PER_MONTH)
+        for item_id in range(months * LOGS_PER_MONTH)
+    ]
+
+
+def collate(
+    s3_client, collator_class, collation, raw_entries, partitioned, concurrent_io
+):
+    raw_file_key = f"uploads/users/100/unknown/1/logs/{collation}"
+    # Uploads are not counted, nor slowed down
+    MemoryS3Client.put_object(
+        s3_client, Bucket=S3_BUCKET, Key=raw_file_key, Body=json.dumps(raw_entries)
+    )
+    collator = collator_class(
+        s3_client,
+        S3_BUCKET,
+        raw_file_key,
+        100,
+        "1",
+        datetime.datetime(2023, 9, 1) + datetime.timedelta(minutes=collation),
+        True,
+        projection=True,
+        diff_parts=True,
+        partitioned=partitioned,
+        min_partitioned_logs=MIN_PARTITIONED_LOGS,
+        concurrent_io=concurrent_io,
+    )
+    collator.collate()
+
+
+def run(collator_class, log, months, partitioned, concurrent_io):
+    s3_client = CountingS3Client()
+    raw_entries = history(log, months)
+    # The history is written to the current file, and moved to partitions by the next
+    # collation if it has enough logs
+    for collation in [-1, 0]:
+        collate(
+            s3_client,
+            collator_class,
+            collation,
+            raw_entries,
+            partitioned,
+            concurrent_io,
+        )
+    s3_client.requests_count = 0
+    s3_client.bytes_read_count = 0
+    s3_client.bytes_written_count = 0
+
+    start = time.perf_counter()
+    for collation in range(1, COLLATIONS_COUNT + 1):
+        last_ms = START_MS + months * MONTH_MS
+        new_entries = [
+            log(
+                months * LOGS_PER_MONTH + collation * UPLOAD_SIZE + item_id,
+                last_ms + collation * 1000 + item_id,
+            )
+            for item_id in range(UPLOAD_SIZE)
+        ]
+        # The whole call log is uploaded, and only the new SMS logs
+        if collator_class is CallCollator:
+            raw_entries = raw_entries + new_entries
+        else:
+            raw_entries = new_entries
+        collate(
+            s3_client,
+            collator_class,
+            collation,
+            raw_entries,
+            partitioned,
+            concurrent_io,
+        )
+    seconds = time.perf_counter() - start
+    return s3_client, seconds
+
+
+def main():
+    print(
+        f"{'log_type':>9} {'months':>7} {'layout':>11} {'concurrent_io':>13}"
+        f" {'requests':>9} {'read_kb':>8} {'written_kb':>11} {'seconds':>8}"
+    )
+    for log_type, collator_class, log in [
+        ("call_log", CallCollator, call),
+        ("sms_log", SmsCollator, sms),
+    ]:
+        for months in HISTORY_MONTHS:
+            for concurrent_io in [False, True]:
+                layouts = [("full", False), ("partitioned", True)]
+                s3_clients = {}
+                runs = {layout: [] for layout, _ in layouts}
+                # The layouts are run in turn, in alternating order, and the fastest
+                # run of each has the least noise
+                for run_index in range(RUNS_COUNT):
+                    order = reversed(layouts) if run_index % 2 else layouts
+                    for layout, partitioned in order:
+                        s3_clients[layout], seconds = run(
+                            collator_class, log, months, partitioned, concurrent_io
+                        )
+                        runs[layout].append(seconds)
+                for layout, _ in layouts:
+                    s3_client = s3_clients[layout]
+                    seconds = min(runs[layout])
+                    print(
+                        f"{log_type:>9} {months:>7} {layout:>11}"
+                        f" {str(concurrent_io):>13}"
+                        f" {s3_client.requests_count // COLLATIONS_COUNT:>9}"
+                        f" {s3_client.bytes_read_count // 1024 // COLLATIONS_COUNT:>8}"
+                        f" {s3_client.bytes_written_count // 1024 // COLLATIONS_COUNT:>11}"
+                        f" {seconds / COLLATIONS_COUNT:>8.3f}"
+                    )
+    print("Requests, kilobytes and seconds per collation")
+
+
+if __name__ == "__main__":
+    main()
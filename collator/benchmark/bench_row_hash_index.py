@@ -0,0 +1,96 @@
+"""Benchmark for new log ingestion against an existing user history.
+
+Ingest time should grow linearly with the upload size for every row hash index.
+
+Usage: PYTHONPATH=src python benchmark/bench_row_hash_index.py
+"""
+
+import datetime
+import json
+import time
+
+from memory_s3 import MemoryS3Client
+from parquet import writer
+from row_hash_index import ROW_HASH_INDEXES
+from sms_collator import SmsCollator
+
+S3_BUCKET = "benchmark"
+USER_ID = 100
+DEVICE_ID = "1"
+EXISTING_SIZE = 50000
+UPLOAD_SIZES = [5000, 10000, 20000, 40000]
+TS_UPDATED = datetime.datetime(2023, 9, 1)
+
+
+def raw_sms(item_id):
+    return {
+        "message_body": f"Message number {item_id}",
+        "thread_id": item_id % 50,
+        "sms_type": 1,
+        "contact_id": 0,
+        "datetime": 1600000000000 + item_id * 1000,
+        "sms_address": f"+254 7{item_id:08d}",
+        "item_id": item_id,
+    }
+
+
+def existing_logs(size):
+    logs = []
+    for item_id in range(size):
+        collated_entry = {
+            "user_id": USER_ID,
+            "device_id": DEVICE_ID,
+            "is_deleted": False,
+        }
+        SmsCollator.collate_entry(collated_entry, raw_sms(item_id))
+        collated_entry["ts_updated"] = TS_UPDATED
+        logs.append(collated_entry)
+    return logs
+
+
+def time_ingest(s3_client, upload_size, kind):
+    raw_file_key = f"uploads/users/{USER_ID}/unknown/{DEVICE_ID}/sms_log/{upload_size}"
+    # Half of the upload is already stored, the other half is new
+    first_item_id = EXISTING_SIZE - upload_size // 2
+    raw_entries = [raw_sms(first_item_id + i) for i in range(upload_size)]
+    s3_client.put_object(
+        Bucket=S3_BUCKET, Key=raw_file_key, Body=json.dumps(raw_entries)
+    )
+
+    collator = SmsCollator(
+        s3_client,
+        S3_BUCKET,
+        raw_file_key,
+        USER_ID,
+        DEVICE_ID,
+        TS_UPDATED,
+        False,
+        row_hash_index=kind,
+    )
+    collator._retrieve_existing_entries()
+    start = time.perf_counter()
+    collator._process_new_logs(collator.raw_file_key)
+    return time.perf_counter() - start
+
+
+def main():
+    s3_client = MemoryS3Client()
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=SmsCollator.CURRENT_COLLATED_LOGS_KEY.format("sms_log", USER_ID),
+        Body=writer(existing_logs(EXISTING_SIZE)).to_pybytes(),
+    )
+
+    print(f"{EXISTING_SIZE} existing logs")
+    print(f"{'index':>8} {'upload':>8} {'seconds':>8} {'us/entry':>9}")
+    for kind in ROW_HASH_INDEXES:
+        for upload_size in UPLOAD_SIZES:
+            seconds = time_ingest(s3_client, upload_size, kind)
+            print(
+                f"{kind:>8} {upload_size:>8} {seconds:>8.3f}"
+                f" {seconds / upload_size * 1e6:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
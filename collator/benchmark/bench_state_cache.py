@@ -0,0 +1,88 @@
+"""Benchmark for time taken and bytes read by back-to-back collations of small uploads on
+top of a large history of SMS logs, comparing reading the current file from S3 on every
+collation with reading it from a local cache of the files written by the previous
+collation.
+
+Usage: PYTHONPATH=src python benchmark/bench_state_cache.py
+"""
+
+import datetime
+import json
+import tempfile
+import time
+
+from bench_delta_segments import KEY, upload
+from bench_ranged_reads import existing_logs
+from memory_s3 import MemoryS3Client
+from parquet import TableStreamWriter, dicts_to_table
+from sms_collator import SmsCollator
+from state_cache import StateCache
+
+S3_BUCKET = "benchmark"
+HISTORY_SIZES = [10000, 100000]
+COLLATIONS_COUNT = 10
+
+
+class CountingS3Client(MemoryS3Client):
+    def __init__(self):
+        super(CountingS3Client, self).__init__()
+        self.bytes_read_count = 0
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        result = super(CountingS3Client, self).get_object(Bucket, Key, Range, **kwargs)
+        self.bytes_read_count += result["ContentLength"]
+        return result
+
+
+def run(history, state_cache):
+    s3_client = CountingS3Client()
+    s3_client.put_object(Bucket=S3_BUCKET, Key=KEY, Body=history)
+    for collation in range(COLLATIONS_COUNT):
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=f"uploads/users/100/unknown/1/sms_log/{collation}",
+            Body=json.dumps(upload(collation)),
+        )
+
+    start = time.perf_counter()
+    for collation in range(COLLATIONS_COUNT):
+        collator = SmsCollator(
+            s3_client,
+            S3_BUCKET,
+            f"uploads/users/100/unknown/1/sms_log/{collation}",
+            100,
+            "1",
+            datetime.datetime(2023, 9, 1) + datetime.timedelta(minutes=collation),
+            False,
+            projection=True,
+            diff_parts=True,
+            state_cache=state_cache,
+        )
+        collator.collate()
+    seconds = time.perf_counter() - start
+    return s3_client.bytes_read_count, seconds
+
+
+def main():
+    print(
+        f"{'rows':>8} {'mode':>7} {'read_kb':>8} {'seconds':>8}"
+        f" {'ms_per_collation':>16}"
+    )
+    for size in HISTORY_SIZES:
+        out = TableStreamWriter(SmsCollator.SCHEMA)
+        out.write(dicts_to_table(existing_logs(size), SmsCollator.SCHEMA))
+        history = out.close().to_pybytes()
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, state_cache in [
+                ("s3", None),
+                ("cache", StateCache(directory, 1024 * 1024 * 1024)),
+            ]:
+                bytes_read, seconds = run(history, state_cache)
+                print(
+                    f"{size:>8} {mode:>7} {bytes_read // 1024:>8} {seconds:>8.3f}"
+                    f" {seconds * 1000 / COLLATIONS_COUNT:>16.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,23 +5,14 @@ call schema
 
 import hashlib
 import json
-import logging
 import re
 
+import pyarrow as pa
 from base_collator import BaseCollator
-from ddtrace import patch
+from batch_hashing import hash_columns, str_column
+from collator_logging import get_logger
 
-patch(logging=True)
-
-FORMAT = (
-    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
-    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
-    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
-)
-
-logging.basicConfig(format=FORMAT)
-LOGGER = logging.getLogger(__name__)
-LOGGER.setLevel(logging.INFO)
+LOGGER = get_logger(__name__)
 
 
 class CallCollator(BaseCollator):
@@ -35,7 +26,33 @@ class CallCollator(BaseCollator):
         "duration",  # int
     ]
 
-    SCHEMA = SCHEMA_RAW + BaseCollator.BASE_SCHEMA
+    SCHEMA = pa.schema(
+        [
+            pa.field("cached_name", pa.string()),
+            pa.field("call_type", pa.string()),
+            pa.field("item_id", pa.int64()),
+            pa.field("phone_number", pa.string()),
+            pa.field("normalized_phone_number", pa.string()),
+            pa.field("datetime", pa.timestamp("ns")),
+            pa.field("duration", pa.int64()),
+        ]
+        + BaseCollator.BASE_SCHEMA
+    )
+
+    # Fields hashed by compute_row_hash, in order
+    ROW_HASH_FIELDS = [
+        "id",
+        "cached_name",
+        "call_type",
+        "normalized_phone_number",
+        "duration",
+        "is_deleted",
+    ]
+
+    DICTIONARY_FIELDS = BaseCollator.DICTIONARY_FIELDS + ["call_type"]
+
+    # Current logs can be partitioned by the month of their datetime
+    PARTITION_BY = "month"
 
     REQUIRED_FIELDS_TXT = [
         "cached_name",
@@ -67,6 +84,7 @@ class CallCollator(BaseCollator):
         device_id,
         ts_updated,
         write_txt,
+        **kwargs,
     ):
         super(CallCollator, self).__init__(
             s3_client,
@@ -77,6 +95,7 @@ class CallCollator(BaseCollator):
             ts_updated,
             "call_log",
             write_txt,
+            **kwargs,
         )
 
     # This function creates collated version of all relevant raw fields, and calculates
@@ -127,6 +146,64 @@ class CallCollator(BaseCollator):
         collated_entry["row_hash"] = CallCollator.compute_row_hash(collated_entry)
         return True
 
+    def collate_batch(self, raw_entries):
+        self._log_unexpected_fields(raw_entries)
+        raw_entries = [
+            raw_entry for raw_entry in raw_entries if raw_entry["phone_number"]
+        ]
+        num_rows = len(raw_entries)
+        cached_names = BaseCollator.raw_column(raw_entries, "cached_name")
+        call_types = BaseCollator.resolve_column(
+            BaseCollator.raw_column(raw_entries, "call_type"),
+            CallCollator._resolve_call_type,
+        )
+        item_ids = [raw_entry["item_id"] for raw_entry in raw_entries]
+        phone_numbers = [raw_entry["phone_number"] for raw_entry in raw_entries]
+        normalized_phone_numbers = BaseCollator.normalize_address_column(phone_numbers)
+        datetimes = BaseCollator.parse_datetime_column(
+            [int(raw_entry["datetime"]) for raw_entry in raw_entries]
+        )
+        durations = [
+            None if duration is None else int(duration)
+            for duration in BaseCollator.raw_column(raw_entries, "duration")
+        ]
+        ids = pa.array(
+            hash_columns(
+                [
+                    pa.scalar(str(self.user_id)),
+                    pa.scalar(self.device_id),
+                    str_column(datetimes),
+                    str_column(item_ids),
+                    phone_numbers,
+                ]
+            ),
+            pa.string(),
+        )
+        row_hashes = hash_columns(
+            [
+                ids,
+                cached_names,
+                call_types,
+                normalized_phone_numbers,
+                durations,
+                pa.scalar(False),
+            ]
+        )
+        return self._batch_table(
+            {
+                "cached_name": cached_names,
+                "call_type": call_types,
+                "item_id": item_ids,
+                "phone_number": phone_numbers,
+                "normalized_phone_number": normalized_phone_numbers,
+                "datetime": datetimes,
+                "duration": durations,
+                "id": ids,
+                "row_hash": row_hashes,
+            },
+            num_rows,
+        )
+
     @staticmethod
     def compute_row_hash(entry):
         return hashlib.md5(
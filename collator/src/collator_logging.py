@@ -0,0 +1,23 @@
+"""Logging setup shared by the modules of the collator, done once when first imported"""
+
+import logging
+
+from ddtrace import patch
+
+# Log records carry the ids of the trace and span they are logged in
+patch(logging=True)
+
+FORMAT = (
+    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
+    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
+    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
+)
+
+logging.basicConfig(format=FORMAT)
+
+
+def get_logger(name):
+    """Returns the logger of the given name, logging from the INFO level"""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    return logger
@@ -6,22 +6,13 @@ contact schema
 import ast
 import hashlib
 import json
-import logging
 
+import pyarrow as pa
 from base_collator import BaseCollator
-from ddtrace import patch
+from batch_hashing import hash_columns, str_column
+from collator_logging import get_logger
 
-patch(logging=True)
-
-FORMAT = (
-    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
-    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
-    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
-)
-
-logging.basicConfig(format=FORMAT)
-LOGGER = logging.getLogger(__name__)
-LOGGER.setLevel(logging.INFO)
+LOGGER = get_logger(__name__)
 
 
 class ContactsCollator(BaseCollator):
@@ -34,10 +25,39 @@ class ContactsCollator(BaseCollator):
         "phone_numbers",  # str
     ]
 
-    SCHEMA = SCHEMA_RAW + BaseCollator.BASE_SCHEMA
+    SCHEMA = pa.schema(
+        [
+            pa.field("display_name", pa.string()),
+            pa.field("item_id", pa.int64()),
+            pa.field("last_time_contacted", pa.timestamp("ns")),
+            pa.field("photo_id", pa.string()),
+            pa.field("times_contacted", pa.int64()),
+            pa.field("phone_numbers", pa.string()),
+        ]
+        + BaseCollator.BASE_SCHEMA
+    )
+
+    # Fields hashed by compute_row_hash, in order
+    ROW_HASH_FIELDS = [
+        "id",
+        "display_name",
+        "last_time_contacted",
+        "times_contacted",
+        "photo_id",
+        "phone_numbers",
+        "is_deleted",
+    ]
 
     REQUIRED_FIELDS_TXT = ["display_name", "item_id", "phone_numbers"]
 
+    # txt logs only contain logs from the device being collated, and leave out logs
+    # that were ever deleted
+    TXT_DEVICE_ONLY = True
+    TXT_EXCLUDES_DELETED_IDS = True
+
+    # Current logs can be partitioned by the device they were collated from
+    PARTITION_BY = "device"
+
     def __init__(
         self,
         s3_client,
@@ -47,6 +67,7 @@ class ContactsCollator(BaseCollator):
         device_id,
         ts_updated,
         write_txt,
+        **kwargs,
     ):
         super(ContactsCollator, self).__init__(
             s3_client,
@@ -57,6 +78,7 @@ class ContactsCollator(BaseCollator):
             ts_updated,
             "contact_list",
             write_txt,
+            **kwargs,
         )
 
     # This function creates collated version of all relevant raw fields, and calculates
@@ -108,6 +130,60 @@ class ContactsCollator(BaseCollator):
         collated_entry["row_hash"] = ContactsCollator.compute_row_hash(collated_entry)
         return True
 
+    def collate_batch(self, raw_entries):
+        self._log_unexpected_fields(raw_entries)
+        num_rows = len(raw_entries)
+        display_names = BaseCollator.raw_column(raw_entries, "display_name")
+        last_times_contacted = BaseCollator.parse_datetime_column(
+            [
+                None if raw_dt is None else int(raw_dt)
+                for raw_dt in BaseCollator.raw_column(
+                    raw_entries, "last_time_contacted"
+                )
+            ]
+        )
+        photo_ids = BaseCollator.raw_column(raw_entries, "photo_id")
+        times_contacted = BaseCollator.raw_column(raw_entries, "times_contacted")
+        item_ids = [raw_entry["item_id"] for raw_entry in raw_entries]
+        phone_numbers = [
+            None if numbers is None else json.dumps(numbers)
+            for numbers in BaseCollator.raw_column(raw_entries, "phone_numbers")
+        ]
+        ids = pa.array(
+            hash_columns(
+                [
+                    pa.scalar(str(self.user_id)),
+                    pa.scalar(self.device_id),
+                    str_column(item_ids),
+                ]
+            ),
+            pa.string(),
+        )
+        row_hashes = hash_columns(
+            [
+                ids,
+                display_names,
+                last_times_contacted,
+                times_contacted,
+                photo_ids,
+                phone_numbers,
+                pa.scalar(False),
+            ]
+        )
+        return self._batch_table(
+            {
+                "display_name": display_names,
+                "item_id": item_ids,
+                "last_time_contacted": last_times_contacted,
+                "photo_id": photo_ids,
+                "times_contacted": times_contacted,
+                "phone_numbers": phone_numbers,
+                "id": ids,
+                "row_hash": row_hashes,
+            },
+            num_rows,
+        )
+
     @staticmethod
     def compute_row_hash(entry):
         return hashlib.md5(
@@ -0,0 +1,196 @@
+"""Reading of the current collated logs of users stored in partitions. With
+partitioned, the current logs of each user are split into one file per partition, such
+as the month of the datetime of SMS and call logs or the device of app packages and
+contacts, and collations only rewrite the partitions they add logs to. Readers merge the
+partitions of a user back into a single view, or read only some of them such as
+device=<device_id>.
+
+Month partitions are written along with a summary of the stats of each of them, from
+which collations find the partitions where the logs of their raw files may change, and
+leave the others unread. A partition missing from the summary, or changed since it was
+written, is read and its stats written again"""
+
+import hashlib
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from latest_versions import latest_version_positions
+from parquet import conform_table, hex_hash_columns, read_table_columns
+from s3_file import list_objects
+
+# Same as the prefix of BaseCollator.CURRENT_COLLATED_LOGS_KEY
+PARTITIONS_PREFIX = "collated_logs/current/{}/user={}/"
+PARTITION_FILE_NAME = "logs.parquet"
+
+
+def partition_prefix(log_type, user_id):
+    """Returns the prefix of the partitions of the current logs of a user"""
+    return PARTITIONS_PREFIX.format(log_type, user_id)
+
+
+def partition_keys(s3_client, s3_bucket, log_type, user_id):
+    """Returns the names and keys of the partitions of the current logs of a user,
+    ordered by name"""
+    prefix = partition_prefix(log_type, user_id)
+    partitions = []
+    for content in list_objects(s3_client, s3_bucket, prefix):
+        name, _, file_name = content["Key"][len(prefix) :].rpartition("/")
+        if file_name == PARTITION_FILE_NAME and "=" in name and "/" not in name:
+            partitions.append((name, content["Key"]))
+    return sorted(partitions)
+
+
+def read_partitions(s3_client, s3_bucket, log_type, user_id, schema, names=None):
+    """Returns a table of the current logs of a user, merging all of their partitions
+    or only those with the given names, with the columns and types of the given
+    schema. Users without partitions, such as those with fewer logs than
+    min_partitioned_logs, are read from their current file"""
+    tables = [schema.empty_table()]
+    keys = partition_keys(s3_client, s3_bucket, log_type, user_id)
+    if not keys and names is None:
+        prefix = partition_prefix(log_type, user_id)
+        keys = [
+            (None, content["Key"])
+            for content in list_objects(s3_client, s3_bucket, prefix)
+            if content["Key"] == prefix + PARTITION_FILE_NAME
+        ]
+    for name, key in keys:
+        if names is None or name in names:
+            result = s3_client.get_object(Bucket=s3_bucket, Key=key)
+            tables.append(conform_table(read_table_columns(result["Body"]), schema))
+    return pa.concat_tables(tables)
+
+
+def partition_names(table, partition_by, default_partition):
+    """Returns the name of the partition of each log of a table, as in Hive
+    partitioning, by the month of their datetime or by their device"""
+    if partition_by == "month":
+        names = pc.strftime(table.column("datetime"), format="month=%Y-%m")
+    elif partition_by == "device":
+        device_ids = table.column("device_id")
+        if pa.types.is_dictionary(device_ids.type):
+            device_ids = device_ids.cast(device_ids.type.value_type)
+        names = pc.binary_join_element_wise("device=", device_ids, "")
+    return pc.fill_null(names, f"{partition_by}={default_partition}")
+
+
+def clamped_row_hashes(table, name):
+    """Returns the hex row hashes of the logs of a table in the month partition with
+    the given name whose datetime may have been corrected for the future timestamp
+    issue before they were routed there, as their datetime equals their ts_updated and
+    they are in the partition of that month. The raw logs of these are in the
+    partition of the datetime in their id instead"""
+    clamped = table.filter(
+        pc.and_(
+            pc.fill_null(
+                pc.equal(table.column("datetime"), table.column("ts_updated")), False
+            ),
+            pc.equal(partition_names(table, "month", None), name),
+        )
+    )
+    return hex_hash_columns(clamped.select(["row_hash"])).column("row_hash").to_pylist()
+
+
+def row_hashes_digest(row_hashes):
+    """Returns a digest of a set of hex row hashes, whatever their order"""
+    digest = 0
+    for row_hash in row_hashes:
+        digest ^= int(row_hash, 16)
+    return f"{len(row_hashes)}:{digest:032x}"
+
+
+def partition_stats(keys, etag, clamped):
+    """Returns the stats of a partition from the key fields of its logs: the counts of
+    all and latest versions, the digest of the row hashes of the live logs of each
+    device, and the row hashes of its logs whose datetime may have been corrected"""
+    latest = keys.take(
+        latest_version_positions(keys.column("id"), keys.column("ts_updated"))
+    )
+    live = latest.filter(pc.invert(pc.fill_null(latest.column("is_deleted"), False)))
+    row_hashes = {}
+    for device_id, row_hash in zip(
+        live.column("device_id").to_pylist(), live.column("row_hash").to_pylist()
+    ):
+        row_hashes.setdefault(device_id, set()).add(row_hash)
+    return {
+        "etag": etag,
+        "rows": keys.num_rows,
+        "latest": latest.num_rows,
+        "live": {
+            device_id: row_hashes_digest(device_row_hashes)
+            for device_id, device_row_hashes in row_hashes.items()
+        },
+        "clamped": clamped,
+    }
+
+
+def summary_stats(summary, etags):
+    """Returns the stats by name of the partitions listed with the given ETags by name
+    that are up to date in the summary, which may be None if it is missing, and the
+    names of the others. Partitions written without a summary, or with a summary from
+    before the stats recorded their corrected logs, are not up to date"""
+    entries = summary["partitions"] if summary is not None else {}
+    stats = {}
+    stale = set()
+    for name, etag in etags.items():
+        entry = entries.get(name)
+        if entry is None or entry["etag"] != etag or "clamped" not in entry:
+            stale.add(name)
+        else:
+            stats[name] = entry
+    return stats, stale
+
+
+def changed_partitions(stats, raw_file_row_hashes, device_id, finds_deletions):
+    """Returns the names of the partitions, up to date with the given stats, where the
+    logs of the raw files may change, given the row hashes of the logs of each raw file
+    by partition. A partition where each raw file has exactly the live logs of the
+    device there has no changes, as has one without logs of the raw files unless the
+    logs missing from them are deleted. Partitions with corrected logs that are in the
+    raw files change as well"""
+    names = set()
+    for row_hashes in raw_file_row_hashes:
+        candidates = set(row_hashes)
+        if finds_deletions:
+            candidates.update(stats)
+        for name in candidates:
+            digest = row_hashes_digest(row_hashes[name]) if name in row_hashes else None
+            if digest != stats.get(name, {"live": {}})["live"].get(device_id):
+                names.add(name)
+    raw_row_hashes = set().union(
+        *(
+            partition_row_hashes
+            for row_hashes in raw_file_row_hashes
+            for partition_row_hashes in row_hashes.values()
+        )
+    )
+    for name, partition in stats.items():
+        if not raw_row_hashes.isdisjoint(partition["clamped"]):
+            names.add(name)
+    return names
+
+
+def partitions_summary(stats, txt_key=None, txt_body=None):
+    """Returns the summary of partitions with the given stats by name. The txt file
+    written along with it is read back by the next collation if unchanged, to update
+    its txt logs rather than create them again"""
+    summary = {"partitions": stats}
+    if txt_body is not None:
+        summary["txt"] = {
+            "key": txt_key,
+            "md5": hashlib.md5(txt_body.encode("utf-8")).hexdigest(),
+        }
+    return summary
+
+
+def summary_txt_logs(txt, body):
+    """Returns the txt logs by txt key from the body of the txt file of a summary,
+    given as the txt entry of the summary, or None if it is missing or was written
+    since. The txt logs of month partitions are those of every device, keyed by the
+    datetime and item_id of each log as in create_txt_logs"""
+    if body is None or hashlib.md5(body).hexdigest() != txt["md5"]:
+        return None
+    return {
+        "{}:{}".format(log["datetime"], log["item_id"]): log for log in json.loads(body)
+    }
@@ -0,0 +1,133 @@
+"""Incremental decoding of the JSON array of a raw upload, gzip-compressed or not, one
+element at a time as its bytes are read. Only one chunk of the stream and the element
+being decoded are held in memory, rather than the whole body, its decompressed copy and
+all of its decoded elements"""
+
+import codecs
+import gzip
+import json
+
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+# Characters that may continue a number cut at the end of a chunk
+_NUMBER_CHARS = "0123456789+-.eE"
+_DECODER = json.JSONDecoder()
+
+
+def open_gzip_or_plain(stream):
+    """Returns a stream of the decompressed bytes of a gzip stream, or of the bytes of
+    any other stream"""
+    head = stream.read(len(GZIP_MAGIC))
+    stream = _PrefixedStream(head, stream)
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    return stream
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Yields the elements of the JSON array in a UTF-8 byte stream, reading it a chunk
+    at a time. Raises JSONDecodeError, as json.loads would, once an invalid part of the
+    stream is read"""
+    text = _TextBuffer(stream, chunk_size)
+    if text.next_char() != "[":
+        raise text.error("Expecting '['")
+    text.pos += 1
+    if text.next_char() == "]":
+        text.pos += 1
+    else:
+        while True:
+            yield text.decode_value()
+            char = text.next_char()
+            text.pos += 1
+            if char == "]":
+                break
+            if char != ",":
+                raise text.error("Expecting ',' delimiter", text.pos - 1)
+    if text.next_char() != "":
+        raise text.error("Extra data")
+
+
+class _PrefixedStream:
+    """Stream of the given bytes followed by the rest of another stream"""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b""
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+class _TextBuffer:
+    """Text decoded from a byte stream, read a chunk at a time from the position of the
+    next value. Text before that position is dropped as chunks are read"""
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # Same as json.loads on bytes, which skips a UTF-8 byte order mark
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_chunk(self):
+        # Returns whether there was more text to read
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.text = self.text[self.pos :] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        # Skips whitespace, and returns the next character, or "" at the end
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_chunk():
+                return ""
+
+    def decode_value(self):
+        self.next_char()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # The value may be cut at the end of the chunk
+                if self.read_chunk():
+                    continue
+                raise
+            # A number may continue in the next chunk, as may any value at the end of
+            # the chunk
+            next_pos = end
+            while next_pos < len(self.text) and self.text[next_pos] in _WHITESPACE:
+                next_pos += 1
+            if (
+                next_pos == len(self.text)
+                or (
+                    isinstance(value, (int, float))
+                    and self.text[next_pos] in _NUMBER_CHARS
+                )
+            ) and self.read_chunk():
+                continue
+            self.pos = end
+            return value
+
+    def error(self, message, pos=None):
+        return json.JSONDecodeError(
+            message, self.text, self.pos if pos is None else pos
+        )
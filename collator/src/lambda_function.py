@@ -2,41 +2,175 @@
 is uploaded to /uploads/users/"""
 
 import json
-import logging
 import os
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import boto3
+from botocore.config import Config
 from collator_factory import CollatorFactory
+from collator_logging import get_logger
 from datadog_lambda.metric import lambda_metric
 from ddtrace import patch, tracer
+from state_cache import StateCache
 
-patch(logging=True)
+# Spans of collations run by the executor are children of the span of the handler
+patch(futures=True)
 
-FORMAT = (
-    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
-    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
-    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
-)
-
-logging.basicConfig(format=FORMAT)
-LOGGER = logging.getLogger("collator")
-LOGGER.setLevel(logging.INFO)
+LOGGER = get_logger("collator")
 
 BUCKET_PREFIX = "branch-in-"
 
-VALID_LOG_TYPES = [
-    "sms_log",
-    "call_log",
-    "contact_list",
-    "app_packages",
-]
+VALID_LOG_TYPES = list(CollatorFactory.COLLATORS)
 
 
 # Environment variable controls whether to write collated logs as text files to S3
 WRITE_TXT = os.getenv("WRITE_TXT", default="true").lower() == "true"
 
+# Environment variable sets how many collations of the records of an event run at once.
+# Collations of the same user and log type still run one after another, in the order of
+# their records, and a failed one stops only the later ones of its user and log type.
+# With 1, the records are collated one after another in their order and the first
+# failure stops all the later ones, as before
+COLLATION_WORKERS = int(os.getenv("COLLATION_WORKERS", default="1"))
+
+# Environment variable controls whether consecutive records of an event for the same
+# user, log type and device are collated together, applying their uploads in order to
+# the existing logs read once, and writing the current, diff and txt files once. A
+# failed upload fails the uploads coalesced with it
+COALESCE_UPLOADS = os.getenv("COALESCE_UPLOADS", default="false").lower() == "true"
+
+# Environment variable selects the index used to look up existing row hashes: "hash"
+# (hash set) or "sorted" (sorted array of fixed-width bytes searched with binary search)
+ROW_HASH_INDEX = os.getenv("ROW_HASH_INDEX", default="hash")
+
+# Environment variable controls whether low-cardinality columns such as device_id are
+# written dictionary-encoded to parquet files
+DICTIONARY_ENCODE = os.getenv("DICTIONARY_ENCODE", default="false").lower() == "true"
+
+# Environment variable controls whether only the fields needed to find changes are read
+# from existing collated logs as python objects, with the remaining fields kept as Arrow
+# columns
+COLUMN_PROJECTION = os.getenv("COLUMN_PROJECTION", default="false").lower() == "true"
+
+# Environment variable controls whether existing collated logs are read from S3 one row
+# group at a time, bounding memory by row group size rather than by user history size.
+# This implies COLUMN_PROJECTION
+STREAMING_READ = os.getenv("STREAMING_READ", default="false").lower() == "true"
+
+# Environment variable controls whether raw uploads are collated as columns, with only
+# the new and updated entries converted to python objects
+BATCH_COLLATE = os.getenv("BATCH_COLLATE", default="false").lower() == "true"
+
+# Environment variable controls whether the id and row_hash fields are written to
+# parquet files as 16-byte binaries rather than hex strings. Files written either way
+# can be read in both modes
+BINARY_HASHES = os.getenv("BINARY_HASHES", default="false").lower() == "true"
+
+# Environment variable controls whether each collation writes its changes to a new diff
+# part file rather than rewriting the diff file of the user. Parts are merged into the
+# diff file by diff_parts.compact_diffs before the batch job reads it
+DIFF_PARTS = os.getenv("DIFF_PARTS", default="false").lower() == "true"
+
+# Environment variable controls whether each collation writes its changes to a new delta
+# file next to the current collated logs of the user rather than rewriting them. Deltas
+# are merged into the current file by the first collation after there are
+# MAX_DELTA_SEGMENTS of them or MAX_DELTA_BYTES of them. Readers of the current logs
+# merge the deltas with delta_segments.read_current, and turning this off again requires
+# all deltas to be merged first
+DELTA_SEGMENTS = os.getenv("DELTA_SEGMENTS", default="false").lower() == "true"
+MAX_DELTA_SEGMENTS = int(os.getenv("MAX_DELTA_SEGMENTS", default="8"))
+MAX_DELTA_BYTES = int(os.getenv("MAX_DELTA_BYTES", default=str(8 * 1024 * 1024)))
+
+# Environment variable controls whether the current collated logs of each user are
+# split into a latest file, holding only the most recent version of each log, and
+# append-only history part files of the versions it supersedes. Collations only read
+# and rewrite the latest file, and build txt files from it and from the txt logs of
+# superseded versions it records in its metadata. Users are moved to this layout by
+# their next collation, and latest_history.read_full_view stitches the two back into
+# the full view. This cannot be combined with DELTA_SEGMENTS
+LATEST_HISTORY = os.getenv("LATEST_HISTORY", default="false").lower() == "true"
+
+# Environment variable controls whether the current collated logs of each user are split
+# into partitions, by the month of their datetime for SMS and call logs, so that
+# collations only rewrite the partitions they add logs to. Only the partitions whose
+# logs may change are read, as found from a summary of the partitions written along
+# with them, and those written without it, and the txt file is updated from the one
+# written last. App packages and contacts are partitioned by device instead, and only
+# the partition of the device being collated is read and rewritten. This implies
+# COLUMN_PROJECTION, and users are moved to partitions by their next collation once
+# their current file has MIN_PARTITIONED_LOGS logs, as shorter histories of SMS and call
+# logs are collated faster from a single file. current_partitions.read_partitions merges
+# the partitions of a user. This cannot be combined with DELTA_SEGMENTS or
+# LATEST_HISTORY
+PARTITIONED = os.getenv("PARTITIONED", default="false").lower() == "true"
+MIN_PARTITIONED_LOGS = int(os.getenv("MIN_PARTITIONED_LOGS", default="24000"))
+
+# Environment variable controls whether the existing collated logs read and written by
+# collations are cached in the local storage of warm containers, under STATE_CACHE_DIR,
+# as memory-mapped Arrow IPC files. Cached files are only downloaded again when their
+# ETag changed, and a file missing from the cache is downloaded whole rather than with
+# the ranged reads of STREAMING_READ. The least recently used files are evicted beyond
+# STATE_CACHE_MAX_BYTES, which should stay below the function's ephemeral storage
+STATE_CACHE_ENABLED = os.getenv("STATE_CACHE", default="false").lower() == "true"
+STATE_CACHE_DIR = os.getenv("STATE_CACHE_DIR", default="/tmp/collator_state")
+STATE_CACHE_MAX_BYTES = int(
+    os.getenv("STATE_CACHE_MAX_BYTES", default=str(256 * 1024 * 1024))
+)
+STATE_CACHE = (
+    StateCache(STATE_CACHE_DIR, STATE_CACHE_MAX_BYTES) if STATE_CACHE_ENABLED else None
+)
+
+# Environment variable controls whether current collated logs are written with
+# conditional PUTs on the ETag they were read with, so that collations of the same user
+# running at once cannot overwrite each other's logs. A collation whose write conflicts
+# reads the existing logs again and applies its upload to them, up to
+# MAX_WRITE_ATTEMPTS times. With DELTA_SEGMENTS, deltas are put under the next number
+# in sequence only if it is still missing, and the last delta merged by a compaction is
+# kept to hold its number
+CONDITIONAL_WRITES = os.getenv("CONDITIONAL_WRITES", default="false").lower() == "true"
+MAX_WRITE_ATTEMPTS = int(os.getenv("MAX_WRITE_ATTEMPTS", default="3"))
+
+# Environment variable controls whether each collation overlaps its S3 requests, on up
+# to IO_WORKERS threads: the raw uploads and the diff are downloaded while the existing
+# logs are read, the current file is uploaded while the txt file is created, and the txt
+# file is uploaded while the diff is written. The diff is still only written once the
+# current file is
+CONCURRENT_IO = os.getenv("CONCURRENT_IO", default="false").lower() == "true"
+IO_WORKERS = int(os.getenv("IO_WORKERS", default="4"))
+
+# Environment variables configure the S3 clients, which are created once per region and
+# endpoint and shared by all the collations of a container. The connection pool should
+# have room for the requests of collations running at once, and idle connections are
+# kept alive with TCP keepalive
+S3_MAX_POOL_CONNECTIONS = int(
+    os.getenv(
+        "S3_MAX_POOL_CONNECTIONS",
+        default=str(max(10, COLLATION_WORKERS * (IO_WORKERS + 1))),
+    )
+)
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", default="5"))
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", default="standard")
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", default="60"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", default="60"))
+S3_TCP_KEEPALIVE = os.getenv("S3_TCP_KEEPALIVE", default="true").lower() == "true"
+S3_CLIENTS = {}
+S3_CLIENTS_LOCK = threading.Lock()
+
+# Environment variable lists the log types whose collators are imported while the
+# function is initialized, before the first invocation, rather than by their first
+# collation. Comma-separated, all log types by default and none if empty
+PREWARM_LOG_TYPES = [
+    log_type
+    for log_type in os.getenv(
+        "PREWARM_LOG_TYPES", default=",".join(VALID_LOG_TYPES)
+    ).split(",")
+    if log_type
+]
+CollatorFactory.prewarm(PREWARM_LOG_TYPES)
+
 
 def lambda_handler(event, context):
     """The function that gets triggered by Lambda. Happens for both S3 uploads (normal
@@ -44,6 +178,10 @@ def lambda_handler(event, context):
     needs to be run with more RAM)
     """
 
+    # Collations are grouped by user and log type, and the groups run concurrently. With
+    # a single worker, they all run in the order of their records as one group
+    groups = {}
+    errors = []
     for record in event["Records"]:
         try:
             if "Sns" in record:
@@ -52,55 +190,124 @@ def lambda_handler(event, context):
                 s3_records = message["Records"]
             else:
                 s3_records = [record]
+        except Exception as ex:
+            _log_traceback()
+            errors.append(ex)
+            if COLLATION_WORKERS == 1:
+                # The later records are not collated, as after a failed collation
+                break
+            continue
+
+        for s3_record in s3_records:
+            filename = s3_record["s3"]["object"]["key"]
+            try:
+                _, _, user_id, device_serial, device_id, log_type, _ = filename.split(
+                    "/"
+                )
+            except ValueError:
+                # Doesn't match the file pattern
+                LOGGER.error(
+                    "File uploaded outside of expected directory: %s", filename
+                )
+                continue
+            group = (user_id, log_type) if COLLATION_WORKERS > 1 else None
+            groups.setdefault(group, []).append(
+                (s3_record, user_id, device_id, device_serial, log_type)
+            )
 
+    with ThreadPoolExecutor(max_workers=COLLATION_WORKERS) as executor:
+        futures = [
+            executor.submit(collate_records_in_order, collations)
+            for collations in groups.values()
+        ]
+    # Every failure was logged, and the first one fails the invocation. With a single
+    # worker, a failed collation comes before a record that failed to be read
+    errors = [
+        future.exception() for future in futures if future.exception() is not None
+    ] + errors
+    if errors:
+        raise errors[0]
+
+
+def collate_records_in_order(collations):
+    """Runs the collations of one user and log type, or of all of them with a single
+    worker, in the order of their records. A failed collation stops the ones after it,
+    which would otherwise be applied before it when it is retried"""
+
+    for run in _coalesced_runs(collations):
+        s3_record, user_id, device_id, device_serial, log_type = run[0]
+        try:
             start_time_total = datetime.utcnow()
 
-            log_types = []
-            for s3_record in s3_records:
-                filename = s3_record["s3"]["object"]["key"]
-                try:
-                    _, _, user_id, device_serial, device_id, log_type, _ = (
-                        filename.split("/")
-                    )
-                except ValueError:
-                    # Doesn't match the file pattern
-                    LOGGER.error(
-                        "File uploaded outside of expected directory: %s", filename
-                    )
-                    continue
-
-                span = tracer.current_span()
-                if span:
-                    span.set_tag("info.user_id", user_id)
-                    span.set_tag("info.device_id", device_id)
-
-                collate_logs_for_user(
-                    s3_record, user_id, device_id, device_serial, log_type
-                )
-                log_types.append(log_type)
+            span = tracer.current_span()
+            if span:
+                span.set_tag("info.user_id", user_id)
+                span.set_tag("info.device_id", device_id)
+
+            collate_logs_for_user(
+                s3_record,
+                user_id,
+                device_id,
+                device_serial,
+                log_type,
+                [record for record, *_ in run[1:]],
+            )
 
             seconds_total = (datetime.utcnow() - start_time_total).total_seconds()
 
             LOGGER.info(
                 "Done collating all logs: %s for user: %s on device: %s in %s seconds",
-                ",".join(log_types),
+                log_type,
                 user_id,
                 device_id,
                 seconds_total,
             )
 
         except:
-            for line in traceback.format_exc().split("\n"):
-                LOGGER.error(line)
+            _log_traceback()
             raise
 
 
+def _coalesced_runs(collations):
+    # Splits the collations into runs collated together: with COALESCE_UPLOADS, the
+    # consecutive ones of the same user, log type, device and bucket
+    runs = []
+    previous_source = None
+    for collation in collations:
+        s3_record, user_id, device_id, device_serial, log_type = collation
+        source = (
+            user_id,
+            log_type,
+            device_id,
+            device_serial,
+            s3_record["s3"]["bucket"]["name"],
+        )
+        if COALESCE_UPLOADS and source == previous_source:
+            runs[-1].append(collation)
+        else:
+            runs.append([collation])
+        previous_source = source
+    return runs
+
+
+def _log_traceback():
+    for line in traceback.format_exc().split("\n"):
+        LOGGER.error(line)
+
+
 @tracer.wrap("collate_logs_for_user")
-def collate_logs_for_user(record, user_id, device_id, device_serial, log_type):
-    """Main collation function"""
+def collate_logs_for_user(
+    record, user_id, device_id, device_serial, log_type, coalesced_records=()
+):
+    """Main collation function. The uploads of the coalesced records are applied after
+    the upload of the record, by the same collation"""
 
     LOGGER.info(
-        "Collating %s logs for user: %s on device: %s", log_type, user_id, device_id
+        "Collating %s logs for user: %s on device: %s from %s uploads",
+        log_type,
+        user_id,
+        device_id,
+        1 + len(coalesced_records),
     )
 
     if log_type not in VALID_LOG_TYPES:
@@ -109,10 +316,7 @@ def collate_logs_for_user(record, user_id, device_id, device_serial, log_type):
 
     with tracer.trace("create_s3_client"):
         s3_bucket = record["s3"]["bucket"]["name"]
-        session = boto3.session.Session()
-        s3_client = session.client(
-            "s3", region_name=record["awsRegion"], endpoint_url=os.getenv("S3_ENDPOINT")
-        )
+        s3_client = get_s3_client(record["awsRegion"], os.getenv("S3_ENDPOINT"))
 
     ts_update = datetime.utcnow()
 
@@ -127,6 +331,28 @@ def collate_logs_for_user(record, user_id, device_id, device_serial, log_type):
             device_id,
             ts_update,
             WRITE_TXT,
+            row_hash_index=ROW_HASH_INDEX,
+            dictionary_encode=DICTIONARY_ENCODE,
+            projection=COLUMN_PROJECTION,
+            streaming=STREAMING_READ,
+            batch_collate=BATCH_COLLATE,
+            binary_hashes=BINARY_HASHES,
+            diff_parts=DIFF_PARTS,
+            delta_segments=DELTA_SEGMENTS,
+            max_delta_segments=MAX_DELTA_SEGMENTS,
+            max_delta_bytes=MAX_DELTA_BYTES,
+            latest_history=LATEST_HISTORY,
+            partitioned=PARTITIONED,
+            min_partitioned_logs=MIN_PARTITIONED_LOGS,
+            state_cache=STATE_CACHE,
+            conditional_writes=CONDITIONAL_WRITES,
+            max_write_attempts=MAX_WRITE_ATTEMPTS,
+            concurrent_io=CONCURRENT_IO,
+            io_workers=IO_WORKERS,
+            coalesced_file_keys=[
+                coalesced_record["s3"]["object"]["key"]
+                for coalesced_record in coalesced_records
+            ],
         )
 
     start_time_log = datetime.utcnow()
@@ -163,3 +389,45 @@ def collate_logs_for_user(record, user_id, device_id, device_serial, log_type):
         value=seconds_log,
         tags=[f"log_type:{log_type}"],
     )
+    if collator.conditional_writes:
+        lambda_metric(
+            metric_name="collator.write_attempts",
+            value=collator.write_attempts,
+            tags=[f"log_type:{log_type}"],
+        )
+    if collator.state_cache is not None:
+        lambda_metric(
+            metric_name="collator.state_cache_hits",
+            value=collator.state_cache_hits,
+            tags=[f"log_type:{log_type}"],
+        )
+        lambda_metric(
+            metric_name="collator.state_cache_misses",
+            value=collator.state_cache_misses,
+            tags=[f"log_type:{log_type}"],
+        )
+
+
+def get_s3_client(region_name, endpoint_url):
+    """Returns the S3 client of a region and endpoint, creating it on first use. Clients
+    are safe to share between threads, but sessions are not, so each client has its own
+    session"""
+
+    with S3_CLIENTS_LOCK:
+        s3_client = S3_CLIENTS.get((region_name, endpoint_url))
+        if s3_client is None:
+            session = boto3.session.Session()
+            s3_client = session.client(
+                "s3",
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+                    connect_timeout=S3_CONNECT_TIMEOUT,
+                    read_timeout=S3_READ_TIMEOUT,
+                    tcp_keepalive=S3_TCP_KEEPALIVE,
+                ),
+            )
+            S3_CLIENTS[(region_name, endpoint_url)] = s3_client
+        return s3_client
@@ -0,0 +1,64 @@
+"""Reading of the current collated logs of users stored with the latest/history layout.
+With latest_history, the current file of a user is replaced by a latest file holding
+only the most recent version of each log, and the versions it supersedes are appended
+to part files of a history partition. Readers that need every version stitch the two
+back into the full view of the current file"""
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from base_collator import BaseCollator
+from parquet import conform_table, read_table_columns
+from s3_file import list_objects
+
+PART_PREFIX = "part-"
+
+
+def history_prefix(log_type, user_id):
+    """Returns the prefix of the history part files of a user"""
+    key = BaseCollator.HISTORY_LOGS_PART_KEY.format(log_type, user_id, "")
+    return key[: key.index(PART_PREFIX)]
+
+
+def history_keys(s3_client, s3_bucket, log_type, user_id):
+    """Returns the keys of the history part files of a user, in the order they were
+    written"""
+    prefix = history_prefix(log_type, user_id)
+    return sorted(
+        content["Key"]
+        for content in list_objects(s3_client, s3_bucket, prefix)
+        if content["Key"][len(prefix) :].startswith(PART_PREFIX)
+    )
+
+
+def read_latest(s3_client, s3_bucket, log_type, user_id, schema):
+    """Returns a table of the most recent version of each log of a user, with the
+    columns and types of the given schema"""
+    return conform_table(_read_latest(s3_client, s3_bucket, log_type, user_id), schema)
+
+
+def read_full_view(s3_client, s3_bucket, log_type, user_id, schema):
+    """Returns a table of every version of the logs of a user, as in the current file
+    before the split, with the columns and types of the given schema. Versions are
+    ordered by ts_updated, which only differs from the order of the current file among
+    versions collated at the same time"""
+    tables = []
+    for key in history_keys(s3_client, s3_bucket, log_type, user_id):
+        result = s3_client.get_object(Bucket=s3_bucket, Key=key)
+        tables.append(read_table_columns(result["Body"]))
+    tables.append(_read_latest(s3_client, s3_bucket, log_type, user_id))
+
+    # Sorting is stable, and versions without a ts_updated are the oldest
+    ts_updated = pa.chunked_array(
+        [table.column("ts_updated").cast(pa.timestamp("ns")) for table in tables],
+        pa.timestamp("ns"),
+    )
+    order = pc.sort_indices(ts_updated, null_placement="at_start")
+    return pa.concat_tables(
+        [schema.empty_table()] + [conform_table(table, schema) for table in tables]
+    ).take(order)
+
+
+def _read_latest(s3_client, s3_bucket, log_type, user_id):
+    key = BaseCollator.CURRENT_LATEST_LOGS_KEY.format(log_type, user_id)
+    result = s3_client.get_object(Bucket=s3_bucket, Key=key)
+    return read_table_columns(result["Body"])
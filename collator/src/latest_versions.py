@@ -0,0 +1,42 @@
+"""Vectorized selection of the most recent version of each collated log, equivalent to
+BaseCollator._create_unique_set over Arrow columns"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def latest_version_positions(ids, ts_updated):
+    """Returns the positions of the most recent version of each id, ordered by the
+    first position of each id. As with _create_unique_set, among versions with the same
+    ts_updated the last one wins. Versions without a ts_updated are the oldest"""
+    num_rows = len(ids)
+    if num_rows == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Group versions by id, with nulls in their own group
+    encoded_ids = _combine(ids).dictionary_encode()
+    codes = pc.fill_null(encoded_ids.indices, len(encoded_ids.dictionary))
+    codes = codes.to_numpy(zero_copy_only=False)
+
+    timestamps = pc.fill_null(
+        pc.cast(_combine(ts_updated), pa.int64()), np.iinfo(np.int64).min
+    ).to_numpy(zero_copy_only=False)
+    positions = np.arange(num_rows, dtype=np.int64)
+
+    # Sort by id, then ts_updated, then position, so that the last row of each id
+    # is its most recent version
+    order = np.lexsort((positions, timestamps, codes))
+    sorted_codes = codes[order]
+    group_starts = np.flatnonzero(np.diff(sorted_codes, prepend=-1))
+    group_ends = np.append(group_starts[1:], num_rows) - 1
+
+    latest = order[group_ends]
+    first_positions = np.minimum.reduceat(order, group_starts)
+    return latest[np.argsort(first_positions, kind="stable")]
+
+
+def _combine(array):
+    if isinstance(array, pa.ChunkedArray):
+        return array.combine_chunks()
+    return array
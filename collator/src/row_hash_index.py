@@ -0,0 +1,55 @@
+"""Indexes over the row hashes of existing collated logs. Collation checks every
+collated entry against the existing row hashes, so the lookup must not scan the whole
+user history for each entry"""
+
+import numpy as np
+
+
+class HashSetIndex:
+    """Hash set of row hashes, O(1) lookups"""
+
+    def __init__(self, row_hashes):
+        self._row_hashes = set(row_hashes)
+
+    def __contains__(self, row_hash):
+        return row_hash in self._row_hashes
+
+    def __len__(self):
+        return len(self._row_hashes)
+
+
+class SortedArrayIndex:
+    """Sorted array of row hashes searched with binary search, O(log n) lookups. The
+    row hashes are stored as fixed-width bytes in one numpy array, sorted in place and
+    deduplicated without a hash set, which uses less memory than a hash set of str
+    objects for very large histories at the cost of slower lookups"""
+
+    def __init__(self, row_hashes):
+        self._row_hashes = np.array(list(row_hashes), dtype="S")
+        self._row_hashes.sort()
+        unique = self._row_hashes[1:] != self._row_hashes[:-1]
+        if not unique.all():
+            self._row_hashes = self._row_hashes[np.concatenate(([True], unique))]
+
+    def __contains__(self, row_hash):
+        row_hash = row_hash.encode()
+        index = self._row_hashes.searchsorted(row_hash)
+        return index < len(self._row_hashes) and self._row_hashes[index] == row_hash
+
+    def __len__(self):
+        return len(self._row_hashes)
+
+
+ROW_HASH_INDEXES = {
+    "hash": HashSetIndex,
+    "sorted": SortedArrayIndex,
+}
+
+
+def build_row_hash_index(row_hashes, kind="hash"):
+    """Returns an index of the given row hashes of the requested kind"""
+    try:
+        index_class = ROW_HASH_INDEXES[kind]
+    except KeyError:
+        raise ValueError(f"Unsupported row hash index: '{kind}'")
+    return index_class(row_hashes)
@@ -0,0 +1,145 @@
+"""
+test_coalesced_uploads.py
+Tests that collating several uploads together gives the same collated logs as collating
+them one after another, against the S3 container
+"""
+
+import datetime
+import json
+import os
+
+import boto3
+import pytest
+from app_collator import AppCollator
+from call_collator import CallCollator
+from current_partitions import read_partitions
+from delta_segments import read_current
+from latest_history import read_full_view
+from parquet import conform_table, read_table_columns
+from s3_file import delete_objects, list_objects
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+USER_ID = 104
+TS_UPDATED = datetime.datetime(2023, 9, 1)
+LAYOUTS = {
+    "full": {},
+    "batch": {"batch_collate": True},
+    "projection": {"projection": True},
+    "deltas": {"delta_segments": True},
+    "latest": {"latest_history": True},
+    "partitioned": {"partitioned": True},
+    "concurrent": {"concurrent_io": True},
+    "concurrent_deltas": {"concurrent_io": True, "delta_segments": True},
+}
+
+
+def _call(item_id, duration):
+    return {
+        "cached_name": "Deno",
+        "call_type": "1",
+        "datetime": str(1466176793178 + item_id * 30 * 86400 * 1000),
+        "duration": str(duration),
+        "item_id": item_id,
+        "phone_number": f"+254 7{item_id:08d}",
+    }
+
+
+# Uploads of each log type, with logs updated, deleted and added again by later uploads
+UPLOADS = {
+    "call_log": [
+        [_call(1, 3), _call(2, 3), _call(3, 3)],
+        [_call(1, 3), _call(2, 5)],
+        [_call(1, 3), _call(2, 5), _call(3, 3), _call(4, 3)],
+    ],
+    "app_packages": [
+        [{"package_name": "app.one"}, {"package_name": "app.two"}],
+        [{"package_name": "app.two"}],
+        [{"package_name": "app.one"}, {"package_name": "app.three"}],
+    ],
+}
+COLLATORS = {"call_log": CallCollator, "app_packages": AppCollator}
+
+
+def _reset():
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        [
+            content["Key"]
+            for content in list_objects(S3_CLIENT, S3_BUCKET, "collated_logs/")
+            if f"user={USER_ID}/" in content["Key"]
+            or f"user-{USER_ID}/" in content["Key"]
+        ],
+    )
+
+
+def _raw_file_key(log_type, upload):
+    return f"uploads/users/{USER_ID}/unknown/1/{log_type}/{upload}"
+
+
+def _collate(log_type, uploads, layout):
+    collator = COLLATORS[log_type](
+        S3_CLIENT,
+        S3_BUCKET,
+        _raw_file_key(log_type, uploads[0]),
+        USER_ID,
+        "1",
+        TS_UPDATED,
+        True,
+        coalesced_file_keys=[_raw_file_key(log_type, upload) for upload in uploads[1:]],
+        **LAYOUTS[layout],
+    )
+    collator.collate()
+    return collator
+
+
+def _rows(table):
+    return sorted(json.dumps(row, default=str) for row in table.to_pylist())
+
+
+def _collated_logs(log_type, layout):
+    # The current, diff and txt logs of the user
+    schema = COLLATORS[log_type].SCHEMA
+    if layout == "latest":
+        current = read_full_view(S3_CLIENT, S3_BUCKET, log_type, USER_ID, schema)
+    elif layout == "partitioned":
+        current = read_partitions(S3_CLIENT, S3_BUCKET, log_type, USER_ID, schema)
+    else:
+        key = f"collated_logs/current/{log_type}/user={USER_ID}/logs.parquet"
+        current = read_current(S3_CLIENT, S3_BUCKET, key, schema)
+    result = S3_CLIENT.get_object(
+        Bucket=S3_BUCKET,
+        Key=f"collated_logs/diff/{log_type}/ts_update=2023-09-01/user={USER_ID}"
+        "/logs.parquet",
+    )
+    diff = conform_table(read_table_columns(result["Body"]), schema)
+    result = S3_CLIENT.get_object(
+        Bucket=S3_BUCKET,
+        Key=f"collated_logs/user-{USER_ID}/device-1/collated_{log_type}.txt",
+    )
+    return _rows(current), _rows(diff), result["Body"].read()
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("log_type", list(UPLOADS))
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_coalesced_uploads(log_type, layout):
+    for upload, raw_entries in enumerate(UPLOADS[log_type]):
+        S3_CLIENT.put_object(
+            Bucket=S3_BUCKET,
+            Key=_raw_file_key(log_type, upload),
+            Body=json.dumps(raw_entries),
+        )
+    _reset()
+    _collate(log_type, [0], layout)
+    for upload in range(1, len(UPLOADS[log_type])):
+        _collate(log_type, [upload], layout)
+    sequential = _collated_logs(log_type, layout)
+
+    _reset()
+    _collate(log_type, [0], layout)
+    collator = _collate(log_type, list(range(1, len(UPLOADS[log_type]))), layout)
+    assert collator.new_logs_count + collator.deleted_logs_count > 2
+    assert _collated_logs(log_type, layout) == sequential
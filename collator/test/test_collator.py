@@ -10,6 +10,7 @@ import json
 import os
 
 import boto3
+import lambda_function
 import pandas as pd
 import pytest
 from lambda_function import lambda_handler
@@ -292,7 +293,15 @@ def test_base_collation_additive_entries():
 # This tests that the collated output includes new entries for updates
 # when the raw upload being processed contains old entries with new row hashes
 @pytest.mark.integration
-def test_base_contact_collation_updated_entries():
+@pytest.mark.parametrize("projection", [False, True])
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("batch_collate", [False, True])
+def test_base_contact_collation_updated_entries(
+    monkeypatch, projection, streaming, batch_collate
+):
+    monkeypatch.setattr(lambda_function, "COLUMN_PROJECTION", projection)
+    monkeypatch.setattr(lambda_function, "STREAMING_READ", streaming)
+    monkeypatch.setattr(lambda_function, "BATCH_COLLATE", batch_collate)
     now = datetime.datetime.now()
     diff_key = (
         "collated_logs/diff/contact_list/ts_update={}/user=100/logs.parquet".format(
@@ -366,7 +375,11 @@ def test_base_contact_collation_updated_entries():
 # This tests that the collated output includes new entries for deletions
 # when the raw upload being processed does not contain all currently existing entries
 @pytest.mark.integration
-def test_base_collation_deleted_entries():
+@pytest.mark.parametrize("projection", [False, True])
+@pytest.mark.parametrize("streaming", [False, True])
+def test_base_collation_deleted_entries(monkeypatch, projection, streaming):
+    monkeypatch.setattr(lambda_function, "COLUMN_PROJECTION", projection)
+    monkeypatch.setattr(lambda_function, "STREAMING_READ", streaming)
     key = "collated_logs/current/app_packages/user=100/logs.parquet"
     new_collated_logs = _run_collation_with_reset(
         "test_events/test_collation_deletion_event.json",
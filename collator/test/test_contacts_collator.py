@@ -1,6 +1,7 @@
 import datetime
 
 from contacts_collator import ContactsCollator
+from parquet import dicts_to_table
 
 # Contacts-specific tests
 
@@ -165,3 +166,42 @@ def test_contact_collator_mising_photo_id():
     collated_entry = {"user_id": "123", "device_id": "456", "is_deleted": False}
     ContactsCollator.collate_entry(collated_entry, raw_entry)
     assert collated_entry["photo_id"] is None
+
+
+def test_contacts_collator_batch():
+    raw_entries = [
+        {
+            "display_name": "Deno",
+            "item_id": 201338,
+            "last_time_contacted": 1510590105792,
+            "phone_numbers": [
+                {
+                    "item_id": 417151,
+                    "normalized_phone_number": "+254729477015",
+                    "phone_number": "(072) 947-7015",
+                },
+            ],
+            "photo_id": "417143",
+            "times_contacted": 1,
+        },
+        {"item_id": 201339},
+        {
+            "display_name": "Ünïcode",
+            "item_id": 201340,
+            "last_time_contacted": "1510590105",
+            "photo_id": "417144",
+            "times_contacted": 2,
+        },
+    ]
+    collator = ContactsCollator(
+        None, None, None, 123, "456", datetime.datetime(2020, 1, 1), False
+    )
+    collated_entries = []
+    for raw_entry in raw_entries:
+        collated_entry = {"user_id": 123, "device_id": "456", "is_deleted": False}
+        if ContactsCollator.collate_entry(collated_entry, raw_entry):
+            collated_entries.append(collated_entry)
+    # Batches are collated the same as each entry on its own
+    assert collator.collate_batch(raw_entries).equals(
+        dicts_to_table(collated_entries, collator.schema)
+    )
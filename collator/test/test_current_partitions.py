@@ -0,0 +1,379 @@
+"""
+test_current_partitions.py
+Tests for collations with partitioned current logs, against the S3 container
+"""
+
+import datetime
+import json
+import os
+
+import boto3
+import lambda_function
+import pyarrow as pa
+import pytest
+from base_collator import BaseCollator
+from botocore.exceptions import ClientError
+from call_collator import CallCollator
+from current_partitions import (
+    partition_keys,
+    partition_prefix,
+    read_partitions,
+    summary_stats,
+)
+from lambda_function import lambda_handler
+from s3_file import delete_objects, list_objects
+from sms_collator import SmsCollator
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+USER_ID = 102
+SCHEMA = pa.schema(
+    [pa.field("item_id", pa.int64()), pa.field("is_deleted", pa.bool_())]
+)
+COLLATORS = {"call_log": CallCollator, "sms_log": SmsCollator}
+
+
+def _reset(log_type, user_id):
+    prefix = partition_prefix(log_type, user_id)
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        [content["Key"] for content in list_objects(S3_CLIENT, S3_BUCKET, prefix)],
+    )
+
+
+def _raw_call(item_id, datetime_ms):
+    return {
+        "cached_name": "Deno",
+        "call_type": "1",
+        "datetime": str(datetime_ms),
+        "duration": "3",
+        "item_id": item_id,
+        "phone_number": f"+254 7{item_id:08d}",
+    }
+
+
+def _raw_sms(item_id, datetime_ms):
+    return {
+        "thread_id": 1,
+        "sms_type": 1,
+        "contact_id": 0,
+        "datetime": datetime_ms,
+        "sms_address": "MPESA",
+        "item_id": item_id,
+        "message_body": f"Message {item_id}",
+    }
+
+
+def _collate(
+    upload,
+    raw_entries,
+    log_type="call_log",
+    user_id=USER_ID,
+    write_txt=False,
+    partitioned=True,
+    min_partitioned_logs=0,
+    concurrent_io=False,
+):
+    raw_file_key = f"uploads/users/{user_id}/unknown/1/{log_type}/{upload}"
+    S3_CLIENT.put_object(
+        Bucket=S3_BUCKET, Key=raw_file_key, Body=json.dumps(raw_entries)
+    )
+    collator = COLLATORS[log_type](
+        S3_CLIENT,
+        S3_BUCKET,
+        raw_file_key,
+        user_id,
+        "1",
+        datetime.datetime(2023, 9, 1, upload),
+        write_txt,
+        partitioned=partitioned,
+        min_partitioned_logs=min_partitioned_logs,
+        concurrent_io=concurrent_io,
+    )
+    collator.collate()
+    return collator
+
+
+def _read_txt(log_type, user_id):
+    key = BaseCollator.TXT_LOGS_KEY.format(user_id, "1", log_type)
+    return json.load(S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=key)["Body"])
+
+
+def test_partition_names():
+    collator = CallCollator(
+        None, None, None, USER_ID, "1", datetime.datetime(2020, 1, 1), False
+    )
+    table = pa.table(
+        {
+            "datetime": pa.array(
+                [
+                    datetime.datetime(2016, 6, 17, 15),
+                    None,
+                    datetime.datetime(2017, 1, 1),
+                ],
+                pa.timestamp("ns"),
+            )
+        }
+    )
+    assert collator._partition_names(table).to_pylist() == [
+        "month=2016-06",
+        "month=__HIVE_DEFAULT_PARTITION__",
+        "month=2017-01",
+    ]
+    assert (
+        partition_prefix("call_log", USER_ID)
+        == f"collated_logs/current/call_log/user={USER_ID}/"
+    )
+
+
+def test_summary_stats():
+    stats = {"etag": "a", "rows": 1, "latest": 1, "live": {}, "clamped": []}
+    summary = {
+        "partitions": {
+            "month=2016-06": stats,
+            "month=2016-07": {**stats, "etag": "b"},
+            "month=2016-08": {"etag": "a", "rows": 1, "latest": 1, "live": {}},
+        }
+    }
+    # Partitions changed since the summary, missing from it or without the logs whose
+    # datetime may have been corrected are not up to date
+    etags = {name: "a" for name in ["month=2016-06", "month=2016-07", "month=2016-08"]}
+    etags["month=2016-09"] = "a"
+    assert summary_stats(summary, etags) == (
+        {"month=2016-06": stats},
+        {"month=2016-07", "month=2016-08", "month=2016-09"},
+    )
+    assert summary_stats(None, {"month=2016-06": "a"}) == ({}, {"month=2016-06"})
+
+
+@pytest.mark.parametrize("layout", ["delta_segments", "latest_history"])
+def test_partitioned_layouts(layout):
+    with pytest.raises(ValueError):
+        CallCollator(
+            None,
+            None,
+            None,
+            USER_ID,
+            "1",
+            datetime.datetime(2020, 1, 1),
+            False,
+            partitioned=True,
+            **{layout: True},
+        )
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("concurrent_io", [False, True])
+def test_partitioned_collation(concurrent_io):
+    _reset("call_log", USER_ID)
+    june = 1466176793178
+    july = june + 30 * 86400 * 1000
+    _collate(1, [_raw_call(1, june), _raw_call(2, july)], concurrent_io=concurrent_io)
+    assert [
+        name for name, _ in partition_keys(S3_CLIENT, S3_BUCKET, "call_log", USER_ID)
+    ] == [
+        "month=2016-06",
+        "month=2016-07",
+    ]
+
+    # The deletion of the June call only rewrites its partition
+    july_key = partition_keys(S3_CLIENT, S3_BUCKET, "call_log", USER_ID)[1][1]
+    july_etag = S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=july_key)["ETag"]
+    collator = _collate(2, [_raw_call(2, july)], concurrent_io=concurrent_io)
+    assert collator.deleted_logs_count == 1
+    assert S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=july_key)["ETag"] == july_etag
+    assert read_partitions(
+        S3_CLIENT, S3_BUCKET, "call_log", USER_ID, SCHEMA
+    ).to_pydict() == {"item_id": [1, 1, 2], "is_deleted": [False, True, False]}
+
+    # Partitions whose live calls of the device are those uploaded are only counted
+    collator = _collate(3, [_raw_call(2, july)], concurrent_io=concurrent_io)
+    assert collator.new_logs_count == 0
+    assert collator.segment_partitions == []
+    assert collator.total_logs_count == 3
+
+
+@pytest.mark.integration
+def test_partitioned_txt_logs():
+    # The txt logs are updated from the summary of the partitions as they would be
+    # created from all logs, and from all logs again once the summary has none
+    full_user_id = USER_ID + 1
+    for user_id in [USER_ID, full_user_id]:
+        _reset("call_log", user_id)
+    june = 1466176793178
+    july = june + 30 * 86400 * 1000
+    august = july + 30 * 86400 * 1000
+    uploads = [
+        ([_raw_call(1, june), _raw_call(2, july)], True),
+        ([_raw_call(2, july), _raw_call(3, august)], True),
+        ([_raw_call(2, july), _raw_call(4, august)], False),
+        ([_raw_call(2, july), _raw_call(4, august), _raw_call(5, august)], True),
+    ]
+    for upload, (raw_entries, write_txt) in enumerate(uploads, 1):
+        collator = _collate(upload, raw_entries, write_txt=write_txt)
+        _collate(
+            upload,
+            raw_entries,
+            user_id=full_user_id,
+            write_txt=write_txt,
+            partitioned=False,
+        )
+        assert _read_txt("call_log", USER_ID) == _read_txt("call_log", full_user_id)
+        if upload == 2:
+            assert collator.segment_partitions == ["month=2016-06"]
+    assert [log["item_id"] for log in _read_txt("call_log", USER_ID)] == [
+        5,
+        4,
+        3,
+        2,
+        1,
+    ]
+
+    # The txt logs are also created from all logs once the txt file of the summary is
+    # changed
+    key = BaseCollator.TXT_LOGS_KEY.format(USER_ID, "1", "call_log")
+    delete_objects(S3_CLIENT, S3_BUCKET, [key])
+    _collate(5, uploads[-1][0], write_txt=True)
+    assert _read_txt("call_log", USER_ID) == _read_txt("call_log", full_user_id)
+
+
+@pytest.mark.integration
+def test_partitioned_future_sms():
+    # SMS logs dated in the future are stored with the time they were collated, in the
+    # partition of the month they are dated
+    _reset("sms_log", USER_ID)
+    future = 4102444800000
+    _collate(1, [_raw_sms(1, future)], "sms_log")
+    assert [
+        name for name, _ in partition_keys(S3_CLIENT, S3_BUCKET, "sms_log", USER_ID)
+    ] == ["month=2100-01"]
+    collator = _collate(2, [_raw_sms(1, future), _raw_sms(2, 1466176793178)], "sms_log")
+    assert collator.new_logs_count == 1
+    assert collator.segment_partitions == []
+    collator = _collate(3, [_raw_sms(1, future), _raw_sms(3, future)], "sms_log")
+    assert collator.new_logs_count == 1
+    assert collator.segment_partitions == ["month=2100-01"]
+    assert read_partitions(
+        S3_CLIENT, S3_BUCKET, "sms_log", USER_ID, SCHEMA
+    ).to_pydict() == {"item_id": [2, 1, 3], "is_deleted": [False, False, False]}
+
+
+@pytest.mark.integration
+def test_min_partitioned_logs():
+    # Users are kept in their current file until it has min_partitioned_logs logs, and
+    # are then moved to partitions
+    _reset("sms_log", USER_ID)
+    key = BaseCollator.CURRENT_COLLATED_LOGS_KEY.format("sms_log", USER_ID)
+    future = 4102444800000
+    raw_entries = [_raw_sms(1, future), _raw_sms(2, 1466176793178)]
+    collator = _collate(1, raw_entries, "sms_log", min_partitioned_logs=3)
+    collator = _collate(
+        2, [_raw_sms(3, 1468800000000)], "sms_log", min_partitioned_logs=3
+    )
+    assert collator.keeps_current_file
+    assert partition_keys(S3_CLIENT, S3_BUCKET, "sms_log", USER_ID) == []
+    assert (
+        read_partitions(S3_CLIENT, S3_BUCKET, "sms_log", USER_ID, SCHEMA).num_rows == 3
+    )
+
+    collator = _collate(
+        3, [_raw_sms(4, 1471478400000)], "sms_log", min_partitioned_logs=3
+    )
+    assert not collator.keeps_current_file
+    with pytest.raises(ClientError):
+        S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=key)
+    # The SMS dated in the future was moved with the time it was collated, and its
+    # partition is read when it is uploaded again
+    assert [
+        name for name, _ in partition_keys(S3_CLIENT, S3_BUCKET, "sms_log", USER_ID)
+    ] == ["month=2016-06", "month=2016-07", "month=2016-08", "month=2023-09"]
+    collator = _collate(4, [_raw_sms(1, future)], "sms_log", min_partitioned_logs=3)
+    assert collator.new_logs_count == 0
+    assert collator.segment_partitions == ["month=2023-09"]
+    assert read_partitions(
+        S3_CLIENT, S3_BUCKET, "sms_log", USER_ID, SCHEMA
+    ).to_pydict() == {"item_id": [2, 3, 4, 1], "is_deleted": [False] * 4}
+
+
+@pytest.mark.integration
+def test_partitions_without_summary():
+    # Partitions written without a summary, or with stats from before they recorded
+    # the logs whose datetime may have been corrected, are read, so that an SMS dated in
+    # the future and moved to the month it was collated is still found there
+    _reset("sms_log", USER_ID)
+    summary_key = BaseCollator.CURRENT_PARTITIONS_SUMMARY_KEY.format("sms_log", USER_ID)
+    future = 4102444800000
+    raw_entries = [_raw_sms(1, future), _raw_sms(2, 1466176793178)]
+    _collate(1, raw_entries, "sms_log", partitioned=False)
+    _collate(2, raw_entries, "sms_log")
+    delete_objects(S3_CLIENT, S3_BUCKET, [summary_key])
+
+    collator = _collate(3, raw_entries, "sms_log")
+    assert collator.new_logs_count == 0
+    assert collator.segment_partitions == ["month=2016-06", "month=2023-09"]
+    collator = _collate(4, raw_entries, "sms_log")
+    assert collator.new_logs_count == 0
+    assert collator.segment_partitions == ["month=2023-09"]
+
+    summary = json.load(S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=summary_key)["Body"])
+    for stats in summary["partitions"].values():
+        del stats["clamped"]
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=summary_key, Body=json.dumps(summary))
+    collator = _collate(5, raw_entries, "sms_log")
+    assert collator.new_logs_count == 0
+    assert collator.segment_partitions == ["month=2016-06", "month=2023-09"]
+    assert read_partitions(
+        S3_CLIENT, S3_BUCKET, "sms_log", USER_ID, SCHEMA
+    ).to_pydict() == {"item_id": [2, 1], "is_deleted": [False, False]}
+
+
+@pytest.mark.integration
+def test_device_partitioned_collation(monkeypatch):
+    monkeypatch.setattr(lambda_function, "PARTITIONED", True)
+    _reset("app_packages", 100)
+    key = "collated_logs/current/app_packages/user=100/logs.parquet"
+    S3_CLIENT.copy_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        CopySource={
+            "Bucket": S3_BUCKET,
+            "Key": "existing_test_logs/app_packages/logs.parquet",
+        },
+    )
+    schema = pa.schema(
+        [
+            pa.field("package_name", pa.string()),
+            pa.field("device_id", pa.string()),
+            pa.field("is_deleted", pa.bool_()),
+        ]
+    )
+
+    # The current file is moved to the partitions of its devices
+    lambda_handler(
+        json.load(open("test_events/test_collation_deletion_event.json")), None
+    )
+    with pytest.raises(ClientError):
+        S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=key)
+    partitions = partition_keys(S3_CLIENT, S3_BUCKET, "app_packages", 100)
+    assert [name for name, _ in partitions] == ["device=1"]
+    etag = S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=partitions[0][1])["ETag"]
+
+    # Collations from other devices leave the partitions of other devices as they are
+    lambda_handler(
+        json.load(open("test_events/test_collation_new_device_event.json")), None
+    )
+    partitions = partition_keys(S3_CLIENT, S3_BUCKET, "app_packages", 100)
+    assert [name for name, _ in partitions] == ["device=1", "device=2"]
+    assert S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=partitions[0][1])["ETag"] == etag
+    assert read_partitions(
+        S3_CLIENT, S3_BUCKET, "app_packages", 100, schema, ["device=2"]
+    ).to_pydict() == {
+        "package_name": ["app.three"],
+        "device_id": ["2"],
+        "is_deleted": [False],
+    }
+    assert (
+        read_partitions(S3_CLIENT, S3_BUCKET, "app_packages", 100, schema).num_rows == 5
+    )
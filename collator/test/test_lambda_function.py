@@ -0,0 +1,183 @@
+"""
+test_lambda_function.py
+Tests for the grouping and ordering of the collations of the records of an event
+"""
+
+import json
+import threading
+
+import lambda_function
+import pytest
+from lambda_function import lambda_handler
+
+
+def _record(user_id, log_type, upload, device_id=1):
+    return {
+        "s3": {
+            "object": {
+                "key": f"uploads/users/{user_id}/1/{device_id}/{log_type}/{upload}"
+            },
+            "bucket": {"name": "branch-co"},
+        },
+        "awsRegion": "us-west-2",
+    }
+
+
+def _sns_record(*records):
+    return {"Sns": {"Message": json.dumps({"Records": list(records)})}}
+
+
+@pytest.fixture
+def collations(monkeypatch):
+    collations = []
+
+    def collate_logs_for_user(
+        record, user_id, device_id, device_serial, log_type, coalesced_records
+    ):
+        upload = record["s3"]["object"]["key"].rsplit("/", 1)[1]
+        if upload == "fail":
+            raise ValueError(upload)
+        for coalesced_record in coalesced_records:
+            upload += "+" + coalesced_record["s3"]["object"]["key"].rsplit("/", 1)[1]
+        collations.append((user_id, log_type, upload))
+
+    monkeypatch.setattr(lambda_function, "COLLATION_WORKERS", 4)
+    monkeypatch.setattr(lambda_function, "collate_logs_for_user", collate_logs_for_user)
+    return collations
+
+
+def test_records_in_order(collations):
+    lambda_handler(
+        {
+            "Records": [
+                _record(100, "sms_log", 1),
+                _sns_record(_record(101, "sms_log", 1), _record(100, "sms_log", 2)),
+                _record(100, "call_log", 1),
+                _record(100, "sms_log", 3),
+                {"s3": {"object": {"key": "uploads/unexpected"}}},
+            ]
+        },
+        None,
+    )
+    assert sorted(collations) == [
+        ("100", "call_log", "1"),
+        ("100", "sms_log", "1"),
+        ("100", "sms_log", "2"),
+        ("100", "sms_log", "3"),
+        ("101", "sms_log", "1"),
+    ]
+    assert [
+        upload
+        for user_id, log_type, upload in collations
+        if user_id == "100" and log_type == "sms_log"
+    ] == ["1", "2", "3"]
+
+
+def test_records_failure(collations):
+    # The failed collation stops the later ones of its user and log type only
+    with pytest.raises(ValueError):
+        lambda_handler(
+            {
+                "Records": [
+                    _record(100, "sms_log", "fail"),
+                    _record(101, "sms_log", 1),
+                    _record(100, "sms_log", 2),
+                    _record(100, "call_log", 1),
+                ]
+            },
+            None,
+        )
+    assert sorted(collations) == [("100", "call_log", "1"), ("101", "sms_log", "1")]
+
+
+def test_records_failure_single_worker(collations, monkeypatch):
+    # With a single worker, the first failure stops all the later collations
+    monkeypatch.setattr(lambda_function, "COLLATION_WORKERS", 1)
+    with pytest.raises(ValueError, match="fail"):
+        lambda_handler(
+            {
+                "Records": [
+                    _record(101, "sms_log", 1),
+                    _record(100, "sms_log", "fail"),
+                    _record(101, "sms_log", 2),
+                    _record(100, "call_log", 1),
+                    {"Sns": {"Message": "not json"}},
+                ]
+            },
+            None,
+        )
+    assert collations == [("101", "sms_log", "1")]
+
+    collations.clear()
+    with pytest.raises(ValueError):
+        lambda_handler(
+            {
+                "Records": [
+                    _record(101, "sms_log", 1),
+                    {"Sns": {"Message": "not json"}},
+                    _record(100, "call_log", 1),
+                ]
+            },
+            None,
+        )
+    assert collations == [("101", "sms_log", "1")]
+
+
+def test_records_coalesced(collations, monkeypatch):
+    # Only consecutive records of the same device are collated together
+    monkeypatch.setattr(lambda_function, "COALESCE_UPLOADS", True)
+    lambda_handler(
+        {
+            "Records": [
+                _record(100, "sms_log", 1),
+                _record(101, "sms_log", 1),
+                _sns_record(_record(100, "sms_log", 2), _record(100, "sms_log", 3)),
+                _record(100, "sms_log", 4, device_id=2),
+                _record(100, "sms_log", 5),
+            ]
+        },
+        None,
+    )
+    assert sorted(collations) == [
+        ("100", "sms_log", "1+2+3"),
+        ("100", "sms_log", "4"),
+        ("100", "sms_log", "5"),
+        ("101", "sms_log", "1"),
+    ]
+    assert [upload for user_id, _, upload in collations if user_id == "100"] == [
+        "1+2+3",
+        "4",
+        "5",
+    ]
+
+
+def test_records_concurrently(monkeypatch):
+    # Both collations must be running at once to pass the barrier
+    barrier = threading.Barrier(2, timeout=10)
+
+    def collate_logs_for_user(
+        record, user_id, device_id, device_serial, log_type, coalesced_records
+    ):
+        barrier.wait()
+
+    monkeypatch.setattr(lambda_function, "COLLATION_WORKERS", 2)
+    monkeypatch.setattr(lambda_function, "collate_logs_for_user", collate_logs_for_user)
+    lambda_handler(
+        {"Records": [_record(100, "sms_log", 1), _record(101, "sms_log", 1)]}, None
+    )
+
+
+def test_get_s3_client(monkeypatch):
+    monkeypatch.setattr(lambda_function, "S3_CLIENTS", {})
+    monkeypatch.setattr(lambda_function, "S3_MAX_POOL_CONNECTIONS", 24)
+    s3_client = lambda_function.get_s3_client("us-west-2", None)
+
+    # Clients are reused for the same region and endpoint only
+    assert lambda_function.get_s3_client("us-west-2", None) is s3_client
+    assert lambda_function.get_s3_client("ap-south-1", None) is not s3_client
+    assert (
+        lambda_function.get_s3_client("us-west-2", "http://localhost:4566")
+        is not s3_client
+    )
+    assert s3_client.meta.config.max_pool_connections == 24
+    assert s3_client.meta.config.tcp_keepalive
@@ -0,0 +1,47 @@
+import datetime
+import random
+
+import pyarrow as pa
+from base_collator import BaseCollator
+from latest_versions import latest_version_positions
+
+
+def _latest_versions(logs):
+    positions = latest_version_positions(
+        pa.array([log["id"] for log in logs], pa.string()),
+        pa.array([log["ts_updated"] for log in logs], pa.timestamp("ns")),
+    )
+    return [logs[position] for position in positions]
+
+
+def test_latest_version_positions():
+    old = datetime.datetime(2018, 6, 5, 22, 16, 45)
+    new = datetime.datetime(2023, 9, 1, 10, 0, 0)
+    logs = [
+        {"id": "b", "ts_updated": new, "row_hash": "1"},
+        {"id": "a", "ts_updated": old, "row_hash": "2"},
+        {"id": "b", "ts_updated": old, "row_hash": "3"},
+        {"id": "a", "ts_updated": new, "row_hash": "4"},
+        {"id": "c", "ts_updated": old, "row_hash": "5"},
+        # Ties go to the last version
+        {"id": "a", "ts_updated": new, "row_hash": "6"},
+    ]
+    assert [log["row_hash"] for log in _latest_versions(logs)] == ["1", "6", "5"]
+
+
+def test_latest_version_positions_empty():
+    assert len(latest_version_positions(pa.array([], pa.string()), pa.array([]))) == 0
+
+
+def test_latest_version_positions_matches_unique_set():
+    randomizer = random.Random(4)
+    timestamps = [datetime.datetime(2023, 9, day) for day in range(1, 6)]
+    logs = [
+        {
+            "id": str(randomizer.randrange(50)),
+            "ts_updated": randomizer.choice(timestamps),
+            "row_hash": str(row_hash),
+        }
+        for row_hash in range(1000)
+    ]
+    assert _latest_versions(logs) == list(BaseCollator._create_unique_set(None, logs))
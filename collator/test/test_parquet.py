@@ -0,0 +1,147 @@
+import datetime
+import io
+
+import pyarrow as pa
+import pytest
+from parquet import (
+    HASH_BINARY_TYPE,
+    binary_hash_fields,
+    conform_table,
+    dictionary_encoded,
+    hex_to_binary,
+    read_table_columns,
+    reader,
+    table_to_dicts,
+    writer,
+)
+
+LOGS = [
+    {
+        "package_name": "app.one",
+        "id": "3be2883fa0343c5a8b97522cc9625d6d",
+        "is_deleted": False,
+        "ts_updated": datetime.datetime(2018, 6, 5, 22, 16, 45),
+    },
+    {
+        "package_name": "app.two",
+        "id": "120a688074dcc1ae043843ed5d5a5394",
+        "is_deleted": True,
+        "ts_updated": datetime.datetime(2018, 6, 5, 22, 16, 45, 1000),
+    },
+]
+
+
+def _stream():
+    return io.BytesIO(writer(LOGS).to_pybytes())
+
+
+def test_reader_round_trip():
+    assert reader(_stream()) == LOGS
+
+
+def test_table_to_dicts_timestamps():
+    # Nanosecond timestamps are returned as datetimes rather than pandas Timestamps
+    table = read_table_columns(_stream())
+    assert table.schema.field("ts_updated").type == pa.timestamp("ns")
+    logs = table_to_dicts(table)
+    assert [type(log["ts_updated"]) for log in logs] == [datetime.datetime] * 2
+    assert logs == LOGS
+    table = pa.table({"ts_updated": pa.array([None], pa.timestamp("ns"))})
+    assert table_to_dicts(table) == [{"ts_updated": None}]
+
+
+def test_read_table_columns():
+    table = read_table_columns(_stream())
+    assert table.column_names == ["package_name", "id", "is_deleted", "ts_updated"]
+    assert table.num_rows == 2
+
+
+def test_read_table_columns_projection():
+    table = read_table_columns(_stream(), columns=["is_deleted", "id", "missing"])
+    assert table.column_names == ["is_deleted", "id"]
+    assert table.column("is_deleted").to_pylist() == [False, True]
+
+
+def test_writer_schema():
+    schema = pa.schema(
+        [
+            pa.field("package_name", pa.string()),
+            pa.field("item_id", pa.int64()),
+            pa.field("id", pa.string()),
+            pa.field("is_deleted", pa.bool_()),
+            pa.field("ts_updated", pa.timestamp("ns")),
+        ]
+    )
+    logs = [
+        {"package_name": None, "item_id": "12", "extra": 1, **LOGS[0]},
+        {"item_id": None, **LOGS[1]},
+    ]
+    table = read_table_columns(io.BytesIO(writer(logs, schema=schema).to_pybytes()))
+    # Columns follow the schema, even for values that are missing or of another type
+    assert table.schema == schema
+    assert table.column("item_id").to_pylist() == [12, None]
+
+
+def test_writer_dictionary_encoded():
+    schema = dictionary_encoded(
+        pa.schema([pa.field("package_name", pa.string()), pa.field("id", pa.string())]),
+        ["package_name"],
+    )
+    assert schema.field("package_name").type == pa.dictionary(pa.int32(), pa.string())
+    assert reader(io.BytesIO(writer(LOGS, schema=schema).to_pybytes())) == [
+        {"package_name": log["package_name"], "id": log["id"]} for log in LOGS
+    ]
+
+
+def test_conform_table():
+    schema = pa.schema(
+        [
+            pa.field("id", pa.string()),
+            pa.field("item_id", pa.int64()),
+            pa.field("device_id", pa.dictionary(pa.int32(), pa.string())),
+        ]
+    )
+    table = pa.table({"device_id": ["1", "2"], "extra": [1, 2], "id": ["a", "b"]})
+    conformed = conform_table(table, schema)
+    assert conformed.schema == schema
+    assert conformed.to_pydict() == {
+        "id": ["a", "b"],
+        "item_id": [None, None],
+        "device_id": ["1", "2"],
+    }
+
+
+def test_writer_binary_hashes():
+    schema = binary_hash_fields(
+        pa.schema([pa.field("package_name", pa.string()), pa.field("id", pa.string())]),
+        ["id"],
+    )
+    logs = LOGS + [{"package_name": "app.three", "id": None}]
+    stream = io.BytesIO(writer(logs, schema=schema).to_pybytes())
+    table = read_table_columns(stream)
+    assert table.schema == schema
+    assert table.column("id").to_pylist() == [
+        bytes.fromhex(LOGS[0]["id"]),
+        bytes.fromhex(LOGS[1]["id"]),
+        None,
+    ]
+
+    # Hashes can be read back as hex strings
+    stream.seek(0)
+    assert reader(stream, hex_hashes=True) == [
+        {"package_name": log["package_name"], "id": log["id"]} for log in logs
+    ]
+    hex_schema = pa.schema(
+        [pa.field("package_name", pa.string()), pa.field("id", pa.string())]
+    )
+    assert conform_table(table.slice(1), hex_schema).column("id").to_pylist() == [
+        LOGS[1]["id"],
+        None,
+    ]
+
+
+def test_hex_to_binary_invalid():
+    for value in ["abc", "g" * 32]:
+        with pytest.raises(ValueError):
+            hex_to_binary(pa.array([value]))
+    assert hex_to_binary(pa.array([], pa.string())).type == HASH_BINARY_TYPE
@@ -0,0 +1,89 @@
+"""
+test_s3_file.py
+Tests for reading S3 objects through ranged GETs, against the S3 container
+"""
+import io
+import os
+
+import boto3
+import pyarrow as pa
+import pytest
+from botocore.exceptions import ClientError
+from parquet import (
+    TableStreamWriter,
+    column_chunk_ranges,
+    iter_file_batches,
+    read_row_group_columns,
+)
+from pyarrow.parquet import ParquetFile
+from s3_file import S3File, coalesce_ranges
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+KEY = "test_s3_file/logs.parquet"
+
+
+def test_coalesce_ranges():
+    ranges = [(100, 50), (0, 10), (20, 10), (5, 10), (1000, 0)]
+    assert coalesce_ranges(ranges, hole_size_limit=10) == [(0, 30), (100, 150)]
+    assert coalesce_ranges(ranges, hole_size_limit=100) == [(0, 150)]
+    assert coalesce_ranges(ranges, hole_size_limit=100, range_size_limit=100) == [
+        (0, 30),
+        (100, 150),
+    ]
+    assert coalesce_ranges([]) == []
+
+
+@pytest.mark.integration
+def test_s3_file_read_and_seek():
+    body = bytes(range(256)) * 1024
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=KEY, Body=body)
+    s3_file = S3File(S3_CLIENT, S3_BUCKET, KEY, tail_size=1024)
+    assert s3_file.size == len(body)
+    assert s3_file.read(10) == body[:10]
+    s3_file.seek(-2000, io.SEEK_END)
+    assert s3_file.read(1500) == body[-2000:-500]
+    assert s3_file.tell() == len(body) - 500
+    assert s3_file.read() == body[-500:]
+    assert s3_file.read() == b""
+
+
+@pytest.mark.integration
+def test_s3_file_parquet_row_groups():
+    table = pa.table(
+        {"id": [str(i) * 20 for i in range(10000)], "item_id": range(10000)}
+    )
+    out = TableStreamWriter(table.schema, row_group_size=1000)
+    out.write(table)
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=KEY, Body=out.close().to_pybytes())
+
+    s3_file = S3File(S3_CLIENT, S3_BUCKET, KEY)
+    parquet_file = ParquetFile(s3_file)
+    assert parquet_file.num_row_groups == 10
+    # Prefetched column chunks are read with a single request
+    requests_count = s3_file.requests_count
+    s3_file.prefetch(column_chunk_ranges(parquet_file, ["id"], [0, 1, 2]))
+    assert s3_file.requests_count == requests_count + 1
+    read_row_group_columns(parquet_file, 1, ["id"])
+    assert s3_file.requests_count == requests_count + 1
+    batches = list(iter_file_batches(parquet_file, ["id"], batch_size=1000))
+    assert pa.Table.from_batches(batches).column("id").to_pylist() == (
+        table.column("id").to_pylist()
+    )
+    assert read_row_group_columns(parquet_file, 3).to_pydict() == (
+        table.slice(3000, 1000).to_pydict()
+    )
+
+
+@pytest.mark.integration
+def test_s3_file_overwritten():
+    # Reads after the object is overwritten fail rather than mixing both versions
+    body = bytes(range(256)) * 1024
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=KEY, Body=body)
+    s3_file = S3File(S3_CLIENT, S3_BUCKET, KEY, tail_size=1024)
+    assert s3_file.read(10) == body[:10]
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=KEY, Body=body[::-1])
+    with pytest.raises(ClientError) as ex:
+        s3_file.read(10)
+    assert ex.value.response["Error"]["Code"] == "PreconditionFailed"
@@ -0,0 +1,86 @@
+"""
+test_state_cache.py
+Tests for the local cache of existing collated logs, partly against the S3 container
+"""
+
+import os
+
+import boto3
+import pyarrow as pa
+import pytest
+from parquet import TableStreamWriter
+from state_cache import IpcFile, StateCache
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+SCHEMA = pa.schema(
+    [
+        pa.field("id", pa.string()),
+        pa.field("device_id", pa.dictionary(pa.int32(), pa.string())),
+    ]
+).with_metadata({b"collator.test": b"1"})
+KEY = "collated_logs/current/test_state_cache/user=100/logs.parquet"
+
+
+def _parquet(ids, row_group_size=2):
+    out = TableStreamWriter(SCHEMA, row_group_size=row_group_size)
+    out.write(
+        pa.table(
+            {"id": ids, "device_id": [str(len(ids) % 3)] * len(ids)}, schema=SCHEMA
+        )
+    )
+    return out.close().to_pybytes()
+
+
+def test_put(tmp_path):
+    cache = StateCache(str(tmp_path), 1024 * 1024)
+    ipc_file = cache.put(S3_BUCKET, KEY, '"a"', _parquet(["a", "b", "c"]))
+
+    # Row groups are kept, along with the schema and its metadata
+    assert isinstance(ipc_file, IpcFile)
+    assert ipc_file.schema_arrow == SCHEMA
+    assert ipc_file.schema_arrow.metadata == SCHEMA.metadata
+    assert ipc_file.num_row_groups == 2
+    assert ipc_file.metadata.num_rows == 3
+    assert ipc_file.metadata.row_group(1).num_rows == 1
+    assert ipc_file.read_row_group(1, ["id"]).to_pydict() == {"id": ["c"]}
+    assert ipc_file.read(["device_id"]).column(0).to_pylist() == ["0", "0", "0"]
+
+
+def test_put_eviction(tmp_path):
+    cache = StateCache(str(tmp_path / "cache"), 1024 * 1024)
+    cache.put(S3_BUCKET, KEY, '"a"', _parquet(["a", "b"]))
+    max_bytes = 2 * cache.total_bytes
+
+    # The least recently used file is evicted to make room for the new one
+    cache = StateCache(str(tmp_path / "cache"), max_bytes)
+    for key in ["a", "b", "c"]:
+        cache.put(S3_BUCKET, key, '"a"', _parquet(["a", "b"]))
+    assert list(cache.entries) == [(S3_BUCKET, "b"), (S3_BUCKET, "c")]
+    assert len(os.listdir(tmp_path / "cache")) == 2
+
+    # Files larger than the cache are not cached
+    cache = StateCache(str(tmp_path / "small"), 16)
+    parquet_file = cache.put(S3_BUCKET, KEY, '"a"', _parquet(["a", "b"]))
+    assert parquet_file.metadata.num_rows == 2
+    assert not cache.entries
+
+
+@pytest.mark.integration
+def test_open(tmp_path):
+    cache = StateCache(str(tmp_path), 1024 * 1024)
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=KEY, Body=_parquet(["a", "b", "c"]))
+    _, _, hit = cache.open(S3_CLIENT, S3_BUCKET, KEY)
+    assert not hit
+
+    # Unchanged objects are read from the cache
+    ipc_file, _, hit = cache.open(S3_CLIENT, S3_BUCKET, KEY)
+    assert hit
+    assert ipc_file.read(["id"]).to_pydict() == {"id": ["a", "b", "c"]}
+
+    # Changed objects are downloaded again
+    S3_CLIENT.put_object(Bucket=S3_BUCKET, Key=KEY, Body=_parquet(["d"]))
+    ipc_file, _, hit = cache.open(S3_CLIENT, S3_BUCKET, KEY)
+    assert not hit
+    assert ipc_file.read(["id"]).to_pydict() == {"id": ["d"]}
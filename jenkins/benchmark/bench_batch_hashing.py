@@ -0,0 +1,54 @@
+"""Benchmark for computing the row hashes of collated call logs, comparing
+CallCollator.compute_row_hash on each entry with hash_columns on the columns of a table
+of the same entries.
+
+Usage: PYTHONPATH=src python benchmark/bench_batch_hashing.py
+"""
+
+import random
+import time
+
+from batch_hashing import hash_columns
+from call_collator import CallCollator
+from parquet import dicts_to_table
+
+ROWS_COUNTS = [10000, 100000, 500000]
+
+
+def entries(rows_count):
+    randomizer = random.Random(0)
+    return [
+        {
+            "id": f"{randomizer.getrandbits(128):032x}",
+            "cached_name": randomizer.choice([None, "Deno", "Amina Wanjiru"]),
+            "call_type": randomizer.choice(list(CallCollator.CALL_TYPES.values())),
+            "normalized_phone_number": f"2547{randomizer.randint(0, 99999999):08d}",
+            "duration": randomizer.randint(0, 600),
+            "is_deleted": randomizer.random() < 0.1,
+        }
+        for _ in range(rows_count)
+    ]
+
+
+def main():
+    print(f"{'rows':>8} {'per_entry':>9} {'columns':>9}")
+    for rows_count in ROWS_COUNTS:
+        logs = entries(rows_count)
+        table = dicts_to_table(logs, CallCollator.SCHEMA)
+
+        start = time.perf_counter()
+        expected = [CallCollator.compute_row_hash(log) for log in logs]
+        per_entry_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        row_hashes = hash_columns(
+            [table.column(field) for field in CallCollator.ROW_HASH_FIELDS]
+        )
+        columns_seconds = time.perf_counter() - start
+
+        assert row_hashes == expected
+        print(f"{rows_count:>8} {per_entry_seconds:>9.3f} {columns_seconds:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark for storing the id and row_hash fields of collated logs as 16-byte binaries
+rather than hex strings, comparing the size of parquet files and of the hash columns in
+memory, and the time to write and read the files back. The binary read includes the
+conversion back to hex strings.
+
+The collated logs are collated from raw entries shaped like the test uploads of each
+log type.
+
+Usage: PYTHONPATH=src python benchmark/bench_binary_hashes.py
+"""
+
+import datetime
+import io
+import random
+import time
+
+from base_collator import BaseCollator
+from bench_collate_batch import COLLATORS
+from parquet import (
+    binary_hash_fields,
+    conform_table,
+    read_table_columns,
+    table_writer,
+)
+
+ENTRIES_COUNT = 100000
+
+
+def write_and_read(table, schema):
+    start = time.perf_counter()
+    body = table_writer(conform_table(table, schema)).to_pybytes()
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    read_table_columns(io.BytesIO(body), hex_hashes=True)
+    read_seconds = time.perf_counter() - start
+    return body, write_seconds, read_seconds
+
+
+def main():
+    print(
+        f"{'collator':>16} {'mode':>6} {'file_kb':>8} {'hashes_kb':>9}"
+        f" {'write':>7} {'read':>7}"
+    )
+    for collator_class, raw_entry in COLLATORS:
+        randomizer = random.Random(0)
+        raw_entries = [raw_entry(randomizer, i) for i in range(ENTRIES_COUNT)]
+        collator = collator_class(
+            None, None, None, 123, "456", datetime.datetime(2020, 1, 1), False
+        )
+        table = collator.collate_batch(raw_entries)
+        for mode, schema in [
+            ("hex", collator.schema),
+            ("binary", binary_hash_fields(collator.schema, BaseCollator.HASH_FIELDS)),
+        ]:
+            body, write_seconds, read_seconds = write_and_read(table, schema)
+            stored = conform_table(table, schema)
+            hashes_bytes = sum(
+                stored.column(field).nbytes for field in BaseCollator.HASH_FIELDS
+            )
+            print(
+                f"{collator_class.__name__:>16} {mode:>6} {len(body) // 1024:>8}"
+                f" {hashes_bytes // 1024:>9} {write_seconds:>7.3f} {read_seconds:>7.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
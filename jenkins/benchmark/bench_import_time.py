@@ -0,0 +1,50 @@
+"""Benchmark for the time taken to import lambda_function, as on a cold start, from
+python -X importtime in fresh interpreters. Reports the total import time and the
+packages that take longest to import, and whether pandas was imported.
+
+Usage: PYTHONPATH=src python benchmark/bench_import_time.py
+"""
+
+import os
+import subprocess
+import sys
+
+RUNS_COUNT = 5
+TOP_PACKAGES_COUNT = 10
+
+
+def import_times():
+    # Import time in microseconds of the modules of each top-level package, by name
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import lambda_function"],
+        env=dict(os.environ, DD_TRACE_ENABLED="false"),
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, _, name = line[len("import time:") :].split("|")
+        package = name.strip().split(".")[0]
+        times[package] = times.get(package, 0) + int(self_time)
+    return times
+
+
+def main():
+    runs = [import_times() for _ in range(RUNS_COUNT)]
+    # The fastest run of each package has the least noise
+    names = set().union(*runs)
+    times = {name: min(run.get(name, 0) for run in runs) for name in names}
+    print(f"{'package':>24} {'ms':>8}")
+    for name, microseconds in sorted(times.items(), key=lambda item: -item[1])[
+        :TOP_PACKAGES_COUNT
+    ]:
+        print(f"{name:>24} {microseconds / 1000:>8.1f}")
+    print(f"{'total':>24} {sum(times.values()) / 1000:>8.1f}")
+    print(f"pandas imported: {'pandas' in names}")
+
+
+if __name__ == "__main__":
+    main()
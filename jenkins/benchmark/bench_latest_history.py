@@ -0,0 +1,97 @@
+"""Benchmark for bytes read and written by collations of contact lists whose contacts
+are updated on every upload, comparing the full current file with the latest/history
+layout. The cost of the full file grows with every upload, while the latest file stays
+the size of the contact list.
+
+Usage: PYTHONPATH=src python benchmark/bench_latest_history.py
+"""
+
+import datetime
+import json
+import random
+import time
+
+from bench_collate_batch import contacts_entry
+from contacts_collator import ContactsCollator
+from memory_s3 import MemoryS3Client
+
+S3_BUCKET = "benchmark"
+CONTACTS_COUNT = 5000
+COLLATIONS_COUNTS = [1, 10, 30]
+
+
+class CountingS3Client(MemoryS3Client):
+    def __init__(self):
+        super(CountingS3Client, self).__init__()
+        self.bytes_read_count = 0
+        self.bytes_written_count = 0
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        result = super(CountingS3Client, self).get_object(Bucket, Key, Range, **kwargs)
+        self.bytes_read_count += result["ContentLength"]
+        return result
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.bytes_written_count += len(Body)
+        return super(CountingS3Client, self).put_object(Bucket, Key, Body, **kwargs)
+
+
+def collate(s3_client, collation, latest_history):
+    # Each upload changes times_contacted, so every contact gets a new version
+    randomizer = random.Random(collation)
+    raw_file_key = f"uploads/users/100/unknown/1/contact_list/{collation}"
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=raw_file_key,
+        Body=json.dumps(
+            [contacts_entry(randomizer, item_id) for item_id in range(CONTACTS_COUNT)]
+        ),
+    )
+    collator = ContactsCollator(
+        s3_client,
+        S3_BUCKET,
+        raw_file_key,
+        100,
+        "1",
+        datetime.datetime(2023, 9, 1) + datetime.timedelta(minutes=collation),
+        False,
+        projection=True,
+        diff_parts=True,
+        latest_history=latest_history,
+    )
+    collator.collate()
+
+
+def main():
+    print(
+        f"{'uploads':>8} {'layout':>7} {'read_kb':>8} {'written_kb':>11}"
+        f" {'seconds':>8}"
+    )
+    for collations_count in COLLATIONS_COUNTS:
+        for layout, latest_history in [("full", False), ("latest", True)]:
+            s3_client = CountingS3Client()
+            for collation in range(collations_count - 1):
+                collate(s3_client, collation, latest_history)
+
+            # Only the last collation is measured, uploads excluded
+            s3_client.bytes_read_count = 0
+            s3_client.bytes_written_count = 0
+            start = time.perf_counter()
+            collate(s3_client, collations_count - 1, latest_history)
+            seconds = time.perf_counter() - start
+            upload = s3_client.objects[
+                (
+                    S3_BUCKET,
+                    f"uploads/users/100/unknown/1/contact_list/{collations_count - 1}",
+                )
+            ]
+            bytes_read = s3_client.bytes_read_count - len(upload)
+            bytes_written = s3_client.bytes_written_count - len(upload)
+            print(
+                f"{collations_count:>8} {layout:>7} {bytes_read // 1024:>8}"
+                f" {bytes_written // 1024:>11} {seconds:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark for selecting the latest version of each log of a user with a deep version
+history, comparing BaseCollator._create_unique_set with latest_version_positions.
+
+The to_dicts column is the additional time _create_unique_set needs to convert the key
+fields to python objects first.
+
+Usage: PYTHONPATH=src python benchmark/bench_latest_versions.py
+"""
+
+import datetime
+import hashlib
+import random
+import time
+
+import pyarrow as pa
+from base_collator import BaseCollator
+from latest_versions import latest_version_positions
+from parquet import table_to_dicts
+
+HISTORIES = [(10000, 10), (10000, 50), (50000, 20)]
+
+
+def history(ids_count, versions_count):
+    randomizer = random.Random(0)
+    ids = [hashlib.md5(str(i).encode("utf-8")).hexdigest() for i in range(ids_count)]
+    start = datetime.datetime(2020, 1, 1)
+    logs = []
+    for version in range(versions_count):
+        ts_updated = start + datetime.timedelta(days=version)
+        for id in randomizer.sample(ids, ids_count // 2):
+            logs.append({"id": id, "ts_updated": ts_updated})
+    return logs
+
+
+def main():
+    print(
+        f"{'ids':>6} {'versions':>8} {'rows':>8} {'to_dicts':>8} {'unique_set':>10}"
+        f" {'vectorized':>10}"
+    )
+    for ids_count, versions_count in HISTORIES:
+        logs = history(ids_count, versions_count)
+        ids = pa.array([log["id"] for log in logs], pa.string())
+        ts_updated = pa.array([log["ts_updated"] for log in logs], pa.timestamp("ns"))
+
+        start = time.perf_counter()
+        table_to_dicts(pa.table({"id": ids, "ts_updated": ts_updated}))
+        to_dicts_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = list(BaseCollator._create_unique_set(None, logs))
+        unique_set_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        positions = latest_version_positions(ids, ts_updated)
+        vectorized_seconds = time.perf_counter() - start
+
+        assert [logs[position] for position in positions] == expected
+        print(
+            f"{ids_count:>6} {versions_count:>8} {len(logs):>8} {to_dicts_seconds:>8.3f}"
+            f" {unique_set_seconds:>10.3f} {vectorized_seconds:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark for bytes transferred when reading the key fields of existing SMS logs.
+
+Compares downloading the whole object with ranged GETs of only the key column chunks.
+
+Usage: PYTHONPATH=src python benchmark/bench_ranged_reads.py
+"""
+
+import datetime
+import time
+
+from memory_s3 import MemoryS3Client
+from parquet import TableStreamWriter, dicts_to_table, open_parquet_file
+from pyarrow.parquet import ParquetFile
+from s3_file import S3File
+from sms_collator import SmsCollator
+
+S3_BUCKET = "benchmark"
+KEY = "collated_logs/current/sms_log/user=100/logs.parquet"
+HISTORY_SIZES = [10000, 100000, 300000]
+TS_UPDATED = datetime.datetime(2023, 9, 1)
+
+
+def existing_logs(size):
+    logs = []
+    for item_id in range(size):
+        collated_entry = {"user_id": 100, "device_id": "1", "is_deleted": False}
+        SmsCollator.collate_entry(
+            collated_entry,
+            {
+                "message_body": f"Message number {item_id} " * 8,
+                "thread_id": item_id % 50,
+                "sms_type": 1,
+                "contact_id": 0,
+                "datetime": 1600000000000 + item_id * 1000,
+                "sms_address": f"+254 7{item_id:08d}",
+                "item_id": item_id,
+            },
+        )
+        collated_entry["ts_updated"] = TS_UPDATED
+        logs.append(collated_entry)
+    return logs
+
+
+def read_full(s3_client):
+    result = s3_client.get_object(Bucket=S3_BUCKET, Key=KEY)
+    collator = SmsCollator(s3_client, S3_BUCKET, None, 100, "1", TS_UPDATED, False)
+    collator.existing_segments = [(open_parquet_file(result["Body"]), None)]
+    collator._read_key_table()
+    return 1, result["ContentLength"]
+
+
+def read_ranged(s3_client):
+    collator = SmsCollator(s3_client, S3_BUCKET, None, 100, "1", TS_UPDATED, False)
+    s3_file = S3File(s3_client, S3_BUCKET, KEY)
+    collator.existing_segments = [(ParquetFile(s3_file), s3_file)]
+    collator._read_key_table()
+    return s3_file.requests_count, s3_file.bytes_read_count
+
+
+def main():
+    print(f"{'rows':>8} {'read':>7} {'requests':>9} {'bytes':>11} {'seconds':>8}")
+    for size in HISTORY_SIZES:
+        out = TableStreamWriter(SmsCollator.SCHEMA)
+        out.write(dicts_to_table(existing_logs(size), SmsCollator.SCHEMA))
+        s3_client = MemoryS3Client()
+        s3_client.put_object(Bucket=S3_BUCKET, Key=KEY, Body=out.close())
+        for name, read in [("full", read_full), ("ranged", read_ranged)]:
+            start = time.perf_counter()
+            requests, bytes_read = read(s3_client)
+            seconds = time.perf_counter() - start
+            print(f"{size:>8} {name:>7} {requests:>9} {bytes_read:>11} {seconds:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
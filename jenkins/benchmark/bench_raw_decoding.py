@@ -0,0 +1,91 @@
+"""Benchmark for peak memory and time of decoding a large gzipped upload of SMS logs and
+collating each of its entries, comparing reading, decompressing and decoding the whole
+upload before collating its first entry with decoding it as a stream. The entries have
+all been collated before, as when a device uploads its full logs again, so that the
+peak memory is that of the decoding rather than of the new logs.
+
+Usage: PYTHONPATH=src python benchmark/bench_raw_decoding.py
+"""
+
+import gzip
+import io
+import json
+import time
+import tracemalloc
+
+from json_stream import iter_json_array, open_gzip_or_plain
+from sms_collator import SmsCollator
+
+UPLOAD_SIZES = [10000, 100000]
+
+
+def upload(size):
+    return [
+        {
+            "message_body": f"Message {item_id} " + "lorem ipsum " * 10,
+            "thread_id": item_id % 50,
+            "sms_type": 1,
+            "contact_id": 0,
+            "datetime": 1693526400000 + item_id * 1000,
+            "sms_address": f"+254 7{item_id:08d}",
+            "item_id": item_id,
+        }
+        for item_id in range(size)
+    ]
+
+
+def read_whole(body):
+    # Decoding before raw uploads were streamed
+    body = body.read()
+    try:
+        body = gzip.GzipFile(fileobj=io.BytesIO(body), mode="rb").read()
+    except gzip.BadGzipFile:
+        pass
+    return json.loads(body)
+
+
+def read_stream(body):
+    return iter_json_array(open_gzip_or_plain(body))
+
+
+def collate(read, data):
+    count = 0
+    for raw_entry in read(io.BytesIO(data)):
+        collated_entry = {"user_id": 100, "device_id": "1", "is_deleted": False}
+        if SmsCollator.collate_entry(collated_entry, raw_entry):
+            count += 1
+    return count
+
+
+def run(read, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = collate(read, data)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Timed again without tracemalloc, which slows allocations down
+    start = time.perf_counter()
+    collate(read, data)
+    return count, time.perf_counter() - start, peak
+
+
+def main():
+    print(
+        f"{'entries':>8} {'gzip_mb':>8} {'json_mb':>8} {'decoding':>8}"
+        f" {'seconds':>8} {'peak_mb':>8}"
+    )
+    for size in UPLOAD_SIZES:
+        body = json.dumps(upload(size)).encode("utf-8")
+        data = gzip.compress(body)
+        for name, read in [("whole", read_whole), ("stream", read_stream)]:
+            count, seconds, peak = run(read, data)
+            assert count == size
+            print(
+                f"{size:>8} {len(data) / 2**20:>8.1f} {len(body) / 2**20:>8.1f}"
+                f" {name:>8} {seconds:>8.3f} {peak / 2**20:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,22 +5,13 @@ the app schema
 
 import hashlib
 import json
-import logging
 
+import pyarrow as pa
 from base_collator import BaseCollator
-from ddtrace import patch
+from batch_hashing import hash_columns
+from collator_logging import get_logger
 
-patch(logging=True)
-
-FORMAT = (
-    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
-    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
-    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
-)
-
-logging.basicConfig(format=FORMAT)
-LOGGER = logging.getLogger(__name__)
-LOGGER.setLevel(logging.INFO)
+LOGGER = get_logger(__name__)
 
 
 class AppCollator(BaseCollator):
@@ -28,7 +19,25 @@ class AppCollator(BaseCollator):
         "package_name",  # str
     ]
 
-    SCHEMA = SCHEMA_RAW + BaseCollator.BASE_SCHEMA
+    SCHEMA = pa.schema(
+        [
+            pa.field("package_name", pa.string()),
+        ]
+        + BaseCollator.BASE_SCHEMA
+    )
+
+    # Fields hashed by compute_row_hash, in order
+    ROW_HASH_FIELDS = ["id", "is_deleted"]
+
+    REQUIRED_FIELDS_TXT = ["package_name"]
+
+    # txt logs only contain logs from the device being collated, and leave out logs
+    # that were ever deleted
+    TXT_DEVICE_ONLY = True
+    TXT_EXCLUDES_DELETED_IDS = True
+
+    # Current logs can be partitioned by the device they were collated from
+    PARTITION_BY = "device"
 
     def __init__(
         self,
@@ -39,6 +48,7 @@ class AppCollator(BaseCollator):
         device_id,
         ts_updated,
         write_txt,
+        **kwargs,
     ):
         super(AppCollator, self).__init__(
             s3_client,
@@ -49,6 +59,7 @@ class AppCollator(BaseCollator):
             ts_updated,
             "app_packages",
             write_txt,
+            **kwargs,
         )
 
     # This function creates collated version of all relevant raw fields, and calculates
@@ -83,6 +94,34 @@ class AppCollator(BaseCollator):
         collated_entry["row_hash"] = AppCollator.compute_row_hash(collated_entry)
         return True
 
+    def collate_batch(self, raw_entries):
+        self._log_unexpected_fields(raw_entries)
+        raw_entries = [
+            raw_entry for raw_entry in raw_entries if raw_entry["package_name"]
+        ]
+        num_rows = len(raw_entries)
+        package_names = BaseCollator.compact_lower_column(
+            [raw_entry["package_name"] for raw_entry in raw_entries]
+        )
+        ids = pa.array(
+            hash_columns(
+                [
+                    pa.scalar(str(self.user_id)),
+                    pa.scalar(self.device_id),
+                    package_names,
+                ]
+            ),
+            pa.string(),
+        )
+        return self._batch_table(
+            {
+                "package_name": package_names,
+                "id": ids,
+                "row_hash": hash_columns([ids, pa.scalar("False")]),
+            },
+            num_rows,
+        )
+
     @staticmethod
     def compute_row_hash(entry):
         return hashlib.md5(
@@ -2,43 +2,134 @@
 by all log types during collation"""
 
 import datetime
-import gzip
-import io
+import itertools
 import json
-import logging
+import re
+import time
+import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from botocore.exceptions import ClientError
-from ddtrace import patch, tracer
-from parquet import reader, writer
+from batch_hashing import hash_columns
+from collator_logging import get_logger
+from current_partitions import (
+    changed_partitions,
+    clamped_row_hashes,
+    partition_names,
+    partition_stats,
+    partitions_summary,
+    summary_stats,
+    summary_txt_logs,
+)
+from ddtrace import tracer
+from delta_segments import (
+    delta_sequence,
+    list_deltas,
+    live_deltas,
+    next_delta_name,
+    with_merged_deltas,
+)
+from json_stream import iter_json_array, open_gzip_or_plain
+from latest_versions import latest_version_positions
+from parquet import (
+    TableStreamWriter,
+    binary_hash_fields,
+    column_chunk_ranges,
+    columns_to_table,
+    conform_table,
+    dicts_to_table,
+    dictionary_encoded,
+    hex_hash_columns,
+    iter_file_batches,
+    open_parquet_file,
+    read_file_columns,
+    read_row_group_columns,
+    reader,
+    table_to_dicts,
+    writer,
+)
+from pyarrow.parquet import ParquetFile
+from row_hash_index import build_row_hash_index
+from s3_file import S3File, delete_objects, list_objects
 
-patch(logging=True)
+LOGGER = get_logger("collator")
 
-FORMAT = (
-    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
-    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
-    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
-)
+# parse_datetime returns local times, which can only be computed with Arrow when the
+# local time zone is UTC, as on Lambda
+LOCAL_TIME_IS_UTC = time.timezone == 0 and not time.daylight
 
-logging.basicConfig(format=FORMAT)
-LOGGER = logging.getLogger("collator")
-LOGGER.setLevel(logging.INFO)
+# Epoch microseconds up to which parse_datetime is exact, around the year 2242
+EXACT_DATETIME_LIMIT = 2**33 * 1000000
 
 
 class BaseCollator(ABC):
     BASE_SCHEMA = [
-        "device_id",  # str
-        "row_hash",  # str
-        "id",  # str
-        "is_deleted",  # bool
-        "user_id",  # int
-        "ts_updated",  # timestamp
+        pa.field("device_id", pa.string()),
+        pa.field("row_hash", pa.string()),
+        pa.field("id", pa.string()),
+        pa.field("is_deleted", pa.bool_()),
+        pa.field("user_id", pa.int64()),
+        pa.field("ts_updated", pa.timestamp("ns")),
     ]
 
+    # Low-cardinality fields that can be stored dictionary-encoded
+    DICTIONARY_FIELDS = ["device_id"]
+
+    # Level the current logs can be partitioned by with partitioned, if any
+    PARTITION_BY = None
+
+    # Partition of logs whose partition field is null, as in Hive
+    DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+    # MD5 hash fields, which can be stored as 16-byte binaries
+    HASH_FIELDS = ["id", "row_hash"]
+
+    # Fields needed to find new, updated and deleted logs
+    KEY_FIELDS = ["id", "row_hash", "ts_updated", "is_deleted", "device_id"]
+    POSITION_KEY = "_position"
+
+    # Raw entries decoded and collated as columns at a time with batch_collate
+    RAW_BATCH_SIZE = 10000
+
+    # Fields read by create_txt_logs, whether it only uses logs from the device being
+    # collated, and whether it leaves out every id with a deleted version
+    TXT_KEY_FIELDS = ["id", "is_deleted", "device_id"]
+    TXT_DEVICE_ONLY = False
+    TXT_EXCLUDES_DELETED_IDS = False
+
+    # Key of the parquet schema metadata of a latest file listing the ids of deleted
+    # versions superseded into the history, as create_txt_logs may still use them
+    HISTORY_DELETED_IDS_KEY = b"collator.history_deleted_ids"
+    # Key of the parquet schema metadata of a latest file with the txt logs of versions
+    # superseded into the history under txt keys no latest version has, as txt logs
+    # created from every version keep them
+    HISTORY_TXT_LOGS_KEY = b"collator.history_txt_logs"
+
+    CURRENT_PREFIX = "collated_logs/current/"
     CURRENT_COLLATED_LOGS_KEY = "collated_logs/current/{}/user={}/logs.parquet"
+    CURRENT_COLLATED_LOGS_DELTA_KEY = (
+        "collated_logs/current/{}/user={}/delta-{}.parquet"
+    )
+    CURRENT_COLLATED_LOGS_PARTITION_KEY = (
+        "collated_logs/current/{}/user={}/{}/logs.parquet"
+    )
+    CURRENT_PARTITIONS_SUMMARY_KEY = "collated_logs/current/{}/user={}/partitions.json"
+    CURRENT_LATEST_LOGS_KEY = "collated_logs/current/{}/user={}/latest.parquet"
+    HISTORY_LOGS_PART_KEY = "collated_logs/history/{}/user={}/part-{}.parquet"
     CHANGED_LOGS_KEY = "collated_logs/diff/{}/ts_update={}/user={}/logs.parquet"
+    CHANGED_LOGS_PART_KEY = "collated_logs/diff/{}/ts_update={}/user={}/part-{}.parquet"
     TXT_LOGS_KEY = "collated_logs/user-{}/device-{}/collated_{}.txt"
     MISSING_KEY_ERROR = "NoSuchKey"
+    # Errors of conditional writes to objects changed or deleted since they were read
+    WRITE_CONFLICT_CODES = (
+        "PreconditionFailed",
+        "ConditionalRequestConflict",
+        MISSING_KEY_ERROR,
+    )
 
     def __init__(
         self,
@@ -50,23 +141,171 @@ class BaseCollator(ABC):
         ts_updated,
         log_type,
         write_txt=None,
+        row_hash_index="hash",
+        dictionary_encode=False,
+        projection=False,
+        streaming=False,
+        batch_collate=False,
+        binary_hashes=False,
+        diff_parts=False,
+        delta_segments=False,
+        max_delta_segments=8,
+        max_delta_bytes=8 * 1024 * 1024,
+        latest_history=False,
+        partitioned=False,
+        min_partitioned_logs=0,
+        state_cache=None,
+        conditional_writes=False,
+        max_write_attempts=3,
+        coalesced_file_keys=(),
+        concurrent_io=False,
+        io_workers=4,
     ):
         self.s3_client = s3_client
         self.s3_bucket = s3_bucket
         self.user_id = int(user_id)
         self.device_id = device_id
         self.raw_file_key = raw_file_key
+        # Raw files uploaded by the device after raw_file_key can be applied in order by
+        # the same collation, which reads and writes the collated logs once for all
+        self.raw_file_keys = [raw_file_key] + list(coalesced_file_keys)
         self.log_type = log_type
         self.ts_updated = ts_updated
         self.write_txt = write_txt if write_txt is not None else True
-        self.ids = set()
+        self.row_hash_index = row_hash_index
+        # Streaming reads the existing logs from S3 one row group at a time, which
+        # relies on the fields being read separately as with projection
+        self.streaming = streaming
+        # Partitions are read and written with projection, for the collators that
+        # support them
+        self.partitioned = partitioned and self.PARTITION_BY is not None
+        self.projection = projection or streaming or self.partitioned
+        # Users with fewer logs than min_partitioned_logs in their current file are kept
+        # in it rather than moved to month partitions, as short histories are collated
+        # faster from a single file
+        self.min_partitioned_logs = min_partitioned_logs
+        self.batch_collate = batch_collate
+        self.schema = self.SCHEMA
+        if dictionary_encode:
+            self.schema = dictionary_encoded(self.SCHEMA, self.DICTIONARY_FIELDS)
+        # Hashes are hex strings in memory, and optionally stored as bytes
+        self.file_schema = self.schema
+        if binary_hashes:
+            self.file_schema = binary_hash_fields(self.schema, self.HASH_FIELDS)
+        self.key_schema = pa.schema(
+            [self.SCHEMA.field(field) for field in self.KEY_FIELDS]
+            + [pa.field(self.POSITION_KEY, pa.int64())]
+        )
         self.key = self.CURRENT_COLLATED_LOGS_KEY.format(self.log_type, self.user_id)
         self.diff_key = self.CHANGED_LOGS_KEY.format(
             self.log_type, self._batch_ts(self.ts_updated), self.user_id
         )
+        # Part names sort in the order the changes were collated
+        part_name = "{:%Y%m%dT%H%M%S%f}-{}".format(self.ts_updated, uuid.uuid4().hex)
+        self.part_name = part_name
+        self.diff_parts = diff_parts
+        self.diff_part_key = self.CHANGED_LOGS_PART_KEY.format(
+            self.log_type, self._batch_ts(self.ts_updated), self.user_id, part_name
+        )
+        self.delta_segments = delta_segments
+        self.max_delta_segments = max_delta_segments
+        self.max_delta_bytes = max_delta_bytes
+        if latest_history and delta_segments:
+            raise ValueError("latest_history and delta_segments cannot be combined")
+        self.latest_history = latest_history
+        self.latest_key = self.CURRENT_LATEST_LOGS_KEY.format(
+            self.log_type, self.user_id
+        )
+        self.partitions_summary_key = self.CURRENT_PARTITIONS_SUMMARY_KEY.format(
+            self.log_type, self.user_id
+        )
+        self.partitions_prefix = self.key[: -len("logs.parquet")]
+        self.history_key = self.HISTORY_LOGS_PART_KEY.format(
+            self.log_type, self.user_id, part_name
+        )
+        if self.partitioned and (latest_history or delta_segments):
+            raise ValueError(
+                "partitioned cannot be combined with latest_history or delta_segments"
+            )
+        # Existing files are read from the local cache when unchanged, and the files
+        # written are cached for the next collation of the user
+        self.state_cache = state_cache
+        self.state_cache_hits = 0
+        self.state_cache_misses = 0
+        # With conditional_writes, current files are only written if they are unchanged
+        # since they were read, and collation is retried from the existing logs when
+        # they changed, up to max_write_attempts times
+        self.conditional_writes = conditional_writes
+        self.max_write_attempts = max_write_attempts
+        self.write_attempts = 0
+        # New logs written to partitions by attempts that conflicted on another
+        # partition, which are existing logs to the next attempt but still changes
+        self.committed_logs = []
+        # With month partitions, the raw files are collated once, ahead of reading the
+        # partitions of the first attempt that finds a summary of them, as entries or
+        # batches by key, along with the row hashes of their logs in each partition for
+        # each raw file
+        self.collated_raw_files = {}
+        self.raw_file_row_hashes = []
+        # With concurrent_io, the first raw file is opened and the diff downloaded while
+        # the existing logs are read, and the current file is uploaded while the txt file
+        # is created, by up to io_workers threads. Futures of the reads by key, and of
+        # the writes not waited for yet
+        self.concurrent_io = concurrent_io
+        self.io_workers = io_workers
+        self.io_executor = None
+        self.pending_reads = {}
+        self.pending_writes = []
         self.txt_logs_key = self.TXT_LOGS_KEY.format(
             self.user_id, self.device_id, self.log_type
         )
+        self._reset_state()
+
+    def _reset_state(self):
+        # State of a collation attempt, from the existing logs it reads
+        self.ids = set()
+        self.splits_full_logs = False
+        # Name of the partition of each existing segment, None for the current file of
+        # a user collated before partitioning
+        self.segment_partitions = []
+        # Whether a user with fewer than min_partitioned_logs logs is kept in the current
+        # file, which is then written as without partitions
+        self.keeps_current_file = False
+        # With month partitions, the stats of each partition by name that the summary
+        # of the partitions is up to date with, and the txt file written along with
+        # them, and the txt logs read back from that file. Partitions left unread are
+        # only counted from their stats
+        self.partition_stats = None
+        self.summary_txt = None
+        self.summary_txt_logs = None
+        # Row hashes of the raw files in the partitions left unread, which are those of
+        # latest versions of logs
+        self.unread_row_hashes = []
+        # Row hashes of the SMS logs of each partition written whose datetime may have
+        # been corrected for the future timestamp issue before they were routed there,
+        # as found by clamped_row_hashes
+        self.clamped_row_hashes = {}
+        self.history_deleted_ids = set()
+        self.history_txt_logs = {}
+        # ETag of each existing file read, or None if it was missing
+        self.etags = {}
+        # The existing logs are read from segments of (ParquetFile, S3File or None):
+        # the current file, then its live deltas
+        self.existing_segments = []
+        self.base_exists = False
+        self.deltas = []
+        self.delta_keys = []
+        self.stale_delta_keys = []
+        self.delta_bytes = 0
+        # Key of the next delta, following the deltas read, and whether the changes
+        # were put there by a compaction
+        self.delta_key = None
+        self.claimed_delta = False
+        self.all_existing_keys = None
+        self.existing_keys = None
+        # New logs of the raw files already applied, as a table with the positions
+        # following the existing logs
+        self.applied_logs = self.schema.empty_table()
         self.existing_logs = None
         self.existing_row_hashes = None
         self.new_logs = []
@@ -75,72 +314,545 @@ class BaseCollator(ABC):
         self.new_logs_count = 0
         self.deleted_logs_count = 0
         self.total_logs_count = 0
+        # Body of the txt file, put once the current logs are written with concurrent_io
+        self.txt_body = None
 
     def collate(self):
         """Primary public method that does all parts of collation"""
-        self._retrieve_existing_entries()
-        self._process_new_logs()
-        self._process_deletions()
-        self._write_updates()
+        if not self.concurrent_io:
+            self._collate()
+            return
+        with ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            self.io_executor = executor
+            try:
+                self._prefetch_inputs()
+                self._collate()
+            finally:
+                self.io_executor = None
+
+    def _collate(self):
+        while True:
+            self.write_attempts += 1
+            try:
+                self._retrieve_existing_entries()
+                for index, raw_file_key in enumerate(self.raw_file_keys):
+                    if index > 0:
+                        self._apply_new_logs()
+                    self._process_new_logs(raw_file_key)
+                    self._process_deletions()
+                self._write_updates()
+                break
+            except ClientError as ex:
+                if (
+                    not self._is_write_conflict(ex)
+                    or self.write_attempts >= self.max_write_attempts
+                ):
+                    raise ex
+            LOGGER.warning(
+                "Current %s logs for user: %s changed during collation, retrying",
+                self.log_type,
+                self.user_id,
+            )
+            self._reset_state()
+        # The changes are only written once the current logs they apply to are written,
+        # as is the txt file with concurrent_io
+        if self.txt_body is not None:
+            self._put_in_background(
+                self.txt_logs_key, self.txt_body, "_write_updates.put_txt"
+            )
+        self._write_diff()
+        self._wait_for_writes()
+
+    def _prefetch_inputs(self):
+        # The first raw file and the changes written so far do not depend on the
+        # existing logs, and are requested while they are read. The raw file is then
+        # decoded as it is downloaded, and the raw files coalesced with it are only
+        # requested once it is
+        self.pending_reads[self.raw_file_key] = self._submit(
+            "_prefetch_inputs.raw_file", self._open_raw_file, self.raw_file_key
+        )
+        if not self.diff_parts:
+            self.pending_reads[self.diff_key] = self._submit(
+                "_prefetch_inputs.diff", self._read_diff
+            )
+        if self.partitioned:
+            self.pending_reads[self.partitions_prefix] = self._submit(
+                "_prefetch_inputs.list_partitions", self._list_partitions
+            )
+        if self._reads_hit_partitions():
+            self.pending_reads[self.partitions_summary_key] = self._submit(
+                "_prefetch_inputs.partitions_summary", self._read_partitions_summary
+            )
+
+    def _submit(self, span_name, fn, *args):
+        # Runs fn on the I/O threads, in a span of its own
+        def run():
+            with tracer.trace(span_name):
+                return fn(*args)
+
+        return self.io_executor.submit(run)
+
+    def _put_in_background(self, key, body, span_name):
+        # Puts the object on the I/O threads with concurrent_io, and right away otherwise
+        if self.io_executor is None:
+            self._put_object(key, body)
+        else:
+            self.pending_writes.append(
+                self._submit(span_name, self._put_object, key, body)
+            )
+
+    def _wait_for_writes(self):
+        # Waits for all the writes in the background, and raises the error of the first
+        # one that failed
+        pending_writes, self.pending_writes = self.pending_writes, []
+        wait(pending_writes)
+        for future in pending_writes:
+            if future.exception() is not None:
+                raise future.exception()
 
     @tracer.wrap("_retrieve_existing_entries")
     def _retrieve_existing_entries(self):
         """Initializes the collator with the existing collated entries stored on S3"""
         try:
-            result = self.s3_client.get_object(Bucket=self.s3_bucket, Key=self.key)
-            self.all_existing_logs = reader(result["Body"])
-            self.existing_logs = self._create_unique_set(self.all_existing_logs)
-            self.existing_row_hashes = [log["row_hash"] for log in self.existing_logs]
-            self.all_existing_logs_count = len(self.all_existing_logs)
-            self.existing_logs_count = len(self.existing_logs)
+            if self.delta_segments:
+                self.deltas = list_deltas(self.s3_client, self.s3_bucket, self.key)
+            if self.partitioned:
+                self._open_partitions()
+            elif self.latest_history:
+                self._open_latest()
+            else:
+                self._open_existing(self.key)
         except ClientError as ex:
             # If this is the first log seen for a given user, simply create an empty df
-            if ex.response["Error"]["Code"] == self.MISSING_KEY_ERROR:
+            if ex.response["Error"]["Code"] != self.MISSING_KEY_ERROR:
+                raise ex
+            if not self.deltas:
                 self.all_existing_logs = []
+                self.all_existing_keys = self.key_schema.empty_table()
                 self.existing_logs = []
-                self.existing_row_hashes = set()
-            else:
+                self.existing_keys = self.key_schema.empty_table()
+                self.existing_row_hashes = build_row_hash_index([], self.row_hash_index)
+                return
+        if self.delta_segments:
+            self._open_deltas()
+
+        if self.projection:
+            self._create_unique_key_table()
+        else:
+            if self._reads_segments():
+                self.all_existing_logs = self._read_segment_logs()
+            self.existing_logs = self._create_unique_set(self.all_existing_logs)
+            self.existing_row_hashes = build_row_hash_index(
+                (log["row_hash"] for log in self.existing_logs),
+                self.row_hash_index,
+            )
+            self.all_existing_logs_count = len(self.all_existing_logs)
+            self.existing_logs_count = len(self.existing_logs)
+
+    def _reads_segments(self):
+        return (
+            self.delta_segments or self.latest_history or self.state_cache is not None
+        )
+
+    def _open_existing(self, key):
+        if self.projection or self._reads_segments():
+            self.existing_segments.append(self._open_segment(key))
+            self.base_exists = True
+        else:
+            result = self.s3_client.get_object(Bucket=self.s3_bucket, Key=key)
+            self.etags[key] = result["ETag"]
+            self.all_existing_logs = reader(result["Body"], hex_hashes=True)
+
+    def _open_latest(self):
+        # Users collated before the latest/history layout are read from their full
+        # current file, which is split by the next write
+        try:
+            self._open_existing(self.latest_key)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != self.MISSING_KEY_ERROR:
                 raise ex
+            self._open_existing(self.key)
+            self.splits_full_logs = True
+            return
+        metadata = self.existing_segments[0][0].schema_arrow.metadata or {}
+        self.history_deleted_ids = set(
+            json.loads(metadata.get(self.HISTORY_DELETED_IDS_KEY, b"[]"))
+        )
+        self.history_txt_logs = json.loads(
+            metadata.get(self.HISTORY_TXT_LOGS_KEY, b"{}")
+        )
+
+    def _open_partitions(self):
+        # Users collated before partitioning are read from their current file, whose
+        # logs are moved to their partitions by the next write unless the user is kept
+        # in it
+        if self._keeps_current_file():
+            return
+        future = self.pending_reads.pop(self.partitions_prefix, None)
+        keys, etags = future.result() if future is not None else self._list_partitions()
+        # New users start in the current file as well
+        if not keys and self._reads_hit_partitions() and self.min_partitioned_logs > 0:
+            self.keeps_current_file = True
+            return
+        # Only the logs of the device being collated can change, and their ids include
+        # the device, so the partitions of other devices are left unread once the
+        # current file has been moved
+        if self.PARTITION_BY == "device" and None not in keys:
+            name = f"device={self.device_id}"
+            keys = {name: keys[name]} if name in keys else {}
+        if self._reads_hit_partitions():
+            keys = self._partitions_to_read(keys, etags)
+        for name, key in keys.items():
+            if name is None and self.segment_partitions == [None]:
+                continue
+            self.existing_segments.append(self._open_segment(key))
+            self.segment_partitions.append(name)
+        self.base_exists = bool(self.existing_segments)
+
+    def _list_partitions(self):
+        # Returns the keys and ETags of the current files of the user by partition name,
+        # None for the current file from before partitioning
+        keys = {}
+        etags = {}
+        prefix = self.partitions_prefix
+        for content in list_objects(self.s3_client, self.s3_bucket, prefix):
+            name, _, file_name = content["Key"][len(prefix) :].rpartition("/")
+            if file_name != "logs.parquet" or "/" in name:
+                continue
+            if name == "" or name.startswith(self.PARTITION_BY + "="):
+                keys[name or None] = content["Key"]
+                etags[name or None] = content.get("ETag")
+        return keys, etags
+
+    def _keeps_current_file(self):
+        # With min_partitioned_logs, the current file is read first, as for users
+        # without partitions, and users with fewer logs are kept in it
+        if not self._reads_hit_partitions() or self.min_partitioned_logs <= 0:
+            return False
+        try:
+            segment = self._open_segment(self.key)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != self.MISSING_KEY_ERROR:
+                raise ex
+            return False
+        self.existing_segments.append(segment)
+        self.segment_partitions.append(None)
+        self.base_exists = True
+        self.keeps_current_file = (
+            segment[0].metadata.num_rows < self.min_partitioned_logs
+        )
+        return self.keeps_current_file
+
+    def _reads_hit_partitions(self):
+        return self.partitioned and self.PARTITION_BY == "month"
+
+    def _partitions_to_read(self, keys, etags):
+        # Every version of a log is in the partition of the month of the datetime in its
+        # id, unless it is an SMS log whose datetime was corrected before it was routed.
+        # Only the partitions where the logs of the raw files may change are read, as
+        # found from the summary of the partitions, along with those the summary is not
+        # up to date with
+        future = self.pending_reads.pop(self.partitions_summary_key, None)
+        self.etags[self.partitions_summary_key], summary = (
+            future.result() if future is not None else self._read_partitions_summary()
+        )
+        stats, stale = summary_stats(summary, etags)
+        if not stats or None in keys:
+            return keys
+        self.partition_stats = stats
+        if not self.collated_raw_files:
+            self._collate_raw_files()
+        # With concurrent_io, the txt file of the summary is read along with the
+        # partitions
+        self.summary_txt = summary.get("txt")
+        if (
+            self.write_txt
+            and self.summary_txt is not None
+            and self.io_executor is not None
+        ):
+            self.pending_reads[self.summary_txt["key"]] = self._submit(
+                "_retrieve_existing_entries.read_txt",
+                self._read_txt_body,
+                self.summary_txt["key"],
+            )
+        # The deletions of SMS logs are not found, so that partitions without their logs
+        # have no changes
+        names = stale | changed_partitions(
+            stats, self.raw_file_row_hashes, self.device_id, self.log_type != "sms_log"
+        )
+        self.unread_row_hashes = [
+            row_hash
+            for row_hashes in self.raw_file_row_hashes
+            for name, partition_row_hashes in row_hashes.items()
+            if name not in names
+            for row_hash in partition_row_hashes
+        ]
+        return {name: key for name, key in keys.items() if name in names}
+
+    def _read_partitions_summary(self):
+        # Returns the ETag and content of the summary of the partitions, which are None
+        # if it is missing
+        try:
+            result = self.s3_client.get_object(
+                Bucket=self.s3_bucket, Key=self.partitions_summary_key
+            )
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != self.MISSING_KEY_ERROR:
+                raise ex
+            return None, None
+        return result["ETag"], json.load(result["Body"])
+
+    def _read_summary_txt_logs(self):
+        # The txt logs are read back from the txt file of the summary if it is unchanged
+        if self.summary_txt is None:
+            return None
+        future = self.pending_reads.pop(self.summary_txt["key"], None)
+        body = (
+            future.result()
+            if future is not None
+            else self._read_txt_body(self.summary_txt["key"])
+        )
+        return summary_txt_logs(self.summary_txt, body)
+
+    def _read_txt_body(self, key):
+        try:
+            return self.s3_client.get_object(Bucket=self.s3_bucket, Key=key)[
+                "Body"
+            ].read()
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != self.MISSING_KEY_ERROR:
+                raise ex
+            return None
+
+    def _unread_partition_stats(self):
+        # Stats of the partitions in the summary that were left unread
+        if self.partition_stats is None:
+            return []
+        return [
+            stats
+            for name, stats in self.partition_stats.items()
+            if name not in self.segment_partitions
+        ]
+
+    def _open_segment(self, key):
+        if self.state_cache is not None:
+            parquet_file, self.etags[key], hit = self.state_cache.open(
+                self.s3_client, self.s3_bucket, key
+            )
+            if hit:
+                self.state_cache_hits += 1
+            else:
+                self.state_cache_misses += 1
+            return parquet_file, None
+        if self.streaming:
+            s3_file = S3File(self.s3_client, self.s3_bucket, key)
+            self.etags[key] = s3_file.etag
+            return ParquetFile(s3_file), s3_file
+        result = self.s3_client.get_object(Bucket=self.s3_bucket, Key=key)
+        self.etags[key] = result["ETag"]
+        return open_parquet_file(result["Body"]), None
+
+    def _open_deltas(self):
+        # Deltas already merged into the current file were left behind by an
+        # interrupted compaction, and are deleted with the next write
+        live = self.deltas
+        schema = None
+        if self.base_exists:
+            schema = self.existing_segments[0][0].schema_arrow
+            live = live_deltas(self.deltas, schema)
+        self.delta_key = self.CURRENT_COLLATED_LOGS_DELTA_KEY.format(
+            self.log_type,
+            self.user_id,
+            next_delta_name(
+                self.deltas, schema, None if self.conditional_writes else self.part_name
+            ),
+        )
+        self.delta_keys = [key for key, _ in live]
+        self.stale_delta_keys = [
+            key for key, _ in self.deltas if key not in self.delta_keys
+        ]
+        self.delta_bytes = sum(size for _, size in live)
+        for key in self.delta_keys:
+            self.existing_segments.append(self._open_segment(key))
+
+    def _read_segment_logs(self):
+        # Same as reader on the existing logs, when they are split into segments
+        logs = []
+        for parquet_file, _ in self.existing_segments:
+            logs.extend(
+                table_to_dicts(hex_hash_columns(read_file_columns(parquet_file)))
+            )
+        return logs
+
+    @tracer.wrap("_apply_new_logs")
+    def _apply_new_logs(self):
+        """Adds the changes of the raw files processed so far to the existing logs, as
+        the collation of the next raw file would read them after they were written"""
+        self.ids = set()
+        if self.projection:
+            self.applied_logs = dicts_to_table(self.new_logs, self.schema)
+            keys = self.applied_logs.select(self.KEY_FIELDS).append_column(
+                self.POSITION_KEY,
+                pa.array(
+                    range(
+                        self.all_existing_keys.num_rows,
+                        self.all_existing_keys.num_rows + len(self.new_logs),
+                    ),
+                    pa.int64(),
+                ),
+            )
+            keys = pa.concat_tables(
+                [self.all_existing_keys, conform_table(keys, self.key_schema)]
+            )
+            self.existing_keys = keys.take(
+                latest_version_positions(keys.column("id"), keys.column("ts_updated"))
+            )
+            row_hashes = (
+                self.existing_keys.column("row_hash").to_pylist()
+                + self.unread_row_hashes
+            )
+        else:
+            self.existing_logs = self._create_unique_set(
+                self.all_existing_logs + self.new_logs
+            )
+            row_hashes = (log["row_hash"] for log in self.existing_logs)
+        self.existing_row_hashes = build_row_hash_index(row_hashes, self.row_hash_index)
 
     @tracer.wrap("_process_new_logs")
-    def _process_new_logs(self):
+    def _process_new_logs(self, raw_file_key):
         """Creates new collated log entries for all new or updated raw entries"""
-        body = self.s3_client.get_object(Bucket=self.s3_bucket, Key=self.raw_file_key)[
-            "Body"
-        ].read()
+        collated = self.collated_raw_files.get(raw_file_key)
 
-        # Attempt to decompress logs
-        try:
-            body = gzip.GzipFile(fileobj=io.BytesIO(body), mode="rb").read()
-        except gzip.BadGzipFile:
-            # Assume this is a text file, not a gzip file
-            pass
+        if self.batch_collate:
+            # Entries are collated as columns a batch at a time, as they are decoded
+            if collated is None:
+                collated = map(
+                    self._collate_batch, self._iter_raw_batches(raw_file_key)
+                )
+            new_logs = []
+            for batch in collated:
+                new_logs.extend(self._collate_new_logs_batch(batch))
+            self.new_logs.extend(new_logs)
+            self.new_logs_count += len(new_logs)
+            return
+
+        if collated is None:
+            collated = self._iter_collated_entries(raw_file_key)
+        else:
+            # Entries collated ahead are updated in place by each attempt
+            collated = map(dict, collated)
+        new_logs = []
+        for collated_entry in collated:
+            self.ids.add(collated_entry["id"])
+            if collated_entry["row_hash"] not in self.existing_row_hashes:
+                collated_entry["ts_updated"] = self.ts_updated
+                new_logs.append(collated_entry)
+        self.new_logs.extend(new_logs)
+        self.new_logs_count += len(new_logs)
+
+    def _iter_collated_entries(self, raw_file_key):
+        for raw_entry in self._read_raw_entries(raw_file_key):
+            collated_entry = {}
+            collated_entry["user_id"] = self.user_id
+            collated_entry["device_id"] = self.device_id
+            collated_entry["is_deleted"] = False
+            if self.collate_entry(collated_entry, raw_entry):
+                yield collated_entry
 
+    def _iter_raw_batches(self, raw_file_key):
+        raw_entries = self._read_raw_entries(raw_file_key)
+        while raw_batch := list(itertools.islice(raw_entries, self.RAW_BATCH_SIZE)):
+            yield raw_batch
+
+    @tracer.wrap("_collate_raw_files")
+    def _collate_raw_files(self):
+        # The raw files are collated before the existing logs are read, to find the
+        # partitions of their logs from the datetimes in their ids. Their collated
+        # entries are held in memory until they are written
+        for raw_file_key in self.raw_file_keys:
+            if self.batch_collate:
+                collated = [
+                    self._collate_batch(raw_batch)
+                    for raw_batch in self._iter_raw_batches(raw_file_key)
+                ]
+                tables = [batch.select(["datetime", "row_hash"]) for batch in collated]
+            else:
+                collated = list(self._iter_collated_entries(raw_file_key))
+                tables = [
+                    pa.table(
+                        {
+                            "datetime": pa.array(
+                                [entry["datetime"] for entry in collated],
+                                pa.timestamp("us"),
+                            ),
+                            "row_hash": pa.array(
+                                [entry["row_hash"] for entry in collated], pa.string()
+                            ),
+                        }
+                    )
+                ]
+            self.collated_raw_files[raw_file_key] = collated
+            row_hashes = {}
+            for table in tables:
+                names = self._partition_names(table)
+                for name in pc.unique(names).to_pylist():
+                    row_hashes.setdefault(name, set()).update(
+                        table.column("row_hash")
+                        .filter(pc.equal(names, name))
+                        .to_pylist()
+                    )
+            self.raw_file_row_hashes.append(row_hashes)
+
+    def _read_raw_entries(self, raw_file_key):
+        # Yields the raw entries of an upload as they are downloaded and decoded, so
+        # that only one of them is held in memory at a time. Each collation attempt
+        # downloads the upload again
+        future = self.pending_reads.pop(raw_file_key, None)
+        body = (
+            future.result() if future is not None else self._open_raw_file(raw_file_key)
+        )
         try:
-            raw_entries = json.loads(body)
+            # Logs are decompressed if gzipped, or assumed to be text otherwise
+            yield from iter_json_array(open_gzip_or_plain(body))
         except json.decoder.JSONDecodeError:
             LOGGER.error(
                 "Unable to decode JSON in file: %s for user: %s on device: %s",
-                self.raw_file_key,
+                raw_file_key,
                 self.user_id,
                 self.device_id,
             )
             raise
+        finally:
+            body.close()
 
-        new_logs = []
-        for raw_entry in raw_entries:
-            collated_entry = {}
-            collated_entry["user_id"] = self.user_id
-            collated_entry["device_id"] = self.device_id
-            collated_entry["is_deleted"] = False
-            if not self.collate_entry(collated_entry, raw_entry):
-                continue
-            self.ids.add(collated_entry["id"])
-            if collated_entry["row_hash"] not in self.existing_row_hashes:
-                collated_entry["ts_updated"] = self.ts_updated
-                new_logs.append(collated_entry)
-        self.new_logs.extend(new_logs)
-        self.new_logs_count = len(new_logs)
+    def _open_raw_file(self, raw_file_key):
+        return self.s3_client.get_object(Bucket=self.s3_bucket, Key=raw_file_key)[
+            "Body"
+        ]
+
+    def _collate_batch(self, raw_entries):
+        with tracer.trace("_process_new_logs.collate_batch"):
+            return self.collate_batch(raw_entries)
+
+    def _collate_new_logs_batch(self, collated):
+        # Same as the loop in _process_new_logs, with the entries collated as columns.
+        # Only the new entries are converted back to dicts
+        self.ids.update(collated.column("id").to_pylist())
+        is_new = [
+            row_hash not in self.existing_row_hashes
+            for row_hash in collated.column("row_hash").to_pylist()
+        ]
+        new_table = collated.filter(pa.array(is_new, pa.bool_()))
+        index = new_table.schema.get_field_index("ts_updated")
+        new_table = new_table.set_column(
+            index,
+            new_table.schema.field(index),
+            pa.repeat(
+                pa.scalar(self.ts_updated, new_table.schema.field(index).type),
+                new_table.num_rows,
+            ),
+        )
+        return table_to_dicts(new_table)
 
     @tracer.wrap("_process_deletions")
     def _process_deletions(self):
@@ -150,24 +862,92 @@ class BaseCollator(ABC):
         # deletions in that case
         if self.log_type == "sms_log":
             return
-        for log in self.existing_logs:
-            if (
-                not log["is_deleted"]
-                and log["device_id"] == self.device_id
-                and log["id"] not in self.ids
-            ):
-                deleted_entry = log.copy()
-                deleted_entry["is_deleted"] = True
-                deleted_entry["row_hash"] = self.compute_row_hash(deleted_entry)
-                deleted_entry["ts_updated"] = self.ts_updated
-                deleted_logs.append(deleted_entry)
+        if self.projection:
+            deleted_logs = self._create_deleted_entries()
+        else:
+            for log in self.existing_logs:
+                if (
+                    not log["is_deleted"]
+                    and log["device_id"] == self.device_id
+                    and log["id"] not in self.ids
+                ):
+                    deleted_entry = log.copy()
+                    deleted_entry["is_deleted"] = True
+                    deleted_entry["row_hash"] = self.compute_row_hash(deleted_entry)
+                    deleted_entry["ts_updated"] = self.ts_updated
+                    deleted_logs.append(deleted_entry)
         self.new_logs.extend(deleted_logs)
-        self.deleted_logs_count = len(deleted_logs)
+        self.deleted_logs_count += len(deleted_logs)
+
+    def _create_deleted_entries(self):
+        # Same as the deletion check in _process_deletions, as filters over the key
+        # fields of the existing logs: live logs for this device not in the upload
+        keys = self.existing_keys
+        deleted_keys = keys.filter(
+            pc.and_(
+                pc.and_(
+                    pc.invert(pc.fill_null(keys.column("is_deleted"), False)),
+                    pc.equal(keys.column("device_id"), self.device_id),
+                ),
+                pc.invert(
+                    pc.is_in(
+                        keys.column("id"),
+                        value_set=pa.array(list(self.ids), pa.string()),
+                    )
+                ),
+            )
+        )
+
+        # Deleted entries are built as a table from the full existing logs
+        deleted_table = self._read_full_table(
+            deleted_keys.column(self.POSITION_KEY).to_pylist()
+        )
+        num_rows = deleted_table.num_rows
+        for field, value in [("is_deleted", True), ("ts_updated", self.ts_updated)]:
+            index = deleted_table.schema.get_field_index(field)
+            deleted_table = deleted_table.set_column(
+                index,
+                deleted_table.schema.field(index),
+                pa.repeat(
+                    pa.scalar(value, deleted_table.schema.field(index).type), num_rows
+                ),
+            )
+        # Same as compute_row_hash on each deleted entry
+        index = deleted_table.schema.get_field_index("row_hash")
+        deleted_table = deleted_table.set_column(
+            index,
+            deleted_table.schema.field(index),
+            pa.array(
+                hash_columns(
+                    [deleted_table.column(field) for field in self.ROW_HASH_FIELDS]
+                ),
+                pa.string(),
+            ),
+        )
+        return table_to_dicts(deleted_table)
 
     @tracer.wrap("_write_updates")
     def _write_updates(self):
         """Writes updated collated log parquet and txt files back to S3"""
+        try:
+            if self.partitioned and not self.keeps_current_file:
+                self._write_partition_updates()
+            elif self.latest_history:
+                self._write_latest_updates()
+            elif self.projection:
+                self._write_table_updates()
+            else:
+                self._write_log_updates()
+            # Conflicts of the writes in the background are raised here
+            self._wait_for_writes()
+        except ClientError as ex:
+            # Changes put as a delta before a conflict are existing logs to the next
+            # attempt, but still changes of this collation
+            if self.claimed_delta and self._is_write_conflict(ex):
+                self.committed_logs.extend(self.new_logs)
+            raise ex
 
+    def _write_log_updates(self):
         # combining existing logs and new logs
         with tracer.trace("_write_updates.combine"):
             self.all_existing_logs.extend(self.new_logs)
@@ -180,9 +960,24 @@ class BaseCollator(ABC):
                     self.all_existing_logs
                 )
 
-        # writing the combined logs to parquet file in s3
-        with tracer.trace("_write_updates.write_parquet_combined"):
-            self._write_logs(self.all_existing_logs, self.key, "parquet")
+        # writing the combined logs to parquet file in s3, or only the new logs as a
+        # delta
+        if self._writes_delta():
+            with tracer.trace("_write_updates.write_parquet_delta"):
+                self._write_logs(
+                    self.new_logs, self.delta_key, "parquet", background=True
+                )
+        else:
+            self._claim_delta()
+            with tracer.trace("_write_updates.write_parquet_combined"):
+                self._write_logs(
+                    self.all_existing_logs,
+                    self.key,
+                    "parquet",
+                    self._base_schema(),
+                    background=True,
+                )
+        self._delete_merged_deltas()
 
         # creating txt logs from the combined logs:
         # 1. selecting the required keys
@@ -190,25 +985,640 @@ class BaseCollator(ABC):
         if self.write_txt:
             with tracer.trace("_write_updates.write_txt"):
                 txt_logs = self.create_txt_logs(self.all_existing_logs, self.device_id)
-                self._write_logs(txt_logs, self.txt_logs_key, "txt")
+                self._write_txt(txt_logs)
+
+    def _write_table_updates(self):
+        # combining existing logs and new logs one row group at a time, so that fields
+        # not needed for finding changes are never converted to python objects
+        new_logs_table = dicts_to_table(self.new_logs, self.file_schema)
+        writes_delta = self._writes_delta()
+        out = TableStreamWriter(
+            self.file_schema if writes_delta else self._base_schema()
+        )
+        txt_tables = [] if self.write_txt else None
+        if not writes_delta:
+            for table in self._iter_existing_tables():
+                self._write_table(out, table, txt_tables)
+        elif self.write_txt:
+            # Only the new logs are written to a delta, the txt logs are still created
+            # from all logs, reading only the fields they use
+            self._read_txt_tables(self.existing_segments, txt_tables)
+        self._write_table(out, new_logs_table, txt_tables)
+        self.total_logs_count = out.num_rows
+        if writes_delta:
+            self.total_logs_count += self.all_existing_logs_count
+
+        # Handling future timestamp issue in SMS logs. New logs are corrected in place,
+        # as they are also written to the diff
+        if self.log_type == "sms_log":
+            with tracer.trace("_write_updates.future_timestamp_handler"):
+                BaseCollator.future_timestamp_handler(self.new_logs)
 
+        # writing the combined logs to parquet file in s3, or only the new logs as a
+        # delta
+        with tracer.trace(
+            "_write_updates.write_parquet_delta"
+            if writes_delta
+            else "_write_updates.write_parquet_combined"
+        ):
+            body = out.close()
+            if not writes_delta:
+                self._claim_delta()
+            if out.num_rows > 0:
+                self._put_in_background(
+                    self.delta_key if writes_delta else self.key,
+                    body.to_pybytes(),
+                    "_write_updates.put_parquet",
+                )
+        self._delete_merged_deltas()
+
+        # creating txt logs from only the fields and devices they use
+        if self.write_txt:
+            with tracer.trace("_write_updates.write_txt"):
+                txt_logs = self.create_txt_logs(
+                    table_to_dicts(pa.concat_tables(txt_tables)), self.device_id
+                )
+                self._write_txt(txt_logs)
+
+    def _write_latest_updates(self):
+        # Only the latest version of each log is written to the latest file, and the
+        # versions they supersede are appended to the history. Latest versions are kept
+        # in the order they were collated, as in the current file, so that the txt logs
+        # of logs sharing a txt key are still those of the last one collated
+        if self.projection:
+            logs = pa.concat_tables(
+                list(self._iter_existing_tables())
+                + [dicts_to_table(self.new_logs, self.file_schema)]
+            )
+            # Handling future timestamp issue in SMS logs, new logs are also corrected
+            # in place as they are written to the diff
+            if self.log_type == "sms_log":
+                with tracer.trace("_write_updates.future_timestamp_handler"):
+                    logs = BaseCollator.future_timestamp_table_handler(logs)
+                    BaseCollator.future_timestamp_handler(self.new_logs)
+            positions = np.sort(
+                latest_version_positions(logs.column("id"), logs.column("ts_updated"))
+            )
+            superseded = np.ones(logs.num_rows, dtype=bool)
+            superseded[positions] = False
+            latest_table = logs.take(pa.array(positions, pa.int64()))
+            history_table = logs.filter(pa.array(superseded))
+        else:
+            logs = self.all_existing_logs
+            logs.extend(self.new_logs)
+            if self.log_type == "sms_log":
+                with tracer.trace("_write_updates.future_timestamp_handler"):
+                    logs = BaseCollator.future_timestamp_handler(logs)
+            latest_ids = set(map(id, self._create_unique_set(logs)))
+            latest_logs = [log for log in logs if id(log) in latest_ids]
+            history_table = dicts_to_table(
+                [log for log in logs if id(log) not in latest_ids], self.file_schema
+            )
+            latest_table = dicts_to_table(latest_logs, self.file_schema)
+        self.total_logs_count = latest_table.num_rows
+
+        # creating txt logs from the latest versions of the logs
+        if self.write_txt and self.projection:
+            latest_logs = table_to_dicts(
+                hex_hash_columns(self._txt_table(latest_table))
+            )
+
+        schema = self.file_schema
+        if self.TXT_EXCLUDES_DELETED_IDS:
+            deleted = hex_hash_columns(history_table.select(["id", "is_deleted"]))
+            self.history_deleted_ids.update(
+                deleted.filter(pc.fill_null(deleted.column("is_deleted"), False))
+                .column("id")
+                .to_pylist()
+            )
+            schema = schema.with_metadata(
+                {
+                    self.HISTORY_DELETED_IDS_KEY: json.dumps(
+                        sorted(self.history_deleted_ids)
+                    )
+                }
+            )
+        else:
+            # Superseded versions keep their txt logs under txt keys the latest versions
+            # do not overwrite, such as SMS logs whose datetime was corrected for the
+            # future timestamp issue
+            self.history_txt_logs.update(
+                self.create_txt_logs(
+                    table_to_dicts(hex_hash_columns(self._txt_table(history_table))),
+                    self.device_id,
+                )
+            )
+            if self.write_txt:
+                txt_logs = self.create_txt_logs(latest_logs, self.device_id)
+                self.history_txt_logs = {
+                    key: log
+                    for key, log in self.history_txt_logs.items()
+                    if key not in txt_logs
+                }
+            schema = schema.with_metadata(
+                {self.HISTORY_TXT_LOGS_KEY: json.dumps(self.history_txt_logs)}
+            )
+
+        # The history is written first, so that an interrupted write leaves superseded
+        # versions in both files rather than in neither
+        with tracer.trace("_write_updates.write_parquet_history"):
+            self._put_table(history_table, self.history_key)
+        with tracer.trace("_write_updates.write_parquet_latest"):
+            try:
+                self._put_table(latest_table, self.latest_key, schema)
+            except ClientError as ex:
+                # The superseded versions are appended again by the next attempt
+                if self._is_write_conflict(ex):
+                    delete_objects(self.s3_client, self.s3_bucket, [self.history_key])
+                raise ex
+        if self.splits_full_logs:
+            delete_objects(self.s3_client, self.s3_bucket, [self.key])
+
+        if self.write_txt:
+            with tracer.trace("_write_updates.write_txt"):
+                if self.TXT_EXCLUDES_DELETED_IDS:
+                    # Deleted versions in the history only add their ids to the deleted
+                    # ids
+                    txt_logs = self.create_txt_logs(
+                        [
+                            {"id": deleted_id, "is_deleted": True, "device_id": None}
+                            for deleted_id in sorted(self.history_deleted_ids)
+                        ]
+                        + latest_logs,
+                        self.device_id,
+                    )
+                else:
+                    txt_logs = {**self.history_txt_logs, **txt_logs}
+                self._write_txt(txt_logs)
+
+    def _write_partition_updates(self):
+        # Only the partitions with new logs are rewritten, with their existing logs
+        # followed by their new logs. New logs are routed to partitions by the datetime
+        # in their id, before it is corrected for the future timestamp issue in SMS
+        # logs, so that all versions of a log share a partition
+        new_logs_table = dicts_to_table(self.new_logs, self.file_schema)
+        if self.log_type == "sms_log":
+            with tracer.trace("_write_updates.future_timestamp_handler"):
+                BaseCollator.future_timestamp_handler(self.new_logs)
+        # Logs of a current file from before partitioning are all moved, ahead of the
+        # new logs
+        added = {}
+        unpartitioned = self._partition_segments(None)
+        for table in self._iter_existing_tables(segments=unpartitioned):
+            self._add_to_partitions(added, table)
+        self._add_to_partitions(added, new_logs_table)
+
+        names = set(self.segment_partitions) | set(added)
+        names.discard(None)
+        txt_tables = [] if self.write_txt else None
+        if self.write_txt and self.partition_stats is not None:
+            self.summary_txt_logs = self._read_summary_txt_logs()
+            if self.summary_txt_logs is None:
+                # The txt logs are created from all logs, reading the txt fields of the
+                # partitions left unread as well
+                self._read_txt_tables(
+                    [
+                        self._open_segment(self._partition_key(name))
+                        for name in sorted(self.partition_stats)
+                        if name not in names
+                    ],
+                    txt_tables,
+                )
+        # With concurrent_io, the partitions and their summary are put while the txt
+        # file is created, unless they are written conditionally or the current file is
+        # moved, as it is only deleted once they are written
+        in_background = (
+            self.io_executor is not None
+            and not self.conditional_writes
+            and not unpartitioned
+        )
+        written = {}
+        try:
+            self._write_partitions(
+                sorted(names), added, txt_tables, written, in_background
+            )
+            # The txt logs read back are updated with those of the added logs, as later
+            # logs replace earlier logs with the same txt key
+            txt_body = None
+            if self.write_txt:
+                with tracer.trace("_write_updates.create_txt"):
+                    txt_logs = self.create_txt_logs(
+                        [log for table in txt_tables for log in table_to_dicts(table)],
+                        self.device_id,
+                    )
+                    if self.summary_txt_logs is not None:
+                        txt_logs = {**self.summary_txt_logs, **txt_logs}
+                    if len(txt_logs) > 0:
+                        txt_body = self.create_txt_file(txt_logs)
+            if self._reads_hit_partitions():
+                self._write_partitions_summary(added, written, txt_body, in_background)
+        except ClientError as ex:
+            # New logs written to partitions before a conflict are existing logs to the
+            # next attempt, but still changes of this collation
+            if self._is_write_conflict(ex):
+                new_names = self._partition_names(new_logs_table).to_pylist()
+                self.committed_logs.extend(
+                    log
+                    for log, name in zip(self.new_logs, new_names)
+                    if name in written
+                )
+            raise ex
+        # If interrupted before this, the moved logs are read twice by the next
+        # collation, as duplicate versions that finding changes ignores
+        if unpartitioned:
+            delete_objects(self.s3_client, self.s3_bucket, [self.key])
+
+        if txt_body is not None:
+            with tracer.trace("_write_updates.write_txt"):
+                self._write_txt_body(txt_body)
+
+    def _write_partitions(self, names, added, txt_tables, written, in_background):
+        # Writes the partitions with added logs, and reads the txt fields of the others
+        # unless the txt logs of the summary are updated. The ETags of the partitions
+        # written, or the futures of their puts in the background, are added to written
+        # by name
+        reads_txt = self.write_txt and self.summary_txt_logs is None
+        self.total_logs_count = sum(
+            stats["rows"] for stats in self._unread_partition_stats()
+        )
+        for name in names:
+            segments = self._partition_segments(name)
+            if name not in added:
+                self.total_logs_count += sum(
+                    segment[0].metadata.num_rows for segment in segments
+                )
+                if reads_txt:
+                    self._read_txt_tables(segments, txt_tables)
+                continue
+
+            out = TableStreamWriter(self.file_schema)
+            clamped = self.clamped_row_hashes.setdefault(name, [])
+            for table in self._iter_existing_tables(segments=segments):
+                self._write_table(out, table, txt_tables if reads_txt else None)
+                clamped.extend(self._clamped_row_hashes(name, table))
+            for table in added[name]:
+                self._write_table(out, table, txt_tables)
+                clamped.extend(self._clamped_row_hashes(name, table))
+            self.total_logs_count += out.num_rows
+            key = self._partition_key(name)
+            body = out.close().to_pybytes()
+            if in_background:
+                written[name] = self._submit(
+                    "_write_updates.put_partition", self._put_object, key, body
+                )
+                self.pending_writes.append(written[name])
+            else:
+                with tracer.trace("_write_updates.write_parquet_partition"):
+                    written[name] = self._put_object(key, body)["ETag"]
+
+    def _write_partitions_summary(self, added, written, txt_body, in_background):
+        # The stats of the partitions read or written are computed from their key
+        # fields, and those of the others are kept
+        stats = dict(self.partition_stats or {})
+        key_tables = {}
+        position = 0
+        for (parquet_file, _), name in zip(
+            self.existing_segments, self.segment_partitions
+        ):
+            num_rows = parquet_file.metadata.num_rows
+            key_tables.setdefault(name, []).append(
+                self.all_existing_keys.slice(position, num_rows)
+            )
+            position += num_rows
+        for name, tables in added.items():
+            key_tables.setdefault(name, []).extend(
+                conform_table(table.select(self.KEY_FIELDS), self.key_schema)
+                for table in tables
+            )
+        key_tables.pop(None, None)
+        for name, tables in key_tables.items():
+            etag = written.get(name) or self.etags[self._partition_key(name)]
+            stats[name] = partition_stats(
+                pa.concat_tables(tables), etag, self._partition_clamped(name)
+            )
+        summary = partitions_summary(stats, self.txt_logs_key, txt_body)
+
+        def put_summary():
+            # Partitions put in the background have their ETags once written
+            if in_background:
+                for name, future in written.items():
+                    stats[name]["etag"] = future.result()["ETag"]
+            self._put_object(self.partitions_summary_key, json.dumps(summary))
+
+        if in_background:
+            self.pending_writes.append(
+                self._submit("_write_updates.put_partitions_summary", put_summary)
+            )
+        else:
+            with tracer.trace("_write_updates.write_partitions_summary"):
+                put_summary()
+
+    def _partition_clamped(self, name):
+        # Row hashes of the SMS logs of a partition whose datetime may have been
+        # corrected, found as it is written, or kept from its stats if up to date, or
+        # otherwise read from its fields
+        if name in self.clamped_row_hashes:
+            return self.clamped_row_hashes[name]
+        if name in (self.partition_stats or {}):
+            return self.partition_stats[name]["clamped"]
+        return [
+            row_hash
+            for table in self._iter_existing_tables(
+                columns=["datetime", "ts_updated", "row_hash"],
+                segments=self._partition_segments(name),
+            )
+            for row_hash in self._clamped_row_hashes(name, table)
+        ]
+
+    def _clamped_row_hashes(self, name, table):
+        if self.log_type != "sms_log":
+            return []
+        return clamped_row_hashes(table, name)
+
+    def _partition_key(self, name):
+        return self.CURRENT_COLLATED_LOGS_PARTITION_KEY.format(
+            self.log_type, self.user_id, name
+        )
+
+    def _add_to_partitions(self, added, table):
+        # Adds the logs of a table to the lists of tables of their partitions
+        names = self._partition_names(table)
+        for name in pc.unique(names).to_pylist():
+            added.setdefault(name, []).append(table.filter(pc.equal(names, name)))
+
+    def _partition_names(self, table):
+        return partition_names(table, self.PARTITION_BY, self.DEFAULT_PARTITION)
+
+    def _partition_segments(self, name):
+        return [
+            segment
+            for segment, partition in zip(
+                self.existing_segments, self.segment_partitions
+            )
+            if partition == name
+        ]
+
+    def _put_table(self, table, key, schema=None):
+        if table.num_rows > 0:
+            out = TableStreamWriter(schema or self.file_schema)
+            out.write(table)
+            self._put_object(key, out.close().to_pybytes())
+
+    def _write_table(self, out, table, txt_tables):
+        # Handling future timestamp issue in SMS logs
+        if self.log_type == "sms_log":
+            table = BaseCollator.future_timestamp_table_handler(table)
+        out.write(table)
+        if txt_tables is not None:
+            txt_tables.append(self._txt_table(table))
+
+    def _read_txt_tables(self, segments, txt_tables):
+        # Reads only the txt fields of the logs of the given segments
+        for table in self._iter_existing_tables(self._txt_read_fields(), segments):
+            if self.log_type == "sms_log":
+                table = BaseCollator.future_timestamp_table_handler(table)
+            txt_tables.append(self._txt_table(table))
+
+    def _txt_table(self, table):
+        txt_table = table.select(self._txt_fields())
+        if self.TXT_DEVICE_ONLY:
+            txt_table = txt_table.filter(self._device_mask(txt_table))
+        return txt_table
+
+    def _txt_fields(self):
+        return self.TXT_KEY_FIELDS + [
+            field
+            for field in self.REQUIRED_FIELDS_TXT
+            if field not in self.TXT_KEY_FIELDS
+        ]
+
+    def _txt_read_fields(self):
+        # The txt fields, and the fields the future timestamp handler uses
+        fields = self._txt_fields()
+        if self.log_type == "sms_log":
+            fields += [
+                field for field in ["datetime", "ts_updated"] if field not in fields
+            ]
+        return fields
+
+    def _writes_delta(self):
+        # The changes are appended as a delta to the current file, until the deltas
+        # cross a compaction threshold and are merged into a new current file
+        return (
+            self.delta_segments
+            and self.base_exists
+            and len(self.delta_keys) < self.max_delta_segments
+            and self.delta_bytes < self.max_delta_bytes
+        )
+
+    def _claims_delta(self):
+        # With conditional_writes, a compaction first puts its changes as the next delta
+        # too, so that of the collations compacting or appending to the same logs only
+        # the first to put it writes its changes
+        return (
+            self.conditional_writes
+            and self.delta_segments
+            and self.base_exists
+            and len(self.new_logs) > 0
+            and not self._writes_delta()
+        )
+
+    def _claim_delta(self):
+        if self._claims_delta():
+            with tracer.trace("_write_updates.claim_delta"):
+                self._write_logs(self.new_logs, self.delta_key, "parquet")
+            self.claimed_delta = True
+
+    def _base_schema(self):
+        if self.delta_segments:
+            delta_keys = self.delta_keys + self.stale_delta_keys
+            if self._claims_delta():
+                delta_keys.append(self.delta_key)
+            return with_merged_deltas(self.file_schema, delta_keys)
+        return self.file_schema
+
+    def _delete_merged_deltas(self):
+        # Deltas are deleted only once the current file merging them is written
+        merged_keys = list(self.stale_delta_keys)
+        if not self._writes_delta():
+            merged_keys += self.delta_keys
+            if self.claimed_delta:
+                merged_keys.append(self.delta_key)
+        # With conditional_writes, the last delta merged is kept, so that a collation
+        # still appending to the logs it read conflicts with it, rather than putting a
+        # delta that the current file lists as merged
+        if self.conditional_writes and merged_keys:
+            merged_keys.remove(max(merged_keys, key=delta_sequence))
+        if merged_keys:
+            self._wait_for_writes()
+            with tracer.trace("_write_updates.delete_merged_deltas"):
+                delete_objects(self.s3_client, self.s3_bucket, merged_keys)
+
+    def _write_diff(self):
         # Then, write the new changes to be processed by the batch job, and merge with
         # any existing changes
+        new_logs = self.committed_logs + self.new_logs
         with tracer.trace("_write_updates.write_parquet_diff"):
-            try:
-                result = self.s3_client.get_object(
-                    Bucket=self.s3_bucket, Key=self.diff_key
+            if self.diff_parts:
+                # The changes are written on their own, and merged with the existing
+                # changes by diff_parts.compact_diff
+                self._write_logs(new_logs, self.diff_part_key, "parquet")
+                return
+            for attempt in range(1, self.max_write_attempts + 1):
+                future = self.pending_reads.pop(self.diff_key, None)
+                self.etags[self.diff_key], diff_logs = (
+                    future.result() if future is not None else self._read_diff()
                 )
-                diff_logs = reader(result["Body"])
-                diff_logs.extend(self.new_logs)
-            except ClientError as ex:
-                # If this is the first change seen for a given user, simply write current
-                # changes
-                if ex.response["Error"]["Code"] == self.MISSING_KEY_ERROR:
-                    diff_logs = self.new_logs
-                else:
-                    raise ex
-            self._write_logs(diff_logs, self.diff_key, file_format="parquet")
+                diff_logs.extend(new_logs)
+                try:
+                    self._write_logs(diff_logs, self.diff_key, file_format="parquet")
+                    return
+                except ClientError as ex:
+                    # The changes written meanwhile are read again and merged
+                    if (
+                        not self._is_write_conflict(ex)
+                        or attempt == self.max_write_attempts
+                    ):
+                        raise ex
+
+    def _read_diff(self):
+        # Returns the ETag and logs of the existing changes. If this is the first change
+        # seen for a given user, there are none
+        try:
+            result = self.s3_client.get_object(Bucket=self.s3_bucket, Key=self.diff_key)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != self.MISSING_KEY_ERROR:
+                raise ex
+            return None, []
+        return result["ETag"], reader(result["Body"], hex_hashes=True)
+
+    def _is_write_conflict(self, ex):
+        code = ex.response["Error"]["Code"]
+        if ex.operation_name == "GetObject":
+            # Existing files read with ranged GETs fail to be read further once
+            # overwritten by another collation, which is retried as a conflict
+            return code == "PreconditionFailed"
+        return self.conditional_writes and code in self.WRITE_CONFLICT_CODES
+
+    def _iter_row_groups(self, segments=None):
+        # Yields each row group of the existing logs, or of the given segments, as
+        # (segment, index) in the order of the segments
+        if segments is None:
+            segments = self.existing_segments
+        for segment in segments:
+            for index in range(segment[0].num_row_groups):
+                yield segment, index
+
+    def _read_key_table(self):
+        # Only the fields needed to find changes are read, along with each log's
+        # position in the existing logs to read the remaining fields later
+        tables = [self.key_schema.empty_table()]
+        position = 0
+        for segment, index in self._iter_row_groups():
+            parquet_file = segment[0]
+            self._prefetch(segment, index, self.KEY_FIELDS)
+            for batch in iter_file_batches(
+                parquet_file, self.KEY_FIELDS, row_groups=[index]
+            ):
+                table = pa.Table.from_batches([batch]).append_column(
+                    self.POSITION_KEY,
+                    pa.array(range(position, position + batch.num_rows), pa.int64()),
+                )
+                tables.append(conform_table(table, self.key_schema))
+                position += batch.num_rows
+        return pa.concat_tables(tables)
+
+    def _iter_existing_tables(self, columns=None, segments=None):
+        # Yields the existing logs, or those of the given segments, one row group at a
+        # time with all fields or only the given ones
+        schema = self.file_schema
+        if columns is not None:
+            schema = pa.schema([schema.field(field) for field in columns])
+        for segment, index in self._iter_row_groups(segments):
+            self._prefetch(segment, index, columns)
+            yield conform_table(
+                read_row_group_columns(segment[0], index, columns), schema
+            )
+
+    def _read_full_table(self, positions):
+        # Reads all fields of the existing logs at the given positions, reading only the
+        # row groups that contain them
+        if not positions:
+            return self.schema.empty_table()
+        order = sorted(range(len(positions)), key=positions.__getitem__)
+        tables = []
+        start = 0
+        next_log = 0
+        for segment, index in self._iter_row_groups():
+            end = start + segment[0].metadata.row_group(index).num_rows
+            local_positions = []
+            while next_log < len(order) and positions[order[next_log]] < end:
+                local_positions.append(positions[order[next_log]] - start)
+                next_log += 1
+            if local_positions:
+                self._prefetch(segment, index)
+                table = read_row_group_columns(segment[0], index)
+                tables.append(
+                    conform_table(table, self.schema).take(
+                        pa.array(local_positions, pa.int64())
+                    )
+                )
+            start = end
+        # Positions past the existing logs are of the new logs of raw files already
+        # applied
+        if next_log < len(order):
+            tables.append(
+                self.applied_logs.take(
+                    pa.array(
+                        [
+                            positions[log_index] - start
+                            for log_index in order[next_log:]
+                        ],
+                        pa.int64(),
+                    )
+                )
+            )
+
+        # Rows were read in file order, restore the order of the key logs
+        file_order = [0] * len(order)
+        for row, log_index in enumerate(order):
+            file_order[log_index] = row
+        full_table = pa.concat_tables([self.schema.empty_table()] + tables)
+        return full_table.take(pa.array(file_order, pa.int64()))
+
+    def _prefetch(self, segment, row_group, columns=None):
+        # Reads the column chunks of a row group of an S3-backed file with as few
+        # requests as possible, before pyarrow reads each of them separately
+        parquet_file, s3_file = segment
+        if s3_file is not None:
+            s3_file.prefetch(column_chunk_ranges(parquet_file, columns, [row_group]))
+
+    def _device_mask(self, table):
+        device_ids = table.column("device_id")
+        if pa.types.is_dictionary(device_ids.type):
+            device_ids = device_ids.cast(device_ids.type.value_type)
+        return pc.equal(device_ids, self.device_id)
+
+    def _create_unique_key_table(self):
+        # Same as _create_unique_set, over the key fields of the existing logs
+        self.all_existing_keys = self._read_key_table()
+        self.existing_keys = self.all_existing_keys.take(
+            latest_version_positions(
+                self.all_existing_keys.column("id"),
+                self.all_existing_keys.column("ts_updated"),
+            )
+        )
+        self.existing_row_hashes = build_row_hash_index(
+            self.existing_keys.column("row_hash").to_pylist() + self.unread_row_hashes,
+            self.row_hash_index,
+        )
+        unread = self._unread_partition_stats()
+        self.all_existing_logs_count = self.all_existing_keys.num_rows + sum(
+            stats["rows"] for stats in unread
+        )
+        self.existing_logs_count = self.existing_keys.num_rows + sum(
+            stats["latest"] for stats in unread
+        )
 
     def _create_unique_set(self, logs):
         # We should only consider the most recent version of a log as having as
@@ -220,15 +1630,51 @@ class BaseCollator(ABC):
                 hashes[id] = log
         return hashes.values()
 
-    def _write_logs(self, logs, key, file_format):
+    def _write_logs(self, logs, key, file_format, schema=None, background=False):
         if len(logs) > 0:
             if file_format == "parquet":
-                out = writer(logs)
+                out = writer(logs, schema=schema or self.file_schema)
                 body = out.to_pybytes()
             elif file_format == "txt":
                 body = self.create_txt_file(logs)
 
-            self.s3_client.put_object(Bucket=self.s3_bucket, Key=key, Body=body)
+            if background:
+                self._put_in_background(key, body, f"_write_updates.put_{file_format}")
+            else:
+                self._put_object(key, body)
+
+    def _write_txt(self, txt_logs):
+        if len(txt_logs) > 0:
+            self._write_txt_body(self.create_txt_file(txt_logs))
+
+    def _write_txt_body(self, body):
+        # With concurrent_io, the txt file is put along with the diff once the current
+        # logs are written, rather than by the attempt writing them
+        if self.io_executor is None:
+            self._put_object(self.txt_logs_key, body)
+        else:
+            self.txt_body = body
+
+    def _put_object(self, key, body):
+        # Current files and the changes are only written if they are unchanged since
+        # they were read, or still missing if they were
+        kwargs = {}
+        if self.conditional_writes and (
+            key in self.etags or key.startswith(self.CURRENT_PREFIX)
+        ):
+            etag = self.etags.get(key)
+            kwargs = {"IfMatch": etag} if etag is not None else {"IfNoneMatch": "*"}
+        result = self.s3_client.put_object(
+            Bucket=self.s3_bucket, Key=key, Body=body, **kwargs
+        )
+        # Only current parquet files are read back from the cache by later collations
+        if (
+            self.state_cache is not None
+            and key.startswith(self.CURRENT_PREFIX)
+            and key.endswith(".parquet")
+        ):
+            self.state_cache.put(self.s3_bucket, key, result["ETag"], body)
+        return result
 
     def _batch_ts(self, dt):
         # Change granularity of diff period for backfill, which only applies to past
@@ -275,6 +1721,113 @@ class BaseCollator(ABC):
             result_dt = None
         return result_dt
 
+    @staticmethod
+    def parse_datetime_column(raw_dts):
+        """Same as parse_datetime for each of a list of raw datetimes, returned as an
+        Arrow timestamp array"""
+        # Beyond EXACT_DATETIME_LIMIT, the float division in parse_datetime rounds to
+        # other microseconds
+        if LOCAL_TIME_IS_UTC and all(
+            raw_dt is None
+            or (type(raw_dt) is int and abs(raw_dt) < EXACT_DATETIME_LIMIT // 1000)
+            for raw_dt in raw_dts
+        ):
+            values = pa.array(raw_dts, pa.int64())
+            # Same test as the length of the number in parse_datetime
+            in_ms = pc.or_(
+                pc.greater_equal(values, 10**10), pc.less_equal(values, -(10**9))
+            )
+            units = pc.if_else(
+                in_ms, pa.scalar(1000, pa.int64()), pa.scalar(1000000, pa.int64())
+            )
+            return pc.multiply(values, units).cast(pa.timestamp("us"))
+        return pa.array(
+            [
+                None if raw_dt is None else BaseCollator.parse_datetime(raw_dt)
+                for raw_dt in raw_dts
+            ],
+            pa.timestamp("us"),
+        )
+
+    @staticmethod
+    def compact_lower_column(values):
+        """Same as "".join(value.lower().split()) for each of a list of strings, returned
+        as an Arrow string array"""
+        array = pa.array(values, pa.string())
+        if pc.all(pc.string_is_ascii(array)).as_py() is not False:
+            # Whitespace as in str.split, for ASCII strings
+            return pc.replace_substring_regex(
+                pc.ascii_lower(array), r"[\t\n\x0b\x0c\r\x1c-\x1f ]", ""
+            )
+        return pa.array(
+            [
+                None if value is None else "".join(value.lower().split())
+                for value in values
+            ],
+            pa.string(),
+        )
+
+    @staticmethod
+    def normalize_address_column(values):
+        """Same as the normalization of phone numbers in collate_entry, for each of a
+        list of phone numbers or addresses, returned as an Arrow string array"""
+        array = pa.array(values, pa.string())
+        if pc.all(pc.string_is_ascii(array)).as_py() is not False:
+            # Only letters and digits are word characters, for ASCII strings
+            return pc.replace_substring_regex(pc.ascii_lower(array), "[^a-z0-9]", "")
+        return pa.array(
+            [
+                (
+                    None
+                    if value is None
+                    else re.sub(r"[\W_]", "", "".join(value.lower().split()))
+                )
+                for value in values
+            ],
+            pa.string(),
+        )
+
+    @staticmethod
+    def resolve_column(values, resolve):
+        """Applies resolve once to each distinct value of a list of raw values"""
+        resolved = {value: resolve(value) for value in set(values)}
+        return [resolved[value] for value in values]
+
+    @staticmethod
+    def raw_column(raw_entries, fields):
+        """Same as _read_raw_field for each of a list of raw entries"""
+        if isinstance(fields, list) and len(fields) > 1:
+            return [BaseCollator._read_raw_field(fields, raw) for raw in raw_entries]
+        if isinstance(fields, list):
+            fields = fields[0]
+        return [raw_entry.get(fields) for raw_entry in raw_entries]
+
+    def _log_unexpected_fields(self, raw_entries):
+        # Logs the unexpected fields of a batch of raw entries once, rather than for
+        # each entry as collate_entry does
+        fields = set()
+        for raw_entry in raw_entries:
+            fields.update(raw_entry.keys())
+        if unexpected_fields := ",".join(
+            sorted(field for field in fields if field not in self.SCHEMA_RAW)
+        ):
+            LOGGER.warning(
+                "Unexpected field(s) %s found for user: %s on device: %s",
+                unexpected_fields,
+                self.user_id,
+                self.device_id,
+            )
+
+    def _batch_table(self, columns, num_rows):
+        # Builds the table of a collated batch, with the fields every collated entry
+        # starts with. ts_updated is set when the batch is compared to existing logs
+        columns["user_id"] = pa.repeat(pa.scalar(self.user_id, pa.int64()), num_rows)
+        columns["device_id"] = pa.repeat(
+            pa.scalar(self.device_id, pa.string()), num_rows
+        )
+        columns["is_deleted"] = pa.repeat(pa.scalar(False, pa.bool_()), num_rows)
+        return columns_to_table(columns, self.schema, num_rows)
+
     @staticmethod
     def combine_hash_fields(fields):
         cleaned_fields = []
@@ -296,10 +1849,27 @@ class BaseCollator(ABC):
 
         return corrected_logs
 
+    @staticmethod
+    def future_timestamp_table_handler(table):
+        # Same as future_timestamp_handler, for a table of logs
+        datetimes = table.column("datetime")
+        ts_updated = table.column("ts_updated")
+        in_future = pc.fill_null(pc.greater(datetimes, ts_updated), False)
+        return table.set_column(
+            table.schema.get_field_index("datetime"),
+            table.schema.field("datetime"),
+            pc.if_else(in_future, ts_updated, datetimes),
+        )
+
     @abstractmethod
     def collate_entry(collated_entry, raw_entry):
         pass
 
+    @abstractmethod
+    def collate_batch(self, raw_entries):
+        """Same as collate_entry for each of a list of raw entries, processing them as
+        columns. Returns a table of the collated entries with ts_updated unset"""
+
     @abstractmethod
     def compute_row_hash(entry):
         pass
@@ -0,0 +1,86 @@
+"""Hashing of collated log fields one column at a time. Gives the same hex MD5 digests as
+hashing each entry with BaseCollator.combine_hash_fields, with the fields of all rows
+converted to strings and joined by Arrow kernels, so only the MD5 itself is computed
+for each row in python"""
+
+import hashlib
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def hash_columns(columns):
+    """Returns the hex MD5 digest of each row of the given columns, joined as
+    combine_hash_fields joins the fields of an entry: null fields are skipped and the
+    others are converted as str() would. Each column is a list, a pyarrow Array or a
+    pyarrow Scalar repeated on every row. At least one column must not be a Scalar"""
+    joined = pc.binary_join_element_wise(
+        *[hash_strings(column) for column in columns], ":", null_handling="skip"
+    )
+    return md5_hex(joined)
+
+
+def hash_strings(column):
+    """Returns a column of values converted to strings as str() would, with nulls kept"""
+    if isinstance(column, pa.Scalar):
+        if not column.is_valid:
+            return pa.scalar(None, pa.string())
+        return pa.scalar(hash_strings(pa.array([column.as_py()], column.type))[0])
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    elif not isinstance(column, pa.Array):
+        try:
+            column = pa.array(column)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            # Values of several types are converted one by one
+            return _str_array(column)
+
+    arrow_type = column.type
+    if pa.types.is_dictionary(arrow_type):
+        column = column.cast(arrow_type.value_type)
+        arrow_type = column.type
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return column
+    if pa.types.is_integer(arrow_type):
+        return pc.cast(column, pa.string())
+    if pa.types.is_boolean(arrow_type):
+        return pc.if_else(column, "True", "False")
+    if pa.types.is_null(arrow_type):
+        return pa.nulls(len(column), pa.string())
+    if pa.types.is_timestamp(arrow_type) and arrow_type.tz is None:
+        # str() of a datetime leaves out microseconds when there are none. Collated
+        # datetimes have at most microsecond precision
+        column = column.cast(pa.timestamp("us"), safe=False)
+        return pc.replace_substring_regex(
+            pc.strftime(column, format="%Y-%m-%d %H:%M:%S"), r"\.000000$", ""
+        )
+    return _str_array(column.to_pylist())
+
+
+def str_column(column):
+    """Same as hash_strings, with nulls converted to "None" as str(None) would, for
+    fields that are hashed as str(field)"""
+    return pc.fill_null(hash_strings(column), "None")
+
+
+def md5_hex(strings):
+    """Returns the hex MD5 digest of each UTF-8 string of a pyarrow Array"""
+    strings = pc.fill_null(strings, "").cast(pa.large_binary())
+    if isinstance(strings, pa.ChunkedArray):
+        strings = strings.combine_chunks()
+    _, offsets, data = strings.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[
+        strings.offset : strings.offset + len(strings) + 1
+    ].tolist()
+    data = memoryview(data) if data is not None else memoryview(b"")
+    md5 = hashlib.md5
+    return [
+        md5(data[start:end]).hexdigest() for start, end in zip(offsets, offsets[1:])
+    ]
+
+
+def _str_array(values):
+    return pa.array(
+        [None if value is None else str(value) for value in values], pa.string()
+    )
@@ -1,12 +1,44 @@
-"""Builds collators associated with each log type"""
+"""Builds collators associated with each log type. Collator modules are only imported
+once a collator of their log type is built, or when they are pre-warmed"""
 
-from app_collator import AppCollator
-from call_collator import CallCollator
-from contacts_collator import ContactsCollator
-from sms_collator import SmsCollator
+import importlib
+import threading
 
 
 class CollatorFactory:
+    # Module and class name of the collator of each log type
+    COLLATORS = {
+        "app_packages": ("app_collator", "AppCollator"),
+        "contact_list": ("contacts_collator", "ContactsCollator"),
+        "sms_log": ("sms_collator", "SmsCollator"),
+        "call_log": ("call_collator", "CallCollator"),
+    }
+    # Collator classes imported so far, by log type
+    _classes = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def collator_class(log_type):
+        # Given log_type, return the appropriate collator class, importing its module
+        # on first use
+        collator_class = CollatorFactory._classes.get(log_type)
+        if collator_class is not None:
+            return collator_class
+        if log_type not in CollatorFactory.COLLATORS:
+            raise ValueError(f"Unsupported log type: '{log_type}'")
+        module_name, class_name = CollatorFactory.COLLATORS[log_type]
+        with CollatorFactory._lock:
+            collator_class = getattr(importlib.import_module(module_name), class_name)
+            CollatorFactory._classes[log_type] = collator_class
+        return collator_class
+
+    @staticmethod
+    def prewarm(log_types=None):
+        """Imports the collator classes of the given log types, or of all of them, ahead
+        of the first collations"""
+        for log_type in CollatorFactory.COLLATORS if log_types is None else log_types:
+            CollatorFactory.collator_class(log_type)
+
     @staticmethod
     def build(
         log_type,
@@ -17,47 +49,16 @@ class CollatorFactory:
         device_id,
         ts_updated,
         write_txt=None,
+        **kwargs,
     ):
         # Given log_type, return the appropriate initialized collator
-        if log_type == "app_packages":
-            return AppCollator(
-                s3_client,
-                s3_bucket,
-                record["s3"]["object"]["key"],
-                user_id,
-                device_id,
-                ts_updated,
-                write_txt,
-            )
-        elif log_type == "contact_list":
-            return ContactsCollator(
-                s3_client,
-                s3_bucket,
-                record["s3"]["object"]["key"],
-                user_id,
-                device_id,
-                ts_updated,
-                write_txt,
-            )
-        elif log_type == "sms_log":
-            return SmsCollator(
-                s3_client,
-                s3_bucket,
-                record["s3"]["object"]["key"],
-                user_id,
-                device_id,
-                ts_updated,
-                write_txt,
-            )
-        elif log_type == "call_log":
-            return CallCollator(
-                s3_client,
-                s3_bucket,
-                record["s3"]["object"]["key"],
-                user_id,
-                device_id,
-                ts_updated,
-                write_txt,
-            )
-        else:
-            raise ValueError(f"Unsupported log type: '{log_type}'")
+        return CollatorFactory.collator_class(log_type)(
+            s3_client,
+            s3_bucket,
+            record["s3"]["object"]["key"],
+            user_id,
+            device_id,
+            ts_updated,
+            write_txt,
+            **kwargs,
+        )
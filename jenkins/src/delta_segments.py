@@ -0,0 +1,104 @@
+"""Delta segments of the current collated logs. With delta_segments, a collation writes
+its changes to a new delta file next to the current file of the user, instead of
+rewriting it. Readers merge the current file and its deltas in the order they were
+written, and once the deltas cross a count or size threshold the next collation merges
+them into a new current file. The current file records the names of the deltas it
+merged, so that deltas left behind by an interrupted compaction are not read twice.
+
+Deltas are numbered in sequence, the next one following the deltas listed and those
+merged into the current file, so that with conditional writes collations appending to
+the same logs put the same key, and only the first of them succeeds"""
+
+import json
+
+import pyarrow as pa
+from botocore.exceptions import ClientError
+from parquet import conform_table, open_parquet_file, read_file_columns
+from s3_file import list_objects
+
+BASE_FILE_NAME = "logs.parquet"
+DELTA_PREFIX = "delta-"
+
+# Key of the parquet schema metadata listing the deltas merged into a current file
+MERGED_DELTAS_KEY = b"collator.merged_deltas"
+
+
+def list_deltas(s3_client, s3_bucket, base_key):
+    """Returns the keys and sizes of the delta files next to a current file, in the
+    order they were written"""
+    prefix = base_key[: -len(BASE_FILE_NAME)]
+    return sorted(
+        (
+            (content["Key"], content["Size"])
+            for content in list_objects(s3_client, s3_bucket, prefix)
+            if content["Key"][len(prefix) :].startswith(DELTA_PREFIX)
+        ),
+        key=lambda delta: (delta_sequence(delta[0]), delta[0]),
+    )
+
+
+def delta_sequence(key):
+    """Returns the sequence number of a delta file, 0 for deltas named by their time
+    only, which were written before any numbered delta"""
+    number = _name(key)[len(DELTA_PREFIX) :].split(".")[0].split("-")[0]
+    return int(number) if number.isdigit() else 0
+
+
+def next_delta_name(deltas, schema, suffix=None):
+    """Returns the name of the next delta after the deltas, as listed by list_deltas, of
+    the current file with the given schema, or None if it is missing. Without
+    conditional writes, a suffix keeps the deltas of concurrent collations apart"""
+    merged = merged_deltas(schema) if schema is not None else set()
+    sequence = 1 + max(
+        [delta_sequence(key) for key, _ in deltas]
+        + [delta_sequence(name) for name in merged],
+        default=0,
+    )
+    return f"{sequence:010d}" if suffix is None else f"{sequence:010d}-{suffix}"
+
+
+def merged_deltas(schema):
+    """Returns the names of the delta files merged into a current file, from the schema
+    of the file"""
+    metadata = schema.metadata or {}
+    return set(json.loads(metadata.get(MERGED_DELTAS_KEY, b"[]")))
+
+
+def with_merged_deltas(schema, delta_keys):
+    """Returns the schema of a current file merging the given delta files"""
+    metadata = dict(schema.metadata or {})
+    metadata[MERGED_DELTAS_KEY] = json.dumps(
+        sorted(_name(key) for key in delta_keys)
+    ).encode()
+    return schema.with_metadata(metadata)
+
+
+def live_deltas(deltas, schema):
+    """Returns the deltas, as listed by list_deltas, that were not merged into the
+    current file with the given schema"""
+    merged = merged_deltas(schema)
+    return [(key, size) for key, size in deltas if _name(key) not in merged]
+
+
+def read_current(s3_client, s3_bucket, base_key, schema):
+    """Returns a table of the current logs of a user, merging the current file and its
+    deltas, with the columns and types of the given schema"""
+    deltas = list_deltas(s3_client, s3_bucket, base_key)
+    tables = [schema.empty_table()]
+    try:
+        result = s3_client.get_object(Bucket=s3_bucket, Key=base_key)
+        parquet_file = open_parquet_file(result["Body"])
+        deltas = live_deltas(deltas, parquet_file.schema_arrow)
+        tables.append(conform_table(read_file_columns(parquet_file), schema))
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] != "NoSuchKey":
+            raise ex
+    for key, _ in deltas:
+        result = s3_client.get_object(Bucket=s3_bucket, Key=key)
+        parquet_file = open_parquet_file(result["Body"])
+        tables.append(conform_table(read_file_columns(parquet_file), schema))
+    return pa.concat_tables(tables)
+
+
+def _name(key):
+    return key.rsplit("/", 1)[-1]
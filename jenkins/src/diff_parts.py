@@ -0,0 +1,82 @@
+"""Reading and compaction of the diffs of collated logs written as part files. With
+diff_parts, each collation writes its changes to a new part file next to the diff file
+of the user, instead of rewriting the diff file. Readers merge the diff file and its
+parts in the order they were written, and compaction merges them back into the diff
+file, so the batch job reads the same files as before"""
+
+import pyarrow as pa
+from base_collator import BaseCollator
+from parquet import conform_table, read_table_columns, table_writer
+from s3_file import delete_objects, list_objects
+
+DIFF_FILE_NAME = "logs.parquet"
+PART_PREFIX = "part-"
+
+
+def diff_prefix(log_type, batch_ts, user_id=None):
+    """Returns the prefix of the diff files of a user, or of all users of a diff
+    partition if no user is given"""
+    if user_id is None:
+        key = BaseCollator.CHANGED_LOGS_KEY.format(log_type, batch_ts, "")
+        return key[: key.index("user=")]
+    key = BaseCollator.CHANGED_LOGS_KEY.format(log_type, batch_ts, user_id)
+    return key[: -len(DIFF_FILE_NAME)]
+
+
+def diff_keys(s3_client, s3_bucket, log_type, batch_ts, user_id):
+    """Returns the keys of the diff file and part files of a user, in the order they
+    were written"""
+    prefix = diff_prefix(log_type, batch_ts, user_id)
+    keys = {content["Key"] for content in list_objects(s3_client, s3_bucket, prefix)}
+    diff_key = prefix + DIFF_FILE_NAME
+    part_keys = sorted(
+        key for key in keys if key[len(prefix) :].startswith(PART_PREFIX)
+    )
+    return ([diff_key] if diff_key in keys else []) + part_keys
+
+
+def read_diff(s3_client, s3_bucket, log_type, batch_ts, user_id, schema, keys=None):
+    """Returns a table of the changes of a user, merging the diff file and its parts,
+    with the columns and types of the given schema"""
+    if keys is None:
+        keys = diff_keys(s3_client, s3_bucket, log_type, batch_ts, user_id)
+    tables = [schema.empty_table()]
+    for key in keys:
+        result = s3_client.get_object(Bucket=s3_bucket, Key=key)
+        tables.append(conform_table(read_table_columns(result["Body"]), schema))
+    return pa.concat_tables(tables)
+
+
+def compact_diff(s3_client, s3_bucket, log_type, batch_ts, user_id, schema):
+    """Merges the part files of a user into the diff file and deletes them. Parts
+    written during compaction are left for the next one. Returns the number of parts
+    merged"""
+    keys = diff_keys(s3_client, s3_bucket, log_type, batch_ts, user_id)
+    diff_key = diff_prefix(log_type, batch_ts, user_id) + DIFF_FILE_NAME
+    part_keys = [key for key in keys if key != diff_key]
+    if not part_keys:
+        return 0
+
+    table = read_diff(
+        s3_client, s3_bucket, log_type, batch_ts, user_id, schema, keys=keys
+    )
+    s3_client.put_object(
+        Bucket=s3_bucket, Key=diff_key, Body=table_writer(table).to_pybytes()
+    )
+    delete_objects(s3_client, s3_bucket, part_keys)
+    return len(part_keys)
+
+
+def compact_diffs(s3_client, s3_bucket, log_type, batch_ts, schema):
+    """Compacts the diffs of all users of a diff partition, before the batch job reads
+    it. Returns the number of parts merged"""
+    prefix = diff_prefix(log_type, batch_ts)
+    user_ids = set()
+    for content in list_objects(s3_client, s3_bucket, prefix):
+        user, name = content["Key"][len(prefix) :].split("/", 1)
+        if name.startswith(PART_PREFIX):
+            user_ids.add(user[len("user=") :])
+    return sum(
+        compact_diff(s3_client, s3_bucket, log_type, batch_ts, user_id, schema)
+        for user_id in sorted(user_ids)
+    )
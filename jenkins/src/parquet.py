@@ -1,15 +1,387 @@
+import numpy as np
 import pyarrow as pa
-from pandas import Timestamp as pd_Timestamp
-from pyarrow.parquet import read_table, write_table
+import pyarrow.compute as pc
+from pyarrow.parquet import ParquetFile, ParquetWriter, write_table
 
 PARQUET_INDICES_KEY = "__index_level_0__"
 
+# Type of MD5 hashes stored as bytes rather than hex strings
+HASH_BINARY_TYPE = pa.binary(16)
 
-def writer(list_of_dicts, flavor="spark"):
+# Hex digits of each byte, and the value of each hex digit character
+_HEX_DIGITS = np.array([f"{i:02x}".encode() for i in range(256)], dtype="S2")
+_HEX_VALUES = np.full(256, -1, dtype=np.int16)
+for _value, _digit in enumerate(b"0123456789abcdef"):
+    _HEX_VALUES[_digit] = _value
+for _value, _digit in enumerate(b"ABCDEF", 10):
+    _HEX_VALUES[_digit] = _value
+
+# Maximum number of rows in each row group written by TableStreamWriter, which bounds
+# the memory needed to read the file back one row group at a time
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def writer(list_of_dicts, flavor="spark", schema=None):
+    """
+    Returns a byte stream that can written to disk or s3. If a schema is given, each
+    column is built directly with its declared type and keys outside of the schema are
+    dropped, otherwise the columns and their types are inferred from the dicts
+    """
+
+    if schema is None:
+        pq_table = _infer_table(list_of_dicts)
+    else:
+        pq_table = dicts_to_table(list_of_dicts, schema)
+
+    return table_writer(pq_table, flavor=flavor)
+
+
+def table_writer(table, flavor="spark"):
+    """
+    Returns a byte stream of a pyarrow Table that can written to disk or s3
+    """
+
+    out_stream = pa.BufferOutputStream()
+    write_table(table, out_stream, flavor=flavor)
+
+    return out_stream.getvalue()
+
+
+class TableStreamWriter:
+    """
+    Writes tables one after another to a parquet byte stream, so that a file can be
+    written without holding all of its rows at once. Small tables are merged into
+    row groups of up to row_group_size rows
+    """
+
+    def __init__(self, schema, flavor="spark", row_group_size=ROW_GROUP_SIZE):
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._out_stream = pa.BufferOutputStream()
+        self._writer = ParquetWriter(self._out_stream, schema, flavor=flavor)
+        self._pending = []
+        self._pending_rows = 0
+
+    def write(self, table):
+        if table.num_rows == 0:
+            return
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        self.num_rows += table.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        """
+        Returns a byte stream that can written to disk or s3
+        """
+
+        self._flush()
+        self._writer.close()
+        return self._out_stream.getvalue()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(
+                pa.concat_tables(self._pending), row_group_size=self.row_group_size
+            )
+            self._pending = []
+            self._pending_rows = 0
+
+
+def dicts_to_table(list_of_dicts, schema):
+    """
+    Builds a pyarrow Table with the given schema from a list of dictionaries
+    """
+
+    return pa.Table.from_arrays(
+        [
+            _build_array(
+                [cur_dict.get(field.name) for cur_dict in list_of_dicts], field.type
+            )
+            for field in schema
+        ],
+        schema=schema,
+    )
+
+
+def columns_to_table(columns, schema, num_rows):
+    """
+    Builds a pyarrow Table with the given schema from a dictionary of columns, each a
+    list or a pyarrow Array. Missing columns are filled with nulls
+    """
+
+    vectors = []
+    for field in schema:
+        vector = columns.get(field.name)
+        if vector is None:
+            vector = pa.nulls(num_rows, field.type)
+        elif not isinstance(vector, (pa.Array, pa.ChunkedArray)):
+            vector = _build_array(vector, field.type)
+        elif vector.type != field.type:
+            vector = _cast_array(vector, field.type)
+        vectors.append(vector)
+
+    return pa.Table.from_arrays(vectors, schema=schema)
+
+
+def conform_table(table, schema):
+    """
+    Returns the table with the columns and types of the given schema. Missing columns
+    are filled with nulls and columns outside of the schema are dropped
+    """
+
+    if table.schema == schema:
+        return table
+
+    vectors = []
+    for field in schema:
+        if field.name in table.column_names:
+            vector = table.column(field.name)
+            if vector.type != field.type:
+                vector = _cast_array(vector, field.type)
+        else:
+            vector = pa.nulls(table.num_rows, field.type)
+        vectors.append(vector)
+
+    return pa.Table.from_arrays(vectors, schema=schema)
+
+
+def dictionary_encoded(schema, names):
+    """
+    Returns the schema with the given fields changed to dictionary-encoded types
+    """
+
+    for name in names:
+        index = schema.get_field_index(name)
+        field = schema.field(index)
+        schema = schema.set(
+            index, field.with_type(pa.dictionary(pa.int32(), field.type))
+        )
+    return schema
+
+
+def binary_hash_fields(schema, names):
+    """
+    Returns the schema with the given hex MD5 hash fields changed to 16-byte binary
+    types. conform_table and the writers convert hex strings to bytes for these types
+    """
+
+    for name in names:
+        index = schema.get_field_index(name)
+        schema = schema.set(index, schema.field(index).with_type(HASH_BINARY_TYPE))
+    return schema
+
+
+def hex_to_binary(vector):
+    """
+    Converts an array of 32-character hex strings to an array of 16-byte binaries
+    """
+
+    if isinstance(vector, pa.ChunkedArray):
+        return pa.chunked_array(
+            [hex_to_binary(chunk) for chunk in vector.chunks], HASH_BINARY_TYPE
+        )
+    num_rows = len(vector)
+    valid = vector.is_valid()
+    if num_rows == 0:
+        return pa.array([], HASH_BINARY_TYPE)
+    strings = pc.if_else(valid, vector, "0" * 32).cast(pa.large_string())
+    _, offsets, data = strings.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[: num_rows + 1]
+    if not (np.diff(offsets) == 32).all():
+        raise ValueError("Hashes must be 32-character hex strings")
+    digits = _HEX_VALUES[
+        np.frombuffer(data, dtype=np.uint8)[offsets[0] : offsets[-1]]
+    ].reshape(num_rows, 16, 2)
+    if (digits < 0).any():
+        raise ValueError("Hashes must be 32-character hex strings")
+    hash_bytes = (digits[:, :, 0] * 16 + digits[:, :, 1]).astype(np.uint8)
+    return pa.Array.from_buffers(
+        HASH_BINARY_TYPE,
+        num_rows,
+        [_validity_buffer(valid), pa.py_buffer(hash_bytes.tobytes())],
+    )
+
+
+def binary_to_hex(vector):
+    """
+    Converts an array of 16-byte binaries to an array of 32-character hex strings
+    """
+
+    if isinstance(vector, pa.ChunkedArray):
+        return pa.chunked_array(
+            [binary_to_hex(chunk) for chunk in vector.chunks], pa.string()
+        )
+    num_rows = len(vector)
+    if num_rows == 0:
+        return pa.array([], pa.string())
+    _, data = vector.buffers()
+    hash_bytes = np.frombuffer(data, dtype=np.uint8)[
+        vector.offset * 16 : (vector.offset + num_rows) * 16
+    ]
+    hex_data = _HEX_DIGITS[hash_bytes].tobytes()
+    offsets = np.arange(0, num_rows * 32 + 1, 32, dtype=np.int32)
+    return pa.Array.from_buffers(
+        pa.string(),
+        num_rows,
+        [
+            _validity_buffer(vector.is_valid()),
+            pa.py_buffer(offsets.tobytes()),
+            pa.py_buffer(hex_data),
+        ],
+    )
+
+
+def open_parquet_file(in_stream):
+    """
+    Reads a stream and returns a ParquetFile whose columns can be read separately
+    """
+
+    return ParquetFile(pa.BufferReader(in_stream.read()))
+
+
+def read_file_columns(parquet_file, columns=None, drop_indices=True):
+    """
+    Returns a pyarrow Table of a ParquetFile. If columns are given, only those
+    columns are read, and columns missing from the file are skipped
+    """
+
+    return parquet_file.read(columns=_column_names(parquet_file, columns, drop_indices))
+
+
+def read_row_group_columns(parquet_file, index, columns=None, drop_indices=True):
+    """
+    Returns a pyarrow Table of one row group of a ParquetFile, with the same column
+    selection as read_file_columns
+    """
+
+    return parquet_file.read_row_group(
+        index, columns=_column_names(parquet_file, columns, drop_indices)
+    )
+
+
+def iter_file_batches(
+    parquet_file,
+    columns=None,
+    drop_indices=True,
+    batch_size=ROW_GROUP_SIZE,
+    row_groups=None,
+):
+    """
+    Yields pyarrow RecordBatches of a ParquetFile, reading one row group at a time,
+    with the same column selection as read_file_columns
+    """
+
+    yield from parquet_file.iter_batches(
+        batch_size=batch_size,
+        row_groups=row_groups,
+        columns=_column_names(parquet_file, columns, drop_indices),
+    )
+
+
+def column_chunk_ranges(parquet_file, columns=None, row_groups=None):
+    """
+    Returns the (offset, length) byte ranges in a ParquetFile of the column chunks of
+    the given columns and row groups
     """
-    Returns a byte stream that can written to disk or s3
+
+    metadata = parquet_file.metadata
+    if row_groups is None:
+        row_groups = range(metadata.num_row_groups)
+
+    ranges = []
+    for index in row_groups:
+        row_group = metadata.row_group(index)
+        for column_index in range(row_group.num_columns):
+            column = row_group.column(column_index)
+            if columns is not None and column.path_in_schema.split(".")[0] not in (
+                columns
+            ):
+                continue
+            # The dictionary page, if any, is the first page of the column chunk
+            start = column.data_page_offset
+            if column.has_dictionary_page and column.dictionary_page_offset:
+                start = min(start, column.dictionary_page_offset)
+            ranges.append((start, column.total_compressed_size))
+    return ranges
+
+
+def read_table_columns(in_stream, columns=None, drop_indices=True, hex_hashes=False):
     """
+    Reads a stream and returns a pyarrow Table. If columns are given, only those
+    columns are read, and columns missing from the file are skipped. With hex_hashes,
+    hashes stored as 16-byte binaries are returned as hex strings
+    """
+
+    table = read_file_columns(open_parquet_file(in_stream), columns, drop_indices)
+    if hex_hashes:
+        table = hex_hash_columns(table)
+    return table
 
+
+def hex_hash_columns(table):
+    """
+    Returns the table with the hashes stored as 16-byte binaries converted to hex
+    strings
+    """
+
+    for index, field in enumerate(table.schema):
+        if field.type == HASH_BINARY_TYPE:
+            table = table.set_column(
+                index,
+                field.with_type(pa.string()),
+                binary_to_hex(table.column(index)),
+            )
+    return table
+
+
+def table_to_dicts(table):
+    """
+    Converts a pyarrow Table to a list of dictionaries
+    """
+
+    return _microsecond_timestamps(table).to_pylist()
+
+
+def _microsecond_timestamps(table):
+    """
+    Returns the table with nanosecond timestamps truncated to microseconds, which
+    pyarrow converts to datetimes rather than to pandas Timestamps
+    """
+
+    for index, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type) and field.type.unit == "ns":
+            arrow_type = pa.timestamp("us", field.type.tz)
+            table = table.set_column(
+                index,
+                field.with_type(arrow_type),
+                table.column(index).cast(arrow_type, safe=False),
+            )
+    return table
+
+
+def reader(in_stream, drop_indices=True, hex_hashes=False):
+    """
+    Reads a stream and returns a list of dictionaries. With hex_hashes, hashes stored
+    as 16-byte binaries are returned as hex strings
+    """
+
+    return table_to_dicts(
+        read_table_columns(in_stream, drop_indices=drop_indices, hex_hashes=hex_hashes)
+    )
+
+
+def _column_names(parquet_file, columns, drop_indices):
+    names = parquet_file.schema_arrow.names
+    if columns is not None:
+        names = [name for name in columns if name in names]
+    if drop_indices:
+        names = [name for name in names if name != PARQUET_INDICES_KEY]
+    return names
+
+
+def _infer_table(list_of_dicts):
     cols = {}
     for index, cur_dict in enumerate(list_of_dicts):
         for key, value in cur_dict.items():
@@ -28,39 +400,38 @@ def writer(list_of_dicts, flavor="spark"):
             arr = arr.cast(pa.timestamp("ns"))
         vectors.append(arr)
 
-    pq_table = pa.Table.from_arrays(vectors, labels)
-
-    out_stream = pa.BufferOutputStream()
-    write_table(pq_table, out_stream, flavor=flavor)
+    return pa.Table.from_arrays(vectors, labels)
 
-    return out_stream.getvalue()
-
-
-def reader(in_stream, drop_indices=True):
-    """
-    Reads a stream and returns a list of dictionaries
-    """
-
-    key_filters = []
-    if drop_indices:
-        key_filters.append(PARQUET_INDICES_KEY)
 
-    table = read_table(pa.BufferReader(in_stream.read()))
+def _build_array(values, arrow_type):
+    if pa.types.is_dictionary(arrow_type):
+        return _build_array(values, arrow_type.value_type).dictionary_encode()
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Values of another type, such as numbers stored as strings in older files,
+        # are converted to the declared type
+        return _cast_array(pa.array(values), arrow_type)
 
-    cols_dict = table.to_pydict()
-    num_rows = table.num_rows
-    keys = cols_dict.keys()
-    list_of_dicts = []
 
-    keys = [key for key in keys if key not in key_filters]
+def _cast_array(vector, arrow_type):
+    if pa.types.is_dictionary(vector.type):
+        vector = vector.cast(vector.type.value_type)
+    if pa.types.is_dictionary(arrow_type):
+        vector = _cast_array(vector, arrow_type.value_type)
+        if isinstance(vector, pa.ChunkedArray):
+            vector = vector.combine_chunks()
+        return vector.dictionary_encode()
+    # Hashes are converted between hex strings and bytes
+    if vector.type == HASH_BINARY_TYPE and pa.types.is_string(arrow_type):
+        return binary_to_hex(vector)
+    if pa.types.is_string(vector.type) and arrow_type == HASH_BINARY_TYPE:
+        return hex_to_binary(vector)
+    return vector.cast(arrow_type)
 
-    for i in range(num_rows):
-        cur_dict = {}
-        for key in keys:
-            value = cols_dict[key][i]
-            if isinstance(value, pd_Timestamp):
-                value = value.to_pydatetime()
-            cur_dict[key] = value
-        list_of_dicts.append(cur_dict)
 
-    return list_of_dicts
+def _validity_buffer(valid):
+    # Validity bitmap of an array, or None if all values are valid
+    if pc.all(valid).as_py():
+        return None
+    return valid.buffers()[1]
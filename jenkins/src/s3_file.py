@@ -0,0 +1,173 @@
+"""Read-only, seekable file object over an S3 object. Reads are served with ranged GETs,
+so parquet files can be read one row group at a time instead of downloading the whole
+object up front. Also lists and deletes objects in bulk"""
+
+import io
+from bisect import bisect_right
+
+# Ranges separated by at most this many bytes are read with a single request
+HOLE_SIZE_LIMIT = 8 * 1024
+
+# Ranges are not coalesced into requests larger than this many bytes
+RANGE_SIZE_LIMIT = 32 * 1024 * 1024
+
+# Maximum number of keys deleted by each DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+
+class S3File(io.RawIOBase):
+    # The parquet footer is at the end of the file, so the tail of the object is read
+    # when the file is opened, which also gives the size of the object
+    TAIL_SIZE = 64 * 1024
+
+    def __init__(self, s3_client, s3_bucket, key, tail_size=TAIL_SIZE):
+        super(S3File, self).__init__()
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.key = key
+        self.position = 0
+        self.buffer_starts = []
+        self.buffers = []
+        self.requests_count = 0
+        self.bytes_read_count = 0
+        # Ranged GETs after the first are pinned to the version it read, and fail with
+        # PreconditionFailed once the object is overwritten, rather than mixing parts of
+        # both versions
+        self.etag = None
+
+        result = self._get_object(f"bytes=-{tail_size}")
+        self.etag = result.get("ETag")
+        self.tail = result["Body"].read()
+        content_range = result.get("ContentRange")
+        if content_range:
+            self.size = int(content_range.rsplit("/", 1)[1])
+        else:
+            # The whole object was returned
+            self.size = len(self.tail)
+        self.tail_start = self.size - len(self.tail)
+
+    def prefetch(self, ranges):
+        """Reads the given (offset, length) ranges ahead of the reads that need them,
+        coalescing ranges that are close together into single requests. Replaces the
+        previously prefetched ranges"""
+        self.buffer_starts = []
+        self.buffers = []
+        for start, end in coalesce_ranges(ranges):
+            end = min(end, self.tail_start)
+            if start >= end:
+                continue
+            data = self._get_object(f"bytes={start}-{end - 1}")["Body"].read()
+            self.buffer_starts.append(start)
+            self.buffers.append(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+        self.position = position
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        data = self._read_range(self.position, end)
+        self.position = max(self.position, end)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def _read_range(self, start, end):
+        if start >= end:
+            return b""
+        if start >= self.tail_start:
+            return self.tail[start - self.tail_start : end - self.tail_start]
+        index = bisect_right(self.buffer_starts, start) - 1
+        if index >= 0:
+            buffer_start = self.buffer_starts[index]
+            buffer = self.buffers[index]
+            if end <= buffer_start + len(buffer):
+                return buffer[start - buffer_start : end - buffer_start]
+        data = self._get_object(f"bytes={start}-{min(end, self.tail_start) - 1}")[
+            "Body"
+        ].read()
+        if end > self.tail_start:
+            data += self.tail[: end - self.tail_start]
+        return data
+
+    def _get_object(self, byte_range):
+        kwargs = {} if self.etag is None else {"IfMatch": self.etag}
+        result = self.s3_client.get_object(
+            Bucket=self.s3_bucket, Key=self.key, Range=byte_range, **kwargs
+        )
+        self.requests_count += 1
+        self.bytes_read_count += result.get("ContentLength", 0)
+        return result
+
+
+def coalesce_ranges(
+    ranges, hole_size_limit=HOLE_SIZE_LIMIT, range_size_limit=RANGE_SIZE_LIMIT
+):
+    """Returns the (start, end) byte ranges to request for the given (offset, length)
+    ranges, merging ranges that overlap or are at most hole_size_limit bytes apart"""
+    coalesced = []
+    for start, length in sorted(ranges):
+        end = start + length
+        if length <= 0:
+            continue
+        if coalesced:
+            last_start, last_end = coalesced[-1]
+            if (
+                start - last_end <= hole_size_limit
+                and max(end, last_end) - last_start <= range_size_limit
+            ):
+                coalesced[-1] = (last_start, max(end, last_end))
+                continue
+        coalesced.append((start, end))
+    return coalesced
+
+
+def list_objects(s3_client, s3_bucket, prefix):
+    """Yields the listing of each object under a prefix, with its Key, Size and ETag"""
+    kwargs = {"Bucket": s3_bucket, "Prefix": prefix}
+    while True:
+        result = s3_client.list_objects_v2(**kwargs)
+        yield from result.get("Contents", [])
+        if not result.get("IsTruncated"):
+            return
+        kwargs["ContinuationToken"] = result["NextContinuationToken"]
+
+
+def delete_objects(s3_client, s3_bucket, keys):
+    """Deletes objects with as few DeleteObjects requests as possible"""
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        s3_client.delete_objects(
+            Bucket=s3_bucket,
+            Delete={
+                "Objects": [
+                    {"Key": key} for key in keys[start : start + DELETE_BATCH_SIZE]
+                ]
+            },
+        )
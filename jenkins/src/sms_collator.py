@@ -5,23 +5,14 @@ schema
 
 import hashlib
 import json
-import logging
 import re
 
+import pyarrow as pa
 from base_collator import BaseCollator
-from ddtrace import patch
+from batch_hashing import hash_columns, str_column
+from collator_logging import get_logger
 
-patch(logging=True)
-
-FORMAT = (
-    "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d]"
-    " [dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s"
-    " dd.trace_id=%(dd.trace_id)s dd.span_id=%(dd.span_id)s] - %(message)s"
-)
-
-logging.basicConfig(format=FORMAT)
-LOGGER = logging.getLogger(__name__)
-LOGGER.setLevel(logging.INFO)
+LOGGER = get_logger(__name__)
 
 
 class SmsCollator(BaseCollator):
@@ -38,7 +29,35 @@ class SmsCollator(BaseCollator):
         "body_hash",  # str
     ]
 
-    SCHEMA = SCHEMA_RAW + BaseCollator.BASE_SCHEMA
+    SCHEMA = pa.schema(
+        [
+            pa.field("message_body", pa.binary()),
+            pa.field("thread_id", pa.int64()),
+            pa.field("sms_type", pa.string()),
+            pa.field("contact_id", pa.int64()),
+            pa.field("datetime", pa.timestamp("ns")),
+            pa.field("sms_address", pa.string()),
+            pa.field("normalized_sms_address", pa.string()),
+            pa.field("item_id", pa.int64()),
+            pa.field("body_hash", pa.string()),
+        ]
+        + BaseCollator.BASE_SCHEMA
+    )
+
+    # Fields hashed by compute_row_hash, in order
+    ROW_HASH_FIELDS = [
+        "id",
+        "sms_type",
+        "thread_id",
+        "contact_id",
+        "normalized_sms_address",
+        "is_deleted",
+    ]
+
+    DICTIONARY_FIELDS = BaseCollator.DICTIONARY_FIELDS + ["sms_type"]
+
+    # Current logs can be partitioned by the month of their datetime
+    PARTITION_BY = "month"
 
     REQUIRED_FIELDS_TXT = [
         "contact_id",
@@ -73,6 +92,7 @@ class SmsCollator(BaseCollator):
         device_id,
         ts_updated,
         write_txt,
+        **kwargs,
     ):
         super(SmsCollator, self).__init__(
             s3_client,
@@ -83,6 +103,7 @@ class SmsCollator(BaseCollator):
             ts_updated,
             "sms_log",
             write_txt,
+            **kwargs,
         )
 
     # This function creates collated version of all relevant raw fields, and calculates
@@ -144,6 +165,73 @@ class SmsCollator(BaseCollator):
         collated_entry["row_hash"] = SmsCollator.compute_row_hash(collated_entry)
         return True
 
+    def collate_batch(self, raw_entries):
+        self._log_unexpected_fields(raw_entries)
+        num_rows = len(raw_entries)
+        message_bodies = [
+            (
+                raw_entry["message_body"].encode("utf-8")
+                if "message_body" in raw_entry
+                else None
+            )
+            for raw_entry in raw_entries
+        ]
+        body_hashes = [
+            "" if message_body is None else hashlib.md5(message_body).hexdigest()
+            for message_body in message_bodies
+        ]
+        sms_types = BaseCollator.resolve_column(
+            BaseCollator.raw_column(raw_entries, ["sms_type", "type"]),
+            SmsCollator._resolve_sms_type,
+        )
+        thread_ids = BaseCollator.raw_column(raw_entries, "thread_id")
+        contact_ids = BaseCollator.raw_column(raw_entries, "contact_id")
+        item_ids = [raw_entry["item_id"] for raw_entry in raw_entries]
+        sms_addresses = BaseCollator.raw_column(raw_entries, "sms_address")
+        normalized_sms_addresses = BaseCollator.normalize_address_column(sms_addresses)
+        datetimes = BaseCollator.parse_datetime_column(
+            [raw_entry["datetime"] for raw_entry in raw_entries]
+        )
+        ids = pa.array(
+            hash_columns(
+                [
+                    pa.scalar(str(self.user_id)),
+                    pa.scalar(self.device_id),
+                    str_column(datetimes),
+                    str_column(item_ids),
+                    sms_addresses,
+                    body_hashes,
+                ]
+            ),
+            pa.string(),
+        )
+        row_hashes = hash_columns(
+            [
+                ids,
+                sms_types,
+                thread_ids,
+                contact_ids,
+                normalized_sms_addresses,
+                pa.scalar(False),
+            ]
+        )
+        return self._batch_table(
+            {
+                "message_body": message_bodies,
+                "thread_id": thread_ids,
+                "sms_type": sms_types,
+                "contact_id": contact_ids,
+                "datetime": datetimes,
+                "sms_address": sms_addresses,
+                "normalized_sms_address": normalized_sms_addresses,
+                "item_id": item_ids,
+                "body_hash": body_hashes,
+                "id": ids,
+                "row_hash": row_hashes,
+            },
+            num_rows,
+        )
+
     @staticmethod
     def compute_row_hash(entry):
         return hashlib.md5(
@@ -0,0 +1,167 @@
+"""Cache of the current collated logs read by collations, kept in the local storage of
+warm Lambda containers. Files are stored as Arrow IPC with one record batch per row
+group, memory-mapped when reused, and validated against S3 with conditional GETs on
+their ETag. The least recently used files are evicted to stay within a size limit"""
+
+import hashlib
+import os
+import shutil
+import threading
+import types
+from collections import OrderedDict
+
+import pyarrow as pa
+from botocore.exceptions import ClientError
+from collator_logging import get_logger
+from pyarrow.parquet import ParquetFile
+
+LOGGER = get_logger(__name__)
+
+# Error codes of a conditional GET whose object still has the given ETag
+NOT_MODIFIED_CODES = ("304", "NotModified")
+
+# Room left free in the local storage for the rest of the collation
+FREE_BYTES_RESERVE = 64 * 1024 * 1024
+
+
+class IpcFile:
+    """Read-only stand-in for a ParquetFile over a memory-mapped Arrow IPC file, with
+    one record batch per row group"""
+
+    def __init__(self, path):
+        self.reader = pa.ipc.open_file(pa.memory_map(path))
+        self.schema_arrow = self.reader.schema
+        self.num_row_groups = self.reader.num_record_batches
+        self.metadata = IpcMetadata(
+            [
+                self.reader.get_batch(index).num_rows
+                for index in range(self.num_row_groups)
+            ]
+        )
+
+    def read(self, columns=None):
+        return self._select(self.reader.read_all(), columns)
+
+    def read_row_group(self, index, columns=None):
+        return self._select(
+            pa.Table.from_batches([self.reader.get_batch(index)]), columns
+        )
+
+    def iter_batches(self, batch_size, row_groups=None, columns=None):
+        if row_groups is None:
+            row_groups = range(self.num_row_groups)
+        for index in row_groups:
+            yield from self.read_row_group(index, columns).to_batches(batch_size)
+
+    @staticmethod
+    def _select(table, columns):
+        return table if columns is None else table.select(columns)
+
+
+class IpcMetadata:
+    """Row counts of an IpcFile, as in the FileMetaData of a ParquetFile"""
+
+    def __init__(self, row_group_sizes):
+        self.row_group_sizes = row_group_sizes
+        self.num_rows = sum(row_group_sizes)
+        self.num_row_groups = len(row_group_sizes)
+
+    def row_group(self, index):
+        return types.SimpleNamespace(num_rows=self.row_group_sizes[index])
+
+
+class StateCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # (bucket, key) -> (etag, path, size), from least to most recently used
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # Collations running at once share the cache, and only read or write the files
+        # of their own keys while holding the lock
+        self.lock = threading.Lock()
+        # Files left by a previous instance of the cache are no longer indexed
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, s3_client, s3_bucket, key):
+        """Returns the object at a key as a ParquetFile or IpcFile, its ETag, and
+        whether it was read from the cache. The object is only downloaded if it changed
+        since it was cached"""
+        with self.lock:
+            entry = self.entries.get((s3_bucket, key))
+        kwargs = {"IfNoneMatch": entry[0]} if entry is not None else {}
+        try:
+            result = s3_client.get_object(Bucket=s3_bucket, Key=key, **kwargs)
+        except ClientError as ex:
+            if entry is None or ex.response["Error"]["Code"] not in NOT_MODIFIED_CODES:
+                with self.lock:
+                    self._evict((s3_bucket, key))
+                raise ex
+            with self.lock:
+                if self.entries.get((s3_bucket, key)) == entry:
+                    self.entries.move_to_end((s3_bucket, key))
+                    return IpcFile(entry[1]), entry[0], True
+            # The file was evicted by another collation since it was validated
+            result = s3_client.get_object(Bucket=s3_bucket, Key=key)
+        etag = result["ETag"]
+        return self.put(s3_bucket, key, etag, result["Body"].read()), etag, False
+
+    def put(self, s3_bucket, key, etag, body):
+        """Caches the parquet body of the object at a key with the given ETag, and
+        returns it as a ParquetFile or, once cached, an IpcFile"""
+        parquet_file = ParquetFile(pa.BufferReader(body))
+        table = self._read_row_groups(parquet_file)
+        with self.lock:
+            return self._put(s3_bucket, key, etag, parquet_file, table)
+
+    def _put(self, s3_bucket, key, etag, parquet_file, table):
+        self._evict((s3_bucket, key))
+        size = table.nbytes
+        if size > self.max_bytes:
+            return parquet_file
+        while self.entries and (
+            self.total_bytes + size > self.max_bytes or not self._has_room(size)
+        ):
+            self._evict(next(iter(self.entries)))
+
+        path = os.path.join(
+            self.directory,
+            hashlib.md5(f"{s3_bucket}/{key}".encode("utf-8")).hexdigest() + ".arrow",
+        )
+        try:
+            with pa.OSFile(path + ".tmp", "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as out:
+                    out.write_table(table)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            LOGGER.warning("Unable to cache %s in %s", key, self.directory)
+            return parquet_file
+        size = os.path.getsize(path)
+        self.entries[(s3_bucket, key)] = (etag, path, size)
+        self.total_bytes += size
+        return IpcFile(path)
+
+    @staticmethod
+    def _read_row_groups(parquet_file):
+        # Row groups are kept as separate chunks, which become the record batches of the
+        # IPC file. Dictionaries are unified, as an IPC file cannot replace them
+        tables = [
+            parquet_file.read_row_group(index).combine_chunks()
+            for index in range(parquet_file.num_row_groups)
+        ]
+        if not tables:
+            return parquet_file.schema_arrow.empty_table()
+        return pa.concat_tables(tables).unify_dictionaries()
+
+    def _has_room(self, size):
+        return shutil.disk_usage(self.directory).free - size >= FREE_BYTES_RESERVE
+
+    def _evict(self, cache_key):
+        entry = self.entries.pop(cache_key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+            try:
+                os.remove(entry[1])
+            except FileNotFoundError:
+                pass
@@ -1,4 +1,7 @@
+import datetime
+
 from app_collator import AppCollator
+from parquet import dicts_to_table
 
 # App-specific tests
 
@@ -34,3 +37,25 @@ def test_app_collator_empty_package():
     collated_entry = {"user_id": "123", "device_id": "456", "is_deleted": False}
     assert not AppCollator.collate_entry(collated_entry, raw_entry_none)
     assert not AppCollator.collate_entry(collated_entry, raw_entry_empty)
+
+
+def test_app_collator_batch():
+    raw_entries = [
+        {"package_name": "App. Name"},
+        {"package_name": ""},
+        {"package_name": " com.Example\tApp\x1c"},
+        {"package_name": "Ünï Cöde"},
+        {"package_name": None},
+    ]
+    collator = AppCollator(
+        None, None, None, 123, "456", datetime.datetime(2020, 1, 1), False
+    )
+    collated_entries = []
+    for raw_entry in raw_entries:
+        collated_entry = {"user_id": 123, "device_id": "456", "is_deleted": False}
+        if AppCollator.collate_entry(collated_entry, raw_entry):
+            collated_entries.append(collated_entry)
+    # Batches are collated the same as each entry on its own
+    assert collator.collate_batch(raw_entries).equals(
+        dicts_to_table(collated_entries, collator.schema)
+    )
@@ -0,0 +1,272 @@
+import datetime
+
+import pyarrow as pa
+from batch_hashing import hash_columns, hash_strings, str_column
+from call_collator import CallCollator
+from contacts_collator import ContactsCollator
+from parquet import dicts_to_table
+from sms_collator import SmsCollator
+
+# Conformance of batch hashing with the expected hashes of the collator tests
+
+CALL_ROW_HASHES = [
+    (
+        {"is_deleted": False, "normalized_phone_number": "4567895", "duration": 456},
+        "83bafc501b555dfca04a3d37ca5eb573",
+    ),
+    (
+        {"is_deleted": True, "normalized_phone_number": "4567895", "duration": 456},
+        "b2e2fd82df0d78c5b1926af61edae852",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "cached_name": "new",
+            "normalized_phone_number": "4567895",
+            "duration": 456,
+        },
+        "5d4caafb13b524293b13af0991f50da3",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "cached_name": "new",
+            "normalized_phone_number": "1234567",
+            "duration": 456,
+        },
+        "346c34952b333f23d63d5a6eb8e70ac4",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "cached_name": "new",
+            "normalized_phone_number": "1234567",
+            "duration": 789,
+        },
+        "346867fa6cc4e884dd08246e9b9347ab",
+    ),
+]
+
+SMS_ROW_HASHES = [
+    (
+        {
+            "is_deleted": False,
+            "thread_id": 5,
+            "contact_id": 9,
+            "sms_type": "sent",
+            "normalized_sms_address": "4567895",
+        },
+        "e97347ee50f9a5f1155061c096672498",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "thread_id": 5,
+            "contact_id": 9,
+            "sms_type": "sent",
+            "normalized_sms_address": "4567895",
+        },
+        "0d06f894e0a9b414505c9ce87bc65d84",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "thread_id": 8,
+            "contact_id": 9,
+            "sms_type": "sent",
+            "normalized_sms_address": "4567895",
+        },
+        "1979b8a0627138f78b8e5fcc79e014a3",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "thread_id": 8,
+            "contact_id": 3,
+            "sms_type": "sent",
+            "normalized_sms_address": "4567895",
+        },
+        "301be5ea0834622aae3f2db184a9c846",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "thread_id": 8,
+            "contact_id": 3,
+            "sms_type": "inbox",
+            "normalized_sms_address": "4567895",
+        },
+        "cb29ce1ae0059c5d5aac48c9d3a8e647",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "thread_id": 8,
+            "contact_id": 3,
+            "sms_type": "inbox",
+            "normalized_sms_address": "3456643",
+        },
+        "41edc13b4ff534ea2ac2def36903018a",
+    ),
+]
+
+CONTACTS_ROW_HASHES = [
+    (
+        {
+            "is_deleted": False,
+            "display_name": "Leroy",
+            "last_time_contacted": 1487722326477,
+            "times_contacted": 67,
+            "photo_id": "56645",
+        },
+        "56345efdb7ccf98805fbcc59d3289966",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "display_name": "Leroy",
+            "last_time_contacted": 1487722326477,
+            "times_contacted": 67,
+            "photo_id": "56645",
+        },
+        "45c2f39966ecf7c55ca37ceaaf1c0666",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "display_name": "Dave",
+            "last_time_contacted": 1487722326477,
+            "times_contacted": 67,
+            "photo_id": "56645",
+        },
+        "8924614ec9d3dfa74322591b6174a376",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "display_name": "Dave",
+            "last_time_contacted": 1487722366477,
+            "times_contacted": 67,
+            "photo_id": "56645",
+        },
+        "739c6a07fd411054fe41dc0c55291bf9",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "display_name": "Dave",
+            "last_time_contacted": 1487722366477,
+            "times_contacted": 12,
+            "photo_id": "56645",
+        },
+        "1a1a7cfb735ec131b289576031f32fcc",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "display_name": "Dave",
+            "last_time_contacted": 1487722366477,
+            "times_contacted": 12,
+            "photo_id": "56778",
+        },
+        "034e499750b1b0bf3229f29ab6d23216",
+    ),
+    (
+        {
+            "is_deleted": True,
+            "display_name": "Dave",
+            "last_time_contacted": 1487722366477,
+            "times_contacted": 12,
+            "photo_id": "56778",
+            "phone_numbers": '{num: "+3445435", num: "3453455"}',
+        },
+        "bb95d8858e1c629178820780603af255",
+    ),
+]
+
+
+def _entries(row_hashes, defaults):
+    entries = []
+    for fields, _ in row_hashes:
+        entry = dict(defaults, id="123fgh", **fields)
+        if "last_time_contacted" in entry:
+            entry["last_time_contacted"] = datetime.datetime.fromtimestamp(
+                entry["last_time_contacted"] / 1000
+            )
+        entries.append(entry)
+    return entries
+
+
+def _assert_row_hashes(collator_class, row_hashes, defaults):
+    entries = _entries(row_hashes, defaults)
+    expected = [row_hash for _, row_hash in row_hashes]
+    assert [collator_class.compute_row_hash(entry) for entry in entries] == expected
+
+    # From python values, as collate_batch hashes them
+    columns = [
+        [entry[field] for entry in entries] for field in collator_class.ROW_HASH_FIELDS
+    ]
+    assert hash_columns(columns) == expected
+
+    # From the columns of collated logs, as deleted entries are hashed
+    table = dicts_to_table(entries, collator_class.SCHEMA)
+    columns = [table.column(field) for field in collator_class.ROW_HASH_FIELDS]
+    assert hash_columns(columns) == expected
+
+
+def test_call_row_hashes():
+    _assert_row_hashes(
+        CallCollator, CALL_ROW_HASHES, {"cached_name": "name", "call_type": "5"}
+    )
+
+
+def test_sms_row_hashes():
+    _assert_row_hashes(SmsCollator, SMS_ROW_HASHES, {})
+
+
+def test_contacts_row_hashes():
+    _assert_row_hashes(
+        ContactsCollator, CONTACTS_ROW_HASHES, {"phone_numbers": '{num: "+3445435"}'}
+    )
+
+
+def test_ids():
+    # ids of the happy path tests, with the fields hashed as str(field)
+    datetimes = pa.array(
+        [
+            datetime.datetime(2016, 6, 17, 15, 19, 53, 178000),
+            datetime.datetime(2017, 2, 22, 0, 12, 6, 477000),
+        ],
+        pa.timestamp("ns"),
+    )
+    item_ids = pa.array([74, 122], pa.int64())
+    assert hash_columns(
+        [
+            pa.scalar("123"),
+            pa.scalar("456"),
+            str_column(datetimes),
+            str_column(item_ids),
+            ["+0724 417 503", "+075 40269 68"],
+            [None, "2e962e16e56aaed080779ea915252cb2"],
+        ]
+    ) == ["5e7cfe8e771f922f540fb66d159de7ef", "1846170e2c6acd9e66f747148519ec34"]
+    assert hash_columns([pa.scalar("123"), pa.scalar("456"), str_column([201338])]) == [
+        "b3577e0d98aab314bacb05cfb225b92d"
+    ]
+
+
+def test_hash_strings():
+    values = [
+        None,
+        True,
+        -5,
+        1.5,
+        "007",
+        b"body",
+        datetime.datetime(2016, 6, 17, 15, 19, 53),
+    ]
+    # Columns of one type are converted by Arrow, others one value at a time
+    for value in values[1:]:
+        assert hash_strings([value, None]).to_pylist() == [str(value), None]
+    assert hash_strings(values).to_pylist() == [None] + [str(v) for v in values[1:]]
+    assert str_column([None, 1]).to_pylist() == ["None", "1"]
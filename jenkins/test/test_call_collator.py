@@ -1,6 +1,7 @@
 import datetime
 
 from call_collator import CallCollator
+from parquet import dicts_to_table
 
 # Call-specific tests
 
@@ -143,3 +144,43 @@ def test_call_collator_empty_phone_number():
     collated_entry = {"user_id": "123", "device_id": "456", "is_deleted": False}
     assert not CallCollator.collate_entry(collated_entry, raw_entry_none)
     assert not CallCollator.collate_entry(collated_entry, raw_entry_empty)
+
+
+def test_call_collator_batch():
+    raw_entries = [
+        {
+            "cached_name": "test",
+            "call_type": "5",
+            "datetime": "1466176793178",
+            "duration": "15",
+            "item_id": 74,
+            "phone_number": "+0724 417 503",
+        },
+        {"phone_number": ""},
+        {
+            "call_type": 20,
+            "datetime": 1466176793,
+            "item_id": 75,
+            "phone_number": "(0724)_417-50\t4",
+        },
+        {
+            "cached_name": "Ünïcode",
+            "call_type": "1",
+            "datetime": "1466176793000",
+            "duration": 0,
+            "item_id": 76,
+            "phone_number": "+٠٧٢٤ 417 ABC",
+        },
+    ]
+    collator = CallCollator(
+        None, None, None, 123, "456", datetime.datetime(2020, 1, 1), False
+    )
+    collated_entries = []
+    for raw_entry in raw_entries:
+        collated_entry = {"user_id": 123, "device_id": "456", "is_deleted": False}
+        if CallCollator.collate_entry(collated_entry, raw_entry):
+            collated_entries.append(collated_entry)
+    # Batches are collated the same as each entry on its own
+    assert collator.collate_batch(raw_entries).equals(
+        dicts_to_table(collated_entries, collator.schema)
+    )
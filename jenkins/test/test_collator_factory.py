@@ -0,0 +1,65 @@
+"""
+test_collator_factory.py
+Tests for the lookup and lazy import of the collator of each log type
+"""
+
+import datetime
+import os
+import subprocess
+import sys
+
+import pytest
+from app_collator import AppCollator
+from call_collator import CallCollator
+from collator_factory import CollatorFactory
+from contacts_collator import ContactsCollator
+from sms_collator import SmsCollator
+
+
+@pytest.mark.parametrize(
+    "log_type, collator_class",
+    [
+        ("app_packages", AppCollator),
+        ("contact_list", ContactsCollator),
+        ("sms_log", SmsCollator),
+        ("call_log", CallCollator),
+    ],
+)
+def test_build(log_type, collator_class):
+    record = {"s3": {"object": {"key": f"uploads/users/100/unknown/1/{log_type}/1"}}}
+    collator = CollatorFactory.build(
+        log_type,
+        None,
+        "branch-co",
+        record,
+        100,
+        "1",
+        datetime.datetime(2023, 9, 1),
+        False,
+        projection=True,
+    )
+    assert type(collator) is collator_class
+    assert collator.raw_file_key == f"uploads/users/100/unknown/1/{log_type}/1"
+    assert collator.projection
+
+
+def test_build_unsupported():
+    with pytest.raises(ValueError):
+        CollatorFactory.build("unknown", None, "branch-co", {}, 100, "1", None)
+
+
+def test_lazy_import():
+    # Collator modules are only imported by the log types using them
+    script = (
+        "import sys\n"
+        "from collator_factory import CollatorFactory\n"
+        "assert 'base_collator' not in sys.modules\n"
+        "CollatorFactory.prewarm(['sms_log'])\n"
+        "assert 'sms_collator' in sys.modules\n"
+        "assert 'call_collator' not in sys.modules\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script],
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        check=True,
+    )
@@ -0,0 +1,337 @@
+"""
+test_conditional_writes.py
+Tests for competing collations of the same user with conditional writes, against the S3
+container. A collation is run in the middle of another, right before the other writes
+"""
+
+import datetime
+import json
+import os
+
+import boto3
+import pyarrow as pa
+import pytest
+from app_collator import AppCollator
+from call_collator import CallCollator
+from current_partitions import read_partitions
+from delta_segments import list_deltas, read_current
+from latest_history import read_latest
+from parquet import conform_table, read_table_columns
+from s3_file import delete_objects, list_objects
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+USER_ID = 103
+SCHEMA = pa.schema(
+    [
+        pa.field("package_name", pa.string()),
+        pa.field("device_id", pa.string()),
+        pa.field("is_deleted", pa.bool_()),
+    ]
+)
+CURRENT_PREFIX = f"collated_logs/current/app_packages/user={USER_ID}/"
+DIFF_KEY = (
+    f"collated_logs/diff/app_packages/ts_update=2023-09-01/user={USER_ID}/logs.parquet"
+)
+LAYOUTS = {
+    "full": {},
+    "projection": {"projection": True},
+    "streaming": {"streaming": True},
+    "deltas": {"delta_segments": True, "max_delta_segments": 0},
+    "appended_deltas": {"delta_segments": True, "max_delta_segments": 8},
+    "latest": {"latest_history": True},
+    "partitioned": {"partitioned": True},
+    "concurrent": {"concurrent_io": True},
+    "concurrent_projection": {"concurrent_io": True, "projection": True},
+}
+
+
+class CompetingS3Client:
+    """S3 client that runs a competing collation before the first write of a key with
+    the given prefix"""
+
+    def __init__(self, s3_client, prefix, competitor):
+        self.s3_client = s3_client
+        self.prefix = prefix
+        self.competitor = competitor
+
+    def put_object(self, **kwargs):
+        if self.competitor is not None and kwargs["Key"].startswith(self.prefix):
+            competitor, self.competitor = self.competitor, None
+            competitor()
+        return self.s3_client.put_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.s3_client, name)
+
+
+class CompetingReadS3Client(CompetingS3Client):
+    """S3 client that runs a competing collation after the first read of a key with
+    the given prefix"""
+
+    def get_object(self, **kwargs):
+        result = self.s3_client.get_object(**kwargs)
+        if self.competitor is not None and kwargs["Key"].startswith(self.prefix):
+            competitor, self.competitor = self.competitor, None
+            competitor()
+        return result
+
+    def put_object(self, **kwargs):
+        return self.s3_client.put_object(**kwargs)
+
+
+def _reset():
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        [
+            content["Key"]
+            for content in list_objects(S3_CLIENT, S3_BUCKET, "collated_logs/")
+            if f"user={USER_ID}/" in content["Key"]
+        ],
+    )
+
+
+def _collator(s3_client, upload, device_id, package_names, layout):
+    raw_file_key = f"uploads/users/{USER_ID}/unknown/{device_id}/app_packages/{upload}"
+    S3_CLIENT.put_object(
+        Bucket=S3_BUCKET,
+        Key=raw_file_key,
+        Body=json.dumps([{"package_name": name} for name in package_names]),
+    )
+    return AppCollator(
+        s3_client,
+        S3_BUCKET,
+        raw_file_key,
+        USER_ID,
+        device_id,
+        datetime.datetime(2023, 9, 1, upload),
+        False,
+        conditional_writes=True,
+        **LAYOUTS[layout],
+    )
+
+
+def _current_logs(layout):
+    if layout == "latest":
+        table = read_latest(S3_CLIENT, S3_BUCKET, "app_packages", USER_ID, SCHEMA)
+    elif layout == "partitioned":
+        table = read_partitions(S3_CLIENT, S3_BUCKET, "app_packages", USER_ID, SCHEMA)
+    elif layout == "appended_deltas":
+        table = read_current(
+            S3_CLIENT, S3_BUCKET, CURRENT_PREFIX + "logs.parquet", SCHEMA
+        )
+    else:
+        result = S3_CLIENT.get_object(
+            Bucket=S3_BUCKET, Key=CURRENT_PREFIX + "logs.parquet"
+        )
+        table = conform_table(read_table_columns(result["Body"]), SCHEMA)
+    return sorted(zip(*table.to_pydict().values()))
+
+
+def _diff_logs():
+    result = S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=DIFF_KEY)
+    table = conform_table(read_table_columns(result["Body"]), SCHEMA)
+    return sorted(zip(*table.to_pydict().values()))
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_competing_devices(layout):
+    _reset()
+    _collator(S3_CLIENT, 1, "1", ["app.one"], layout).collate()
+    competitor = _collator(S3_CLIENT, 3, "2", ["app.three"], layout)
+    s3_client = CompetingS3Client(S3_CLIENT, CURRENT_PREFIX, competitor.collate)
+
+    # The write conflicting with the competitor's is retried on top of its logs
+    collator = _collator(s3_client, 2, "1", ["app.one", "app.two"], layout)
+    collator.collate()
+    assert collator.write_attempts == (1 if layout == "partitioned" else 2)
+    assert _current_logs(layout) == [
+        ("app.one", "1", False),
+        ("app.three", "2", False),
+        ("app.two", "1", False),
+    ]
+    assert _diff_logs() == [
+        ("app.one", "1", False),
+        ("app.three", "2", False),
+        ("app.two", "1", False),
+    ]
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("conditional_writes", [False, True])
+def test_overwritten_during_read(conditional_writes):
+    _reset()
+    package_names = [f"app.{index}" for index in range(5000)]
+    _collator(S3_CLIENT, 1, "1", package_names, "streaming").collate()
+    competitor = _collator(S3_CLIENT, 3, "2", ["app.other"], "streaming")
+    s3_client = CompetingReadS3Client(
+        S3_CLIENT, CURRENT_PREFIX + "logs.parquet", competitor.collate
+    )
+
+    # The current file is overwritten after its footer is read, and the collation is
+    # retried rather than reading its row groups from the competitor's version
+    collator = _collator(s3_client, 2, "1", package_names + ["app.new"], "streaming")
+    collator.conditional_writes = conditional_writes
+    collator.collate()
+    assert collator.write_attempts == 2
+    assert _current_logs("streaming") == sorted(
+        [(name, "1", False) for name in package_names + ["app.new"]]
+        + [("app.other", "2", False)]
+    )
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("layout", ["full", "projection", "concurrent"])
+def test_redelivered_upload(layout):
+    _reset()
+    competitor = _collator(S3_CLIENT, 1, "1", ["app.one", "app.two"], layout)
+    s3_client = CompetingS3Client(S3_CLIENT, CURRENT_PREFIX, competitor.collate)
+
+    # The upload collated by the competitor is not collated twice
+    collator = _collator(s3_client, 1, "1", ["app.one", "app.two"], layout)
+    collator.collate()
+    assert collator.write_attempts == 2
+    assert collator.new_logs_count == 0
+    assert _current_logs(layout) == [("app.one", "1", False), ("app.two", "1", False)]
+    assert _diff_logs() == [("app.one", "1", False), ("app.two", "1", False)]
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize(
+    "competitor_segments, max_delta_segments", [(8, 8), (0, 8), (8, 0)]
+)
+def test_redelivered_delta(competitor_segments, max_delta_segments):
+    _reset()
+    _collator(S3_CLIENT, 1, "1", ["app.zero"], "appended_deltas").collate()
+    competitor = _collator(
+        S3_CLIENT, 2, "1", ["app.zero", "app.one"], "appended_deltas"
+    )
+    competitor.max_delta_segments = competitor_segments
+    s3_client = CompetingS3Client(S3_CLIENT, CURRENT_PREFIX, competitor.collate)
+
+    # Appending the changes as a delta, or compacting the deltas, conflicts with the
+    # competitor appending or compacting the same logs, and the redelivered upload is
+    # not collated twice
+    collator = _collator(s3_client, 2, "1", ["app.zero", "app.one"], "appended_deltas")
+    collator.max_delta_segments = max_delta_segments
+    collator.collate()
+    assert collator.write_attempts == 2
+    assert collator.new_logs_count == 0
+    assert _current_logs("appended_deltas") == [
+        ("app.one", "1", False),
+        ("app.zero", "1", False),
+    ]
+    assert _diff_logs() == [("app.one", "1", False), ("app.zero", "1", False)]
+    # The last delta merged by a compaction is left behind
+    key = CURRENT_PREFIX + "logs.parquet"
+    assert len(list_deltas(S3_CLIENT, S3_BUCKET, key)) == 1
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("layout", ["full", "concurrent"])
+def test_competing_diff(layout):
+    _reset()
+    competitor = _collator(S3_CLIENT, 2, "2", ["app.two"], layout)
+    s3_client = CompetingS3Client(S3_CLIENT, DIFF_KEY, competitor.collate)
+
+    # The changes written meanwhile are merged with the changes of the collation, also
+    # when they were read before
+    collator = _collator(s3_client, 1, "1", ["app.one"], layout)
+    collator.collate()
+    assert _diff_logs() == [("app.one", "1", False), ("app.two", "2", False)]
+
+
+@pytest.mark.integration
+def test_max_write_attempts():
+    _reset()
+    competitor = _collator(S3_CLIENT, 2, "2", ["app.two"], "full")
+    s3_client = CompetingS3Client(S3_CLIENT, CURRENT_PREFIX, competitor.collate)
+    collator = _collator(s3_client, 1, "1", ["app.one"], "full")
+    collator.max_write_attempts = 1
+    with pytest.raises(Exception) as ex:
+        collator.collate()
+    assert ex.value.response["Error"]["Code"] == "PreconditionFailed"
+
+
+def _call(item_id, datetime_ms):
+    return {
+        "cached_name": "Deno",
+        "call_type": "1",
+        "datetime": str(datetime_ms),
+        "duration": "3",
+        "item_id": item_id,
+        "phone_number": f"+254 7{item_id:08d}",
+    }
+
+
+@pytest.mark.integration
+def test_competing_partitions():
+    _reset()
+    june = 1466176793178
+    july = june + 30 * 86400 * 1000
+
+    def collator(s3_client, upload, raw_entries):
+        raw_file_key = f"uploads/users/{USER_ID}/unknown/1/call_log/{upload}"
+        S3_CLIENT.put_object(
+            Bucket=S3_BUCKET, Key=raw_file_key, Body=json.dumps(raw_entries)
+        )
+        return CallCollator(
+            s3_client,
+            S3_BUCKET,
+            raw_file_key,
+            USER_ID,
+            "1",
+            datetime.datetime(2023, 9, 1, upload),
+            False,
+            partitioned=True,
+            conditional_writes=True,
+        )
+
+    collator(S3_CLIENT, 1, [_call(1, june), _call(2, july)]).collate()
+    # The competitor collates an upload with call 3 from June, after it is written
+    competitor = collator(
+        S3_CLIENT,
+        3,
+        [_call(1, june), _call(2, july), _call(3, june), _call(4, july)],
+    )
+    s3_client = CompetingS3Client(
+        S3_CLIENT,
+        f"collated_logs/current/call_log/user={USER_ID}/month=2016-07/",
+        competitor.collate,
+    )
+
+    # The June partition is written before the July one conflicts, and its new call
+    # is still part of the changes of the collation
+    raw_entries = [_call(1, june), _call(2, july), _call(3, june), _call(5, july)]
+    collator = collator(s3_client, 2, raw_entries)
+    collator.collate()
+    assert collator.write_attempts == 2
+    # Call 4 is deleted, as it is missing from the upload
+    schema = pa.schema(
+        [pa.field("item_id", pa.int64()), pa.field("is_deleted", pa.bool_())]
+    )
+    current_logs = read_partitions(S3_CLIENT, S3_BUCKET, "call_log", USER_ID, schema)
+    assert sorted(zip(*current_logs.to_pydict().values())) == [
+        (1, False),
+        (2, False),
+        (3, False),
+        (4, False),
+        (4, True),
+        (5, False),
+    ]
+    key = (
+        f"collated_logs/diff/call_log/ts_update=2023-09-01/user={USER_ID}/logs.parquet"
+    )
+    result = S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=key)
+    diff_logs = conform_table(read_table_columns(result["Body"]), schema)
+    assert sorted(zip(*diff_logs.to_pydict().values())) == [
+        (1, False),
+        (2, False),
+        (3, False),
+        (4, False),
+        (4, True),
+        (5, False),
+    ]
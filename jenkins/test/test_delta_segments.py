@@ -0,0 +1,130 @@
+"""
+test_delta_segments.py
+Tests for merging the delta segments of current collated logs, and for collations that
+write them, against the S3 container
+"""
+
+import json
+import os
+
+import boto3
+import lambda_function
+import pyarrow as pa
+import pytest
+from delta_segments import (
+    list_deltas,
+    live_deltas,
+    merged_deltas,
+    next_delta_name,
+    read_current,
+    with_merged_deltas,
+)
+from lambda_function import lambda_handler
+from parquet import table_writer
+from s3_file import delete_objects
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+SCHEMA = pa.schema([pa.field("id", pa.string()), pa.field("item_id", pa.int64())])
+PREFIX = "collated_logs/current/test_delta_segments/user=100/"
+
+
+def _put(key, ids, schema=SCHEMA):
+    table = pa.table({"id": ids, "item_id": range(len(ids))}, schema=schema)
+    S3_CLIENT.put_object(
+        Bucket=S3_BUCKET, Key=key, Body=table_writer(table).to_pybytes()
+    )
+
+
+def _reset(prefix):
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        [key for key, _ in list_deltas(S3_CLIENT, S3_BUCKET, prefix + "logs.parquet")],
+    )
+
+
+def test_merged_deltas():
+    assert merged_deltas(SCHEMA) == set()
+    schema = with_merged_deltas(
+        SCHEMA, [PREFIX + "delta-b.parquet", PREFIX + "delta-a.parquet"]
+    )
+    assert merged_deltas(schema) == {"delta-a.parquet", "delta-b.parquet"}
+    deltas = [(PREFIX + "delta-a.parquet", 10), (PREFIX + "delta-c.parquet", 20)]
+    assert live_deltas(deltas, schema) == [(PREFIX + "delta-c.parquet", 20)]
+
+
+def test_next_delta_name():
+    assert next_delta_name([], None) == "0000000001"
+    deltas = [
+        (PREFIX + "delta-20230901T100000000000-a.parquet", 10),
+        (PREFIX + "delta-0000000002-b.parquet", 20),
+    ]
+    assert next_delta_name(deltas, SCHEMA, "c") == "0000000003-c"
+    # Deltas merged into the current file are counted once deleted
+    schema = with_merged_deltas(SCHEMA, [PREFIX + "delta-0000000004.parquet"])
+    assert next_delta_name(deltas, schema) == "0000000005"
+
+
+@pytest.mark.integration
+def test_read_current():
+    _reset(PREFIX)
+    base_key = PREFIX + "logs.parquet"
+    _put(PREFIX + "delta-20230901T120000000000-b.parquet", ["c"])
+    _put(PREFIX + "delta-20230901T100000000000-a.parquet", ["b"])
+    _put(PREFIX + "delta-20230901T090000000000-z.parquet", ["stale"])
+    _put(PREFIX + "delta-0000000001.parquet", ["d"])
+    # The stale delta was merged into the current file by an interrupted compaction
+    _put(
+        base_key,
+        ["a"],
+        with_merged_deltas(SCHEMA, [PREFIX + "delta-20230901T090000000000-z.parquet"]),
+    )
+
+    # The current file comes first, then the live deltas in the order they were
+    # written, those named by their time before the numbered ones
+    table = read_current(S3_CLIENT, S3_BUCKET, base_key, SCHEMA)
+    assert table.column("id").to_pylist() == ["a", "b", "c", "d"]
+
+
+@pytest.mark.integration
+def test_delta_segments_collation(monkeypatch):
+    monkeypatch.setattr(lambda_function, "DELTA_SEGMENTS", True)
+    prefix = "collated_logs/current/app_packages/user=100/"
+    key = prefix + "logs.parquet"
+    _reset(prefix)
+    S3_CLIENT.copy_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        CopySource={
+            "Bucket": S3_BUCKET,
+            "Key": "existing_test_logs/app_packages/logs.parquet",
+        },
+    )
+    schema = pa.schema(
+        [pa.field("package_name", pa.string()), pa.field("is_deleted", pa.bool_())]
+    )
+
+    # The deletion is appended as a delta, and the current file is left as it is
+    lambda_handler(
+        json.load(open("test_events/test_collation_deletion_event.json")), None
+    )
+    assert len(list_deltas(S3_CLIENT, S3_BUCKET, key)) == 1
+    logs = read_current(S3_CLIENT, S3_BUCKET, key, schema).to_pydict()
+    assert logs == {
+        "package_name": ["app.one", "app.two", "app.three", "app.two"],
+        "is_deleted": [False, False, False, True],
+    }
+
+    # Crossing the delta count merges the deltas into a new current file
+    monkeypatch.setattr(lambda_function, "MAX_DELTA_SEGMENTS", 1)
+    lambda_handler(
+        json.load(open("test_events/test_collation_new_device_event.json")), None
+    )
+    assert list_deltas(S3_CLIENT, S3_BUCKET, key) == []
+    logs = read_current(S3_CLIENT, S3_BUCKET, key, schema).to_pydict()
+    assert logs == {
+        "package_name": ["app.one", "app.two", "app.three", "app.two", "app.three"],
+        "is_deleted": [False, False, False, True, False],
+    }
@@ -0,0 +1,67 @@
+"""
+test_diff_parts.py
+Tests for merging and compacting diff part files, against the S3 container
+"""
+
+import os
+
+import boto3
+import pyarrow as pa
+import pytest
+from diff_parts import compact_diff, compact_diffs, diff_keys, diff_prefix, read_diff
+from parquet import read_table_columns, table_writer
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+SCHEMA = pa.schema([pa.field("id", pa.string()), pa.field("item_id", pa.int64())])
+BATCH_TS = "2023-09-01"
+
+
+def _put(key, ids):
+    table = pa.table({"id": ids, "item_id": range(len(ids))}, schema=SCHEMA)
+    S3_CLIENT.put_object(
+        Bucket=S3_BUCKET, Key=key, Body=table_writer(table).to_pybytes()
+    )
+
+
+def test_diff_prefix():
+    assert (
+        diff_prefix("call_log", BATCH_TS, 100)
+        == "collated_logs/diff/call_log/ts_update=2023-09-01/user=100/"
+    )
+    assert (
+        diff_prefix("call_log", BATCH_TS)
+        == "collated_logs/diff/call_log/ts_update=2023-09-01/"
+    )
+
+
+@pytest.mark.integration
+def test_compact_diff():
+    prefix = diff_prefix("test_diff_parts", BATCH_TS, 100)
+    _put(prefix + "part-20230901T120000000000-b.parquet", ["c"])
+    _put(prefix + "logs.parquet", ["a"])
+    _put(prefix + "part-20230901T100000000000-a.parquet", ["b"])
+
+    # The diff file comes first, then the parts in the order they were written
+    assert diff_keys(S3_CLIENT, S3_BUCKET, "test_diff_parts", BATCH_TS, 100) == [
+        prefix + "logs.parquet",
+        prefix + "part-20230901T100000000000-a.parquet",
+        prefix + "part-20230901T120000000000-b.parquet",
+    ]
+    table = read_diff(S3_CLIENT, S3_BUCKET, "test_diff_parts", BATCH_TS, 100, SCHEMA)
+    assert table.column("id").to_pylist() == ["a", "b", "c"]
+
+    assert compact_diff(S3_CLIENT, S3_BUCKET, "test_diff_parts", BATCH_TS, 100, SCHEMA)
+    assert diff_keys(S3_CLIENT, S3_BUCKET, "test_diff_parts", BATCH_TS, 100) == [
+        prefix + "logs.parquet"
+    ]
+    result = S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=prefix + "logs.parquet")
+    assert read_table_columns(result["Body"]).column("id").to_pylist() == [
+        "a",
+        "b",
+        "c",
+    ]
+
+    # Users without parts are left as they are
+    assert compact_diffs(S3_CLIENT, S3_BUCKET, "test_diff_parts", BATCH_TS, SCHEMA) == 0
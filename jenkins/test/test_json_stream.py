@@ -0,0 +1,92 @@
+"""
+test_json_stream.py
+Tests for the incremental decoding of the JSON arrays of raw uploads
+"""
+
+import gzip
+import io
+import json
+
+import pytest
+from json_stream import iter_json_array, open_gzip_or_plain
+
+ENTRIES = [
+    {
+        "message_body": "Habari yako? éè \U0001f600",
+        "datetime": 1693526400000,
+        "sms_address": "+254 712345678",
+        "item_id": 123456789,
+        "rate": -1.25e-3,
+        "read": True,
+        "thread": None,
+    },
+    [1, 2.5, "three", {"four": []}],
+    'a string with "escapes" \\ and ü',
+    1234567890123,
+    -0.5,
+    False,
+    None,
+]
+
+
+def decode(data, chunk_size=64 * 1024):
+    return list(iter_json_array(open_gzip_or_plain(io.BytesIO(data)), chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64 * 1024])
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_decode(chunk_size, compress, indent):
+    data = json.dumps(ENTRIES, indent=indent, ensure_ascii=False).encode("utf-8")
+    if compress:
+        data = gzip.compress(data)
+    assert decode(data, chunk_size) == ENTRIES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64 * 1024])
+@pytest.mark.parametrize(
+    "data, entries",
+    [
+        (b"[]", []),
+        (b" [ ] \n", []),
+        (b"[12]", [12]),
+        (b"[12, 345 ,6]", [12, 345, 6]),
+        (b"\xef\xbb\xbf[1]", [1]),
+        (b"[1e5, -2]", [1e5, -2]),
+    ],
+)
+def test_decode_edge_cases(chunk_size, data, entries):
+    assert decode(data, chunk_size) == entries == json.loads(data)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64 * 1024])
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"[1,]",
+        b"[1 2]",
+        b"[1",
+        b"[1] 2",
+        b'["unterminated]',
+        b"[1.]",
+    ],
+)
+def test_decode_invalid(chunk_size, data):
+    with pytest.raises(json.decoder.JSONDecodeError):
+        decode(data, chunk_size)
+    with pytest.raises(json.decoder.JSONDecodeError):
+        json.loads(data)
+
+
+def test_decode_not_array():
+    with pytest.raises(json.decoder.JSONDecodeError):
+        decode(b'{"item_id": 1}')
+
+
+def test_decode_lazily():
+    # Entries are yielded before the rest of the stream is read
+    stream = io.BytesIO(json.dumps(list(range(100000))).encode("utf-8"))
+    entries = iter_json_array(open_gzip_or_plain(stream), chunk_size=16)
+    assert next(entries) == 0
+    assert stream.tell() < 100
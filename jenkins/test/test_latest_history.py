@@ -0,0 +1,225 @@
+"""
+test_latest_history.py
+Tests for collations with the latest/history layout, against the S3 container
+"""
+
+import datetime
+import json
+import os
+
+import boto3
+import lambda_function
+import pyarrow as pa
+import pytest
+from app_collator import AppCollator
+from call_collator import CallCollator
+from botocore.exceptions import ClientError
+from lambda_function import lambda_handler
+from latest_history import history_keys, history_prefix, read_full_view, read_latest
+from s3_file import delete_objects
+from sms_collator import SmsCollator
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+SESSION = boto3.session.Session()
+S3_CLIENT = SESSION.client("s3", endpoint_url=os.getenv("S3_ENDPOINT"))
+SCHEMA = pa.schema(
+    [
+        pa.field("package_name", pa.string()),
+        pa.field("device_id", pa.string()),
+        pa.field("is_deleted", pa.bool_()),
+    ]
+)
+
+
+def test_history_prefix():
+    assert (
+        history_prefix("app_packages", 100)
+        == "collated_logs/history/app_packages/user=100/"
+    )
+
+
+def test_latest_history_delta_segments():
+    with pytest.raises(ValueError):
+        AppCollator(
+            None,
+            None,
+            None,
+            100,
+            "1",
+            datetime.datetime(2020, 1, 1),
+            False,
+            delta_segments=True,
+            latest_history=True,
+        )
+
+
+def _run_collation(s3_event):
+    lambda_handler(json.load(open(s3_event)), None)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("projection", [False, True])
+def test_latest_history_collation(monkeypatch, projection):
+    monkeypatch.setattr(lambda_function, "LATEST_HISTORY", True)
+    monkeypatch.setattr(lambda_function, "COLUMN_PROJECTION", projection)
+    key = "collated_logs/current/app_packages/user=100/logs.parquet"
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        history_keys(S3_CLIENT, S3_BUCKET, "app_packages", 100)
+        + ["collated_logs/current/app_packages/user=100/latest.parquet"],
+    )
+    S3_CLIENT.copy_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        CopySource={
+            "Bucket": S3_BUCKET,
+            "Key": "existing_test_logs/app_packages/logs.parquet",
+        },
+    )
+
+    # The full current file is split by the first collation, and the deletion
+    # supersedes the version it deletes
+    _run_collation("test_events/test_collation_deletion_event.json")
+    with pytest.raises(ClientError):
+        S3_CLIENT.get_object(Bucket=S3_BUCKET, Key=key)
+    assert read_latest(
+        S3_CLIENT, S3_BUCKET, "app_packages", 100, SCHEMA
+    ).to_pydict() == {
+        "package_name": ["app.one", "app.three", "app.two"],
+        "device_id": ["1", "1", "1"],
+        "is_deleted": [False, False, True],
+    }
+    assert len(history_keys(S3_CLIENT, S3_BUCKET, "app_packages", 100)) == 1
+
+    # Collations from other devices only add to the latest file
+    _run_collation("test_events/test_collation_new_device_event.json")
+    assert len(history_keys(S3_CLIENT, S3_BUCKET, "app_packages", 100)) == 1
+    full_view = read_full_view(S3_CLIENT, S3_BUCKET, "app_packages", 100, SCHEMA)
+    assert sorted(zip(*full_view.to_pydict().values())) == [
+        ("app.one", "1", False),
+        ("app.three", "1", False),
+        ("app.three", "2", False),
+        ("app.two", "1", False),
+        ("app.two", "1", True),
+    ]
+
+
+def _call(duration):
+    return {
+        "cached_name": "Deno",
+        "call_type": "1",
+        "datetime": "1693526400000",
+        "duration": str(duration),
+        "item_id": 1,
+        "phone_number": "+254 700000001",
+    }
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize(
+    "layout",
+    [
+        {},
+        {"latest_history": True},
+        {"latest_history": True, "projection": True},
+    ],
+)
+def test_latest_history_txt_order(layout):
+    # Calls from two devices share a txt key, and the txt logs hold the last one
+    # collated, also once it is an update of a log collated before the other's
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        history_keys(S3_CLIENT, S3_BUCKET, "call_log", 104)
+        + [
+            "collated_logs/current/call_log/user=104/logs.parquet",
+            "collated_logs/current/call_log/user=104/latest.parquet",
+        ],
+    )
+    for upload, (device_id, duration) in enumerate([("1", 0), ("2", 0), ("1", 1)]):
+        raw_file_key = f"uploads/users/104/unknown/{device_id}/call_log/{upload}"
+        S3_CLIENT.put_object(
+            Bucket=S3_BUCKET, Key=raw_file_key, Body=json.dumps([_call(duration)])
+        )
+        CallCollator(
+            S3_CLIENT,
+            S3_BUCKET,
+            raw_file_key,
+            104,
+            device_id,
+            datetime.datetime(2023, 9, 1, upload),
+            True,
+            **layout,
+        ).collate()
+    result = S3_CLIENT.get_object(
+        Bucket=S3_BUCKET, Key="collated_logs/user-104/device-1/collated_call_log.txt"
+    )
+    assert [log["duration"] for log in json.loads(result["Body"].read())] == [1]
+
+
+def _sms(item_id, datetime_ms, thread_id):
+    return {
+        "thread_id": thread_id,
+        "sms_type": 1,
+        "contact_id": 0,
+        "datetime": datetime_ms,
+        "sms_address": "MPESA",
+        "item_id": item_id,
+        "message_body": f"Message {item_id}",
+    }
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize(
+    "layout",
+    [
+        {},
+        {"latest_history": True},
+        {"latest_history": True, "projection": True},
+    ],
+)
+def test_latest_history_future_sms_txt(layout):
+    # An SMS dated in the future is stored with the time it was collated, so that its
+    # updated version has another txt key, and the txt logs keep both versions
+    delete_objects(
+        S3_CLIENT,
+        S3_BUCKET,
+        history_keys(S3_CLIENT, S3_BUCKET, "sms_log", 104)
+        + [
+            "collated_logs/current/sms_log/user=104/logs.parquet",
+            "collated_logs/current/sms_log/user=104/latest.parquet",
+        ],
+    )
+    future = 4102444800000
+    uploads = [
+        [_sms(1, future, 1)],
+        [_sms(1, future, 2)],
+        [_sms(1, future, 2), _sms(2, 1693526400000, 1)],
+    ]
+    for upload, raw_entries in enumerate(uploads):
+        raw_file_key = f"uploads/users/104/unknown/1/sms_log/{upload}"
+        S3_CLIENT.put_object(
+            Bucket=S3_BUCKET, Key=raw_file_key, Body=json.dumps(raw_entries)
+        )
+        SmsCollator(
+            S3_CLIENT,
+            S3_BUCKET,
+            raw_file_key,
+            104,
+            "1",
+            datetime.datetime(2023, 9, 1, upload + 1),
+            True,
+            **layout,
+        ).collate()
+    result = S3_CLIENT.get_object(
+        Bucket=S3_BUCKET, Key="collated_logs/user-104/device-1/collated_sms_log.txt"
+    )
+    assert [
+        (log["item_id"], log["datetime"], log["thread_id"])
+        for log in json.loads(result["Body"].read())
+    ] == [
+        (1, 1693533600000, 2),
+        (1, 1693530000000, 1),
+        (2, 1693526400000, 1),
+    ]
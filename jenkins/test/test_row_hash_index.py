@@ -0,0 +1,42 @@
+import pytest
+from row_hash_index import ROW_HASH_INDEXES, build_row_hash_index
+
+
+@pytest.mark.parametrize("kind", ROW_HASH_INDEXES)
+def test_row_hash_index_lookup(kind):
+    row_hashes = [
+        "b5601ac2f9b16be883ccd8ad48f1414c",
+        "cea18809ee1d95a3f451fbd4ba6b3a12",
+        "3f9030f867fce09ef6a74e346770137a",
+        "cea18809ee1d95a3f451fbd4ba6b3a12",
+    ]
+    index = build_row_hash_index(row_hashes, kind)
+    assert len(index) == 3
+    for row_hash in row_hashes:
+        assert row_hash in index
+    assert "8a3b87df85c7061f7d7afbe9d227c697" not in index
+    assert "" not in index
+
+
+@pytest.mark.parametrize("kind", ROW_HASH_INDEXES)
+def test_row_hash_index_empty(kind):
+    index = build_row_hash_index([], kind)
+    assert len(index) == 0
+    assert "b5601ac2f9b16be883ccd8ad48f1414c" not in index
+
+
+def test_row_hash_index_unsupported():
+    with pytest.raises(ValueError):
+        build_row_hash_index([], "list")
+
+
+def test_sorted_array_index_fixed_width():
+    row_hashes = [
+        "cea18809ee1d95a3f451fbd4ba6b3a12",
+        "3f9030f867fce09ef6a74e346770137a",
+    ]
+    index = build_row_hash_index(row_hashes * 2, "sorted")
+    assert index._row_hashes.nbytes == 2 * 32
+    assert "cea18809ee1d95a3f451fbd4ba6b3a12" in index
+    assert "cea18809ee1d95a3f451fbd4ba6b3a120" not in index
+    assert "cea18809ee1d95a3f451fbd4ba6b3a1" not in index
@@ -1,6 +1,7 @@
 import datetime
 
 from base_collator import BaseCollator
+from parquet import dicts_to_table
 from sms_collator import SmsCollator
 
 # Sms-specific tests
@@ -266,3 +267,38 @@ def test_sms_collator_future_timestamps():
         },
     ]
     assert BaseCollator.future_timestamp_handler(sms_logs) == corrected_logs
+
+
+def test_sms_collator_batch():
+    raw_entries = [
+        {
+            "contact_id": 0,
+            "datetime": 1487722326477,
+            "item_id": 122,
+            "message_body": "Jambo people",
+            "sms_address": "+075 40269 68",
+            "sms_type": 6,
+            "thread_id": 32,
+        },
+        {"datetime": 1487722326, "item_id": 123, "type": "13"},
+        {
+            "contact_id": 4,
+            "datetime": 4102444800000,
+            "item_id": 124,
+            "message_body": "Ünïcode",
+            "sms_address": "Ünï_Cöde 1",
+            "thread_id": 33,
+        },
+    ]
+    collator = SmsCollator(
+        None, None, None, 123, "456", datetime.datetime(2020, 1, 1), False
+    )
+    collated_entries = []
+    for raw_entry in raw_entries:
+        collated_entry = {"user_id": 123, "device_id": "456", "is_deleted": False}
+        if SmsCollator.collate_entry(collated_entry, raw_entry):
+            collated_entries.append(collated_entry)
+    # Batches are collated the same as each entry on its own
+    assert collator.collate_batch(raw_entries).equals(
+        dicts_to_table(collated_entries, collator.schema)
+    )